@@ -0,0 +1,138 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+import os
+import getopt
+import json
+import statistics
+import subprocess
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_REPEAT = 5
+# Dependencies that should only be imported by the commands that need them
+HEAVY_MODULES = ["scrapy", "twisted", "geopy", "webview", "pyagent.source_apartments_com",
+                 "pyagent.source_craiglist", "pyagent.source_zillow"]
+
+# Start-up paths, each timed in a fresh interpreter
+IMPORTS = {
+    "pyagent": "import pyagent",
+    "main": "import main",
+    "main_gui": "import main, pyagentui",
+    "main_scrape": "import main, pyagent; [pyagent.get_source(key).spider for key in "
+                   "('apartments_com', 'craigslist_bos', 'zillow')]",
+}
+
+# Runs in the child interpreter, times the statement and reports which heavy modules it pulled in
+CHILD_SCRIPT = """
+import sys, time, json
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def print_help() -> None:
+    """
+    Prints the help information
+    :return: None
+    """
+    print()
+    print("Usage: bench_import.py [-h] [-n repeat] [-b names] [-o file]")
+    print()
+    print("Options:")
+    print("\t-h\t\t\tDisplays command help")
+    print("\t-n repeat\tNumber of fresh interpreters per start-up path, default {0}".format(DEFAULT_REPEAT))
+    print("\t-b names\tComma separated start-up paths, default all of: {0}".format(", ".join(IMPORTS)))
+    print("\t-o file\t\tWrite the results to a JSON file")
+    print()
+
+
+def measure(name: str, repeat: int, scratch_dir: str) -> dict:
+    """
+    Times a start-up path in fresh interpreters
+    :param name: The start-up path name
+    :param repeat: Number of interpreters to start
+    :param scratch_dir: Working directory for the children, main.py logs to the current directory
+    :return: Result dict
+    """
+    script = CHILD_SCRIPT.format(repo=REPO_DIR, statement=IMPORTS[name], heavy=HEAVY_MODULES)
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", script], cwd=scratch_dir, check=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL).stdout.decode()
+        child_result = json.loads(output.strip().splitlines()[-1])
+        times.append(child_result["seconds"])
+        loaded = child_result["loaded"]
+    result = {
+        "benchmark": name,
+        "median_seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "loaded": loaded,
+    }
+    print("{0:12.12s} {1:8.1f} ms median  {2:8.1f} ms min  loads: {3}".format(
+        name, result["median_seconds"] * 1000, result["min_seconds"] * 1000, ", ".join(loaded) or "-"), flush=True)
+    return result
+
+
+def main(argv) -> int:
+    try:
+        opts, args = getopt.getopt(argv, "hn:b:o:")
+    except getopt.GetoptError:
+        print_help()
+        return 2
+
+    repeat = DEFAULT_REPEAT
+    names = list(IMPORTS)
+    output_file = None
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+            return 0
+        elif opt == "-n":
+            repeat = int(arg)
+        elif opt == "-b":
+            names = arg.split(",")
+            for name in names:
+                if name not in IMPORTS:
+                    print("Unknown start-up path {0}".format(name))
+                    return 2
+        elif opt == "-o":
+            output_file = arg
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        try:
+            results = [measure(name, repeat, scratch_dir) for name in names]
+        except subprocess.CalledProcessError as e:
+            print("Start-up path failed: {0}".format(e))
+            return 1
+
+    if output_file:
+        with open(output_file, "w") as json_file:
+            json.dump({"python": sys.version, "repeat": repeat, "results": results}, json_file, indent=2)
+        print("Results written to {0}".format(output_file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
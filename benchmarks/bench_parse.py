@@ -0,0 +1,320 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+import os
+import getopt
+import glob
+import json
+import random
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from parsel import Selector
+from pyagent import source_apartments_com, source_craiglist, source_zillow
+
+DEFAULT_REPEAT = 20
+DEFAULT_CARDS = 40
+SEED = 1234
+
+
+def print_help() -> None:
+    """
+    Prints the help information
+    :return: None
+    """
+    print()
+    print("Usage: bench_parse.py [-h] [-d dir] [-n repeat] [-c cards] [-o file]")
+    print()
+    print("Options:")
+    print("\t-h\t\t\tDisplays command help")
+    print("\t-d dir\t\tDirectory of recorded pages, named <page>*.html for the pages: {0}".format(", ".join(PAGES)))
+    print("\t\t\t\tPages without a recording are generated")
+    print("\t-n repeat\tTimes each page is parsed, default {0}".format(DEFAULT_REPEAT))
+    print("\t-c cards\tCards or unit rows per generated page, default {0}".format(DEFAULT_CARDS))
+    print("\t-o file\t\tWrite the results to a JSON file")
+    print()
+
+
+def make_apartments_search(rng: random.Random, cards: int) -> str:
+    placards = "".join(
+        '<li class="mortar-wrapper"><article><div class="property-information-wrapper">'
+        '<span class="availability">{2}</span></div>'
+        '<a class="property-link" href="https://www.apartments.com/apt-{0}/"></a>'
+        '<div class="property-title" title="{0} Main St, Boston, MA 02134"><span>Apt {0}</span></div>'
+        '<div class="property-address" title="{0} Main St, Boston, MA 02134"></div>'
+        '<div class="price-wrapper"><span class="price-range">${1:,}</span></div></article></li>'.format(
+            rng.randint(1, 999), rng.randint(1500, 4000), rng.choice(["Available Now", "Unavailable"]))
+        for _ in range(cards))
+    return ('<html><body><div class="searchResults"><span class="pageRange">Page 1 of 5</span></div>'
+            '<div id="placardContainer"><ul>{0}</ul></div></body></html>'.format(placards))
+
+
+def make_apartments_property(rng: random.Random, cards: int) -> str:
+    rows = "".join(
+        '<tr class="rentalGridRow"><td class="unit"><button> {0} </button></td>'
+        '<td class="rent"> ${1:,} </td><td class="deposit"> $500 </td><td class="sqft"> {2} Sq Ft </td>'
+        '<td class="beds"><span class="longText">{3} Beds</span></td>'
+        '<td class="baths"><span class="longText">{4}½ Baths</span></td></tr>'.format(
+            rng.randint(100, 999), rng.randint(1500, 4000), rng.randint(500, 1500), rng.randint(1, 4),
+            rng.randint(1, 2))
+        for _ in range(cards))
+    return ('<html><body><div class="propertyNameRow"><h1 class="propertyName"> The Apartments </h1></div>'
+            '<div class="propertyAddressRow"><div class="propertyAddress"><h2><span>1 Main St</span> '
+            '<span>Boston</span></h2></div></div>'
+            '<div class="neighborhoodAddress"><a class="neighborhood">Allston</a></div>'
+            '<div class="tabContent"><table class="availabilityTable">{0}</table></div></body></html>'.format(rows))
+
+
+def make_craigslist_search(rng: random.Random, cards: int) -> str:
+    rows = "".join(
+        '<li class="result-row"><h3 class="result-heading">'
+        '<a class="result-title" href="https://boston.craigslist.org/apa/d/{0}.html">2br</a></h3>'
+        '<span class="result-meta"><span class="result-price">${1:,}</span>'
+        '<span class="result-hood"> (Allston) </span></span></li>'.format(rng.randint(10 ** 9, 10 ** 10),
+                                                                          rng.randint(1500, 4000))
+        for _ in range(cards))
+    return '<html><body><ul class="rows">{0}</ul></body></html>'.format(rows)
+
+
+def make_craigslist_post(rng: random.Random, cards: int) -> str:
+    return ('<html><body><div id="map" data-latitude="{0:.6f}" data-longitude="{1:.6f}"></div>'
+            '<section id="postingbody">{2}</section>'
+            '<div class="postinginfos"><p class="postinginfo">post id: {3}</p>'
+            '<p class="postinginfo">posted: 2021-01-01</p></div></body></html>'.format(
+                42.3 + rng.random() / 10, -71.1 + rng.random() / 10, "Sunny two bedroom. " * cards,
+                rng.randint(10 ** 9, 10 ** 10)))
+
+
+def make_zillow_search(rng: random.Random, cards: int) -> str:
+    list_cards = "".join(
+        '<li><article class="list-card"><a class="list-card-link" href="/b/apt-{0}/"></a>'
+        '<address class="list-card-addr">Apt | {0} Beacon St #2, Brookline, MA 02446</address>'
+        '<div class="list-card-price">${1:,}/mo</div><ul class="list-card-details">'
+        '<li>{2} <abbr>bds</abbr></li><li>1 <abbr>ba</abbr></li><li>{3:,} <abbr>sqft</abbr></li></ul>'
+        '</article></li>'.format(rng.randint(1, 999), rng.randint(1500, 4000), rng.randint(1, 4),
+                                 rng.randint(500, 1500))
+        for _ in range(cards))
+    return '<html><body><ul class="photo-cards">{0}</ul></body></html>'.format(list_cards)
+
+
+# The per-query selector code the spiders used before the extraction layer, kept as the baseline
+def parsel_apartments_search(selector: Selector) -> list:
+    selector.css(".searchResults > .pageRange ::text").extract_first()
+    fields = []
+    for placard in selector.css('div#placardContainer > ul > li.mortar-wrapper'):
+        fields.append((placard.css('.property-information-wrapper > .availability ::text').extract_first(),
+                       placard.css('.property-title ::attr(title)').extract_first(),
+                       placard.css('.property-address ::attr(title)').extract_first(),
+                       placard.css('.property-link ::attr(href)').extract_first()))
+    return fields
+
+
+def parsel_apartments_property(selector: Selector) -> list:
+    selector.css(".propertyNameRow > .propertyName ::text").extract_first()
+    selector.css(".propertyAddressRow > .propertyAddress > h2").extract_first()
+    first_tab = selector.css(".tabContent") or selector.css(".availabilityTable")
+    fields = []
+    for unit in first_tab[0].css(".rentalGridRow"):
+        fields.append((unit.css(".rentalGridRow > .unit > button ::text").extract_first(),
+                       unit.css(".rentalGridRow > .unit ::text").extract_first(),
+                       unit.css(".rentalGridRow > .rent ::text").extract_first(),
+                       unit.css(".rentalGridRow > .deposit ::text").extract_first(),
+                       unit.css(".rentalGridRow > .sqft ::text").extract_first(),
+                       unit.css(".rentalGridRow > .beds > .longText ::text").extract_first(),
+                       unit.css(".rentalGridRow > .baths > .longText ::text").extract_first()))
+    return fields
+
+
+def parsel_craigslist_search(selector: Selector) -> list:
+    return [(row.css("span.result-price ::text").extract_first(),
+             row.css("span.result-hood ::text").extract_first(),
+             row.css(".result-heading > a.result-title ::attr(href)").extract_first())
+            for row in selector.css(".rows > .result-row")]
+
+
+def parsel_craigslist_post(selector: Selector) -> list:
+    return [(selector.css("#map ::attr(data-latitude)").extract_first(),
+             selector.css("#map ::attr(data-longitude)").extract_first(),
+             selector.css("p.postinginfo ::text").extract())]
+
+
+def parsel_zillow_search(selector: Selector) -> list:
+    housing_list = selector.css("ul.photo-cards")
+    housing_list[0].css(".list-card-details > li")
+    return [(card.css(".list-card-addr ::text").extract_first(),
+             card.css(".list-card-link ::attr(href)").extract_first(),
+             card.css(".list-card-price ::text").extract_first(),
+             [detail.extract() for detail in card.css(".list-card-details > li")])
+            for card in housing_list[0].css("article.list-card")]
+
+
+# What the spiders run now
+def fieldset_apartments_search(selector: Selector) -> list:
+    source_apartments_com.PAGE_RANGE.extract(selector.root)
+    return source_apartments_com.PLACARD_FIELDS.extract_each(source_apartments_com.PLACARDS, selector.root)
+
+
+def fieldset_apartments_property(selector: Selector) -> list:
+    root = selector.root
+    source_apartments_com.PROPERTY_FIELDS.extract(root)
+    first_tab = source_apartments_com.UNIT_TABS(root) or source_apartments_com.UNIT_TABLES(root)
+    return source_apartments_com.UNIT_FIELDS.extract_each(source_apartments_com.UNIT_ROWS, first_tab[0])
+
+
+def fieldset_craigslist_search(selector: Selector) -> list:
+    return source_craiglist.RESULT_FIELDS.extract_each(source_craiglist.RESULT_ROWS, selector.root)
+
+
+def fieldset_craigslist_post(selector: Selector) -> list:
+    return [source_craiglist.POST_FIELDS.extract(selector.root)]
+
+
+def fieldset_zillow_search(selector: Selector) -> list:
+    housing_list = source_zillow.HOUSING_LISTS(selector.root)
+    source_zillow.CARD_DETAILS(housing_list[0])
+    return source_zillow.CARD_FIELDS.extract_each(source_zillow.LIST_CARDS, housing_list[0])
+
+
+# page name: (generator, baseline extraction, field set extraction)
+PAGES = {
+    "apartments_search": (make_apartments_search, parsel_apartments_search, fieldset_apartments_search),
+    "apartments_property": (make_apartments_property, parsel_apartments_property, fieldset_apartments_property),
+    "craigslist_search": (make_craigslist_search, parsel_craigslist_search, fieldset_craigslist_search),
+    "craigslist_post": (make_craigslist_post, parsel_craigslist_post, fieldset_craigslist_post),
+    "zillow_search": (make_zillow_search, parsel_zillow_search, fieldset_zillow_search),
+}
+
+
+def load_pages(name: str, record_dir: str, cards: int) -> (list, bool):
+    """
+    Loads the recorded pages for a page type, or generates one
+    :param name: The page name
+    :param record_dir: Directory of recorded pages, or None
+    :param cards: Cards per generated page
+    :return: List of page HTML, and whether they were recorded
+    """
+    if record_dir:
+        paths = sorted(glob.glob(os.path.join(record_dir, name + "*.html")))
+        if paths:
+            pages = []
+            for path in paths:
+                with open(path, "r", encoding="utf-8", errors="replace") as page_file:
+                    pages.append(page_file.read())
+            return pages, True
+    return [PAGES[name][0](random.Random(SEED), cards)], False
+
+
+def time_extraction(pages: list, extract_func, repeat: int) -> (float, float):
+    """
+    Parses and extracts each page repeatedly, the parse is timed apart from the extraction
+    :param pages: List of page HTML
+    :param extract_func: Extraction function taking a selector
+    :param repeat: Times each page is parsed
+    :return: Seconds spent parsing, seconds spent extracting
+    """
+    parse_seconds = 0.0
+    extract_seconds = 0.0
+    for _ in range(repeat):
+        for page in pages:
+            start = time.perf_counter()
+            selector = Selector(text=page)
+            parsed = time.perf_counter()
+            extract_func(selector)
+            parse_seconds += parsed - start
+            extract_seconds += time.perf_counter() - parsed
+    return parse_seconds, extract_seconds
+
+
+def measure(name: str, record_dir: str, repeat: int, cards: int) -> dict:
+    """
+    Compares the per-query selectors with the field sets on a page type
+    :param name: The page name
+    :param record_dir: Directory of recorded pages, or None
+    :param repeat: Times each page is parsed
+    :param cards: Cards per generated page
+    :return: Result dict
+    """
+    _, baseline_func, fieldset_func = PAGES[name]
+    pages, recorded = load_pages(name, record_dir, cards)
+    # Both have to find the same fields, or the comparison means nothing
+    for page in pages:
+        baseline_count = len(baseline_func(Selector(text=page)))
+        fieldset_count = len(fieldset_func(Selector(text=page)))
+        if baseline_count != fieldset_count:
+            raise RuntimeError("{0}: field sets found {1} items, selectors found {2}".format(
+                name, fieldset_count, baseline_count))
+
+    parse_seconds, baseline_seconds = time_extraction(pages, baseline_func, repeat)
+    _, fieldset_seconds = time_extraction(pages, fieldset_func, repeat)
+    page_count = len(pages) * repeat
+    result = {
+        "benchmark": name,
+        "recorded": recorded,
+        "pages": page_count,
+        "parse_seconds": parse_seconds,
+        "selector_seconds": baseline_seconds,
+        "fieldset_seconds": fieldset_seconds,
+        "selector_pages_per_sec": page_count / (parse_seconds + baseline_seconds),
+        "fieldset_pages_per_sec": page_count / (parse_seconds + fieldset_seconds),
+    }
+    print("{0:20.20s} {1:9s} {2:10,.0f} pages/s  {3:10,.0f} pages/s  extraction {4:5.1f}x faster".format(
+        name, "recorded" if recorded else "generated", result["selector_pages_per_sec"],
+        result["fieldset_pages_per_sec"], baseline_seconds / fieldset_seconds if fieldset_seconds > 0 else 0),
+        flush=True)
+    return result
+
+
+def main(argv) -> int:
+    try:
+        opts, args = getopt.getopt(argv, "hd:n:c:o:")
+    except getopt.GetoptError:
+        print_help()
+        return 2
+
+    record_dir = None
+    repeat = DEFAULT_REPEAT
+    cards = DEFAULT_CARDS
+    output_file = None
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+            return 0
+        elif opt == "-d":
+            record_dir = arg
+        elif opt == "-n":
+            repeat = int(arg)
+        elif opt == "-c":
+            cards = int(arg)
+        elif opt == "-o":
+            output_file = arg
+
+    print("{0:20s} {1:9s} {2:>16s}  {3:>16s}".format("page", "source", "selectors", "field sets"))
+    results = [measure(name, record_dir, repeat, cards) for name in PAGES]
+
+    if output_file:
+        with open(output_file, "w") as json_file:
+            json.dump({"python": sys.version, "repeat": repeat, "results": results}, json_file, indent=2)
+        print("Results written to {0}".format(output_file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,292 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+import getopt
+import json
+import math
+import random
+
+DEFAULT_SEED = 1234
+DEFAULT_DUPLICATE_RATE = 0.08
+# Number of recent listings that duplicates are drawn from, keeps memory flat while streaming
+DUPLICATE_POOL_SIZE = 5000
+
+# name, state, center lat, center long, spread in degrees, relative weight, median 2 bed rent, neighborhoods
+CITIES = [
+    ("Boston", "MA", 42.3480, -71.0750, 0.030, 10, 3000,
+     ["Back Bay", "South End", "Fenway", "Allston", "Brighton", "Jamaica Plain", "Dorchester", "Roxbury",
+      "East Boston", "Charlestown", "North End", "South Boston"]),
+    ("Cambridge", "MA", 42.3740, -71.1100, 0.015, 5, 3200,
+     ["Central Square", "Harvard Square", "Kendall Square", "Inman Square", "Porter Square"]),
+    ("Somerville", "MA", 42.3900, -71.1000, 0.012, 4, 2700,
+     ["Davis Square", "Union Square", "Teele Square", "Ball Square"]),
+    ("Brookline", "MA", 42.3320, -71.1250, 0.012, 3, 2900, ["Coolidge Corner", "Brookline Village"]),
+    ("Quincy", "MA", 42.2520, -71.0030, 0.020, 3, 2200, ["Wollaston", "North Quincy", "Quincy Center"]),
+    ("Medford", "MA", 42.4180, -71.1060, 0.015, 2, 2300, ["West Medford", "Medford Hillside"]),
+    ("Newton", "MA", 42.3370, -71.2090, 0.025, 2, 2600, ["Newton Centre", "Newtonville", "Auburndale"]),
+]
+ROADS = ["Main Street", "Beacon Street", "Massachusetts Avenue", "Elm Street", "Highland Avenue", "Washington Street",
+         "Commonwealth Avenue", "Centre Street", "Broadway", "Summer Street", "Harvard Street", "Boylston Street",
+         "Tremont Street", "Cambridge Street", "Pleasant Street", "School Street", "Park Street", "Chestnut Street"]
+LINES = ["Red Line (main)", "Red Line (Braintree)", "Red Line (Ashmont)", "Orange Line", "Blue Line",
+         "Green Line (B)", "Green Line (C)", "Green Line (D)", "Green Line (E)", "Silver Line",
+         "Commuter Rail (Framingham/Worcester Line)", "Commuter Rail (Fitchburg/South Acton Line)"]
+
+# beds, relative weight, rent multiplier of the 2 bed median, mean sqft
+BED_TYPES = [("Studio", 8, 0.62, 450), (1, 25, 0.80, 650), (2, 35, 1.00, 900), (3, 22, 1.30, 1150),
+             (4, 10, 1.60, 1450)]
+SOURCES = ["apartments.com", "craigslist.com", "zillow.com"]
+
+
+def print_help() -> None:
+    """
+    Prints the help information
+    :return: None
+    """
+    print()
+    print("Usage: generate_data.py [-h] [-n count] [-r seed] [-d rate] [-o file] [--stations file] "
+          "[--station-count count]")
+    print()
+    print("Options:")
+    print("\t-h\t\t\t\t\tDisplays command help")
+    print("\t-n count\t\t\tNumber of listings to write, default 1000")
+    print("\t-r seed\t\t\t\tRandom seed, default {0}".format(DEFAULT_SEED))
+    print("\t-d rate\t\t\t\tFraction of listings duplicated across sources, default {0}".format(
+        DEFAULT_DUPLICATE_RATE))
+    print("\t-o file\t\t\t\tListing output file (JSON lines, like scrape_results_N.json)")
+    print("\t--stations file\t\tStation output file (like data/mbta.json)")
+    print("\t--station-count n\tNumber of stations to write, default 150")
+    print()
+
+
+def _pick_weighted(rng: random.Random, items: list, weight_index: int):
+    total = sum(item[weight_index] for item in items)
+    target = rng.uniform(0, total)
+    for item in items:
+        target -= item[weight_index]
+        if target <= 0:
+            return item
+    return items[-1]
+
+
+def _listing_for_source(rng: random.Random, uid: int, source: str, base: dict, duplicate: bool = False) -> dict:
+    """
+    Shapes a listing like the given source's spider would, dropping the fields that source does not provide
+    :param rng: Random generator
+    :param uid: The UID to assign
+    :param source: The source name
+    :param base: The full set of generated fields
+    :param duplicate: True if the listing repeats another, it keeps the unit so the two share an address and unit
+    :return: Listing dict
+    """
+    listing = dict(base)
+    listing["uid"] = uid
+    listing["source"] = source
+    listing["link"] = "https://www.{0}/listing/{1}".format(source, uid)
+    if source == "craigslist.com":
+        listing["deposit"] = None
+        listing["sqft"] = None
+        listing["beds"] = None
+        listing["baths_str"] = None
+        listing["rent"] = str(listing["rent"])
+        if not duplicate:
+            listing["unit"] = 7000000000 + uid
+    elif source == "zillow.com":
+        listing["deposit"] = None
+        if not duplicate:
+            listing["unit"] = None
+        if rng.random() < 0.1:
+            listing["sqft"] = None
+    return listing
+
+
+def generate_listings(count: int, seed: int = DEFAULT_SEED, duplicate_rate: float = DEFAULT_DUPLICATE_RATE):
+    """
+    Generates synthetic scrape results with realistic distributions, one at a time
+    :param count: Number of listings to generate
+    :param seed: Random seed, the same seed always generates the same listings
+    :param duplicate_rate: Fraction of listings that repeat an earlier property from another source
+    :return: Generator of listing dicts, in the format the spiders yield
+    """
+    rng = random.Random(seed)
+    recent = []
+    for uid in range(1, count + 1):
+        if recent and rng.random() < duplicate_rate:
+            # Same property and unit listed again on another site, with a slightly different asking rent
+            base = dict(rng.choice(recent))
+            others = [source for source in SOURCES if source != base["source"]]
+            if isinstance(base["rent"], int):
+                base["rent"] = int(base["rent"] * rng.uniform(0.97, 1.05))
+            yield _listing_for_source(rng, uid, rng.choice(others), base, duplicate=True)
+            continue
+
+        city, state, lat, long, spread, _, median_rent, neighborhoods = _pick_weighted(rng, CITIES, 5)
+        beds, _, rent_factor, mean_sqft = _pick_weighted(rng, BED_TYPES, 1)
+        # Rents are roughly log-normal around the city median
+        rent = int(round(median_rent * rent_factor * math.exp(rng.gauss(0, 0.18)) / 5) * 5)
+        if rng.random() < 0.02:
+            rent = "Call for Rent"
+        sqft = max(250, int(rng.gauss(mean_sqft, mean_sqft * 0.2)))
+        roll = rng.random()
+        if roll < 0.03:
+            sqft = rng.choice([999, 9999])
+        elif roll < 0.15:
+            sqft = None
+        baths = 1.0 if beds in ("Studio", 1) else rng.choice([1.0, 1.0, 1.5, 2.0, 2.0, 2.5])
+        neighborhood = rng.choice(neighborhoods)
+        house_number = str(rng.randint(1, 1500))
+        road = rng.choice(ROADS)
+        unit = rng.choice([None, str(rng.randint(1, 30)), "{0}{1}".format(rng.randint(1, 6), rng.choice("ABCD"))])
+
+        base = {
+            "uid": uid,
+            "address": ", ".join([house_number + " " + road, neighborhood, city, state]),
+            "neighborhood": neighborhood,
+            "suburb": "",
+            "city": city,
+            "state": state,
+            "rent": rent,
+            "deposit": rng.choice([None, None, rent, 0]) if isinstance(rent, int) else None,
+            "sqft": sqft,
+            "beds": beds,
+            "baths_str": baths,
+            "unit": unit,
+            "coordinates": (round(rng.gauss(lat, spread), 6), round(rng.gauss(long, spread * 1.3), 6)),
+            "additional": rng.choice([[], [], ["Condo"], ["Townhome"]]),
+            "link": "",
+            "source": _pick_weighted(rng, [("apartments.com", 5), ("craigslist.com", 2), ("zillow.com", 3)], 1)[0],
+        }
+        listing = _listing_for_source(rng, uid, base["source"], base)
+        # Copies on other sites carry the unit as this source listed it
+        base["unit"] = listing["unit"]
+        if len(recent) < DUPLICATE_POOL_SIZE:
+            recent.append(base)
+        else:
+            recent[rng.randrange(DUPLICATE_POOL_SIZE)] = base
+        yield listing
+
+
+def generate_stations(count: int, seed: int = DEFAULT_SEED) -> list:
+    """
+    Generates synthetic stations in the format of data/mbta.json. Each line is a random walk out from a city center,
+    so stations are strung along lines and cluster downtown like a real network.
+    :param count: Number of stations to generate
+    :param seed: Random seed
+    :return: List of station dicts
+    """
+    rng = random.Random(seed)
+    stations = []
+    per_line = max(1, -(-count // len(LINES)))
+    for line_index, line in enumerate(LINES):
+        _, _, lat, long, _, _, _, _ = CITIES[0] if line_index % 3 else rng.choice(CITIES)
+        heading = rng.uniform(0, 2 * math.pi)
+        step = 0.03 if "Commuter Rail" in line else 0.008
+        for station_index in range(per_line):
+            if len(stations) >= count:
+                break
+            heading += rng.gauss(0, 0.25)
+            lat += math.sin(heading) * step
+            long += math.cos(heading) * step * 1.3
+            lines = [line]
+            if rng.random() < 0.1:
+                lines.append(rng.choice(LINES))
+            stations.append({
+                "name": "{0} {1} Station".format(rng.choice(ROADS).split(" ")[0], line_index * per_line +
+                                                 station_index),
+                "coords": [round(lat, 6), round(long, 6)],
+                "lines": lines
+            })
+    return stations
+
+
+def write_listings(path: str, count: int, seed: int = DEFAULT_SEED,
+                   duplicate_rate: float = DEFAULT_DUPLICATE_RATE) -> None:
+    """
+    Streams synthetic listings to a JSON lines file, in the same format as the scrape results feed
+    :param path: The output file
+    :param count: Number of listings
+    :param seed: Random seed
+    :param duplicate_rate: Fraction of listings duplicated across sources
+    :return: Nothing
+    """
+    with open(path, "w") as output_file:
+        for listing in generate_listings(count, seed, duplicate_rate):
+            output_file.write(json.dumps(listing) + "\n")
+
+
+def write_stations(path: str, count: int, seed: int = DEFAULT_SEED) -> None:
+    """
+    Writes synthetic stations to a JSON file, in the same format as data/mbta.json
+    :param path: The output file
+    :param count: Number of stations
+    :param seed: Random seed
+    :return: Nothing
+    """
+    with open(path, "w") as output_file:
+        json.dump(generate_stations(count, seed), output_file)
+
+
+def main(argv) -> int:
+    try:
+        opts, args = getopt.getopt(argv, "hn:r:d:o:", ["stations=", "station-count="])
+    except getopt.GetoptError:
+        print_help()
+        return 2
+
+    count = 1000
+    seed = DEFAULT_SEED
+    duplicate_rate = DEFAULT_DUPLICATE_RATE
+    output_file = None
+    station_file = None
+    station_count = 150
+    try:
+        for opt, arg in opts:
+            if opt == "-h":
+                print_help()
+                return 0
+            elif opt == "-n":
+                count = int(arg)
+            elif opt == "-r":
+                seed = int(arg)
+            elif opt == "-d":
+                duplicate_rate = float(arg)
+            elif opt == "-o":
+                output_file = arg
+            elif opt == "--stations":
+                station_file = arg
+            elif opt == "--station-count":
+                station_count = int(arg)
+    except ValueError as e:
+        print("Invalid argument: {0}".format(e))
+        return 2
+
+    if not output_file and not station_file:
+        print_help()
+        return 2
+    if output_file:
+        write_listings(output_file, count, seed, duplicate_rate)
+        print("Wrote {0} listings to {1}".format(count, output_file))
+    if station_file:
+        write_stations(station_file, station_count, seed)
+        print("Wrote {0} stations to {1}".format(station_count, station_file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
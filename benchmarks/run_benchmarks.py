@@ -0,0 +1,309 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+import os
+import getopt
+import json
+import logging
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+TRAIN_DATA_FILE = os.path.join(REPO_DIR, "data", "mbta.json")
+
+DEFAULT_SIZES = [1000, 100000]
+SEED = 1234
+
+sys.path.insert(0, REPO_DIR)
+from generate_data import generate_listings, write_listings
+
+# Imported once the working directory has been moved to a scratch directory, since main.py logs to the current
+# directory and the caches use relative paths
+main = None
+pyagent = None
+
+
+def print_help() -> None:
+    """
+    Prints the help information
+    :return: None
+    """
+    print()
+    print("Usage: run_benchmarks.py [-h] [-s sizes] [-b names] [-o file] [-c file] [--no-memory]")
+    print()
+    print("Options:")
+    print("\t-h\t\t\tDisplays command help")
+    print("\t-s sizes\tComma separated listing counts, default {0}".format(",".join(map(str, DEFAULT_SIZES))))
+    print("\t-b names\tComma separated benchmarks to run, default all of: {0}".format(", ".join(BENCHMARKS)))
+    print("\t-o file\t\tResults file, default benchmarks/results/<commit>.json")
+    print("\t-c file\t\tCompare against a previous results file")
+    print("\t--no-memory\tSkip the peak memory pass")
+    print()
+
+
+def make_addresses(count: int, seed: int = SEED) -> list:
+    """
+    Generates deterministic verbose addresses, like the ones found on listing cards
+    :param count: Number of addresses
+    :param seed: Random seed
+    :return: List of address strings
+    """
+    rng = random.Random(seed)
+    formats = ["{0} Main St APT {1}, Boston, MA 02134",
+               "{0} Beacon St #{1}, Brookline, MA 02446",
+               "{0} Elm St FLOOR {1}, Somerville, MA 02144",
+               "{0} Highland Ave, Cambridge, MA 02139"]
+    return [rng.choice(formats).format(rng.randint(1, 999), rng.randint(1, 20)) for _ in range(count)]
+
+
+def bench_criteria(size: int):
+    listings = list(generate_listings(size, SEED))
+
+    def run() -> int:
+        for housing in listings:
+            for criterion in main.housing_criteria:
+                criterion.evaluate(housing[criterion.key])
+        return len(listings)
+    return run
+
+
+def bench_simplify_address(size: int):
+    addresses = make_addresses(size)
+
+    def run() -> int:
+        for address in addresses:
+            pyagent.spider.BaseSpider.simplify_address(address)
+        return len(addresses)
+    return run
+
+
+def _fill_location_cache(size: int) -> list:
+    addresses = make_addresses(size)
+    cache = pyagent.LocationCache
+    cache.location_data = {}
+    cache.location_reverse_data = {}
+    cache.location_times = {"forward": {}, "reverse": {}}
+    for idx, address in enumerate(addresses):
+        location = {"lat": 42.0 + idx * 1e-6, "long": -71.0, "house_number": str(idx), "road": "Main Street",
+                    "neighborhood": "", "suburb": "", "city": "Boston", "state": "MA"}
+        cache.add_to_cache(address, location)
+        cache.add_to_reverse_cache([location["lat"], location["long"]], location)
+    return addresses
+
+
+def bench_cache_save(size: int):
+    _fill_location_cache(size)
+
+    def run() -> int:
+        pyagent.LocationCache.save_cache()
+        return size
+    return run
+
+
+def bench_cache_load(size: int):
+    _fill_location_cache(size)
+    pyagent.LocationCache.save_cache()
+
+    def run() -> int:
+        pyagent.LocationCache.init_cache()
+        return size
+    return run
+
+
+def bench_cache_lookup(size: int):
+    addresses = _fill_location_cache(size)
+    coordinates = [[42.0 + idx * 1e-6, -71.0] for idx in range(size)]
+
+    def run() -> int:
+        for address in addresses:
+            pyagent.LocationCache.get_location(address)
+        for coords in coordinates:
+            pyagent.LocationCache.get_address(coords)
+        return size * 2
+    return run
+
+
+def bench_characterization(size: int):
+    if not os.path.isdir(main.OUTPUT_DIR):
+        os.makedirs(main.OUTPUT_DIR)
+    for cache_file in os.listdir(main.OUTPUT_DIR):
+        os.remove(os.path.join(main.OUTPUT_DIR, cache_file))
+    write_listings(os.path.join(main.OUTPUT_DIR, main.OUTPUT_CACHE_BASE.replace("*", "1")), size, SEED)
+
+    def run() -> int:
+        if not main.perform_characterization():
+            raise RuntimeError("Characterization failed")
+        return size
+    return run
+
+
+BENCHMARKS = {
+    "criteria": bench_criteria,
+    "simplify_address": bench_simplify_address,
+    "cache_save": bench_cache_save,
+    "cache_load": bench_cache_load,
+    "cache_lookup": bench_cache_lookup,
+    "characterization": bench_characterization,
+}
+
+
+def measure(name: str, size: int, do_memory: bool) -> dict:
+    """
+    Runs a benchmark once for timing, and optionally again under tracemalloc for peak memory
+    :param name: The benchmark name
+    :param size: The input size
+    :param do_memory: Whether to measure peak memory
+    :return: Result dict
+    """
+    run = BENCHMARKS[name](size)
+    start = time.perf_counter()
+    items = run()
+    seconds = time.perf_counter() - start
+
+    peak_memory = None
+    if do_memory:
+        # Setup allocations are excluded, only what the benchmarked code allocates counts
+        run = BENCHMARKS[name](size)
+        tracemalloc.start()
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    result = {
+        "benchmark": name,
+        "size": size,
+        "seconds": seconds,
+        "items_per_sec": items / seconds if seconds > 0 else None,
+        "peak_memory_bytes": peak_memory,
+    }
+    print("{0:18.18s} {1:>9d}  {2:10.4f} s  {3:14,.0f} items/s  {4}".format(
+        name, size, seconds, result["items_per_sec"] or 0,
+        "{0:,.1f} MiB peak".format(peak_memory / 1048576) if peak_memory is not None else ""), flush=True)
+    return result
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: list, baseline_file: str) -> None:
+    """
+    Prints the change in throughput and memory against a previous results file
+    :param results: The current results
+    :param baseline_file: Path to a previous results file
+    :return: Nothing
+    """
+    with open(baseline_file, "r") as json_file:
+        baseline = json.load(json_file)
+    baseline_results = {(item["benchmark"], item["size"]): item for item in baseline["results"]}
+    print()
+    print("Compared to {0} ({1}):".format(baseline.get("commit"), baseline_file))
+    for result in results:
+        old = baseline_results.get((result["benchmark"], result["size"]))
+        if not old or not old["items_per_sec"] or not result["items_per_sec"]:
+            continue
+        line = "{0:18.18s} {1:>9d}  throughput x{2:.2f}".format(result["benchmark"], result["size"],
+                                                                 result["items_per_sec"] / old["items_per_sec"])
+        if old["peak_memory_bytes"] and result["peak_memory_bytes"]:
+            line += "  memory x{0:.2f}".format(result["peak_memory_bytes"] / old["peak_memory_bytes"])
+        print(line)
+
+
+def main_bench(argv) -> int:
+    global main, pyagent
+    try:
+        opts, args = getopt.getopt(argv, "hs:b:o:c:", ["no-memory"])
+    except getopt.GetoptError:
+        print_help()
+        return 2
+
+    sizes = DEFAULT_SIZES
+    names = list(BENCHMARKS)
+    output_file = None
+    compare_file = None
+    do_memory = True
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+            return 0
+        elif opt == "-s":
+            sizes = [int(size) for size in arg.split(",")]
+        elif opt == "-b":
+            names = arg.split(",")
+            for name in names:
+                if name not in BENCHMARKS:
+                    print("Unknown benchmark {0}".format(name))
+                    return 2
+        elif opt == "-o":
+            output_file = os.path.abspath(arg)
+        elif opt == "-c":
+            compare_file = os.path.abspath(arg)
+        elif opt == "--no-memory":
+            do_memory = False
+
+    commit = get_commit()
+    if output_file is None:
+        output_file = os.path.join(RESULTS_DIR, "{0}.json".format(commit))
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        os.chdir(scratch_dir)
+        import main as pyagent_main
+        import pyagent as pyagent_package
+        main = pyagent_main
+        pyagent = pyagent_package
+        logging.disable(logging.WARNING)
+
+        with open(TRAIN_DATA_FILE, "r") as train_file:
+            main.train_data = json.load(train_file)
+        pyagent.set_train_data(main.train_data)
+
+        for size in sizes:
+            for name in names:
+                results.append(measure(name, size, do_memory))
+        os.chdir(REPO_DIR)
+
+    if not os.path.isdir(os.path.dirname(output_file)):
+        os.makedirs(os.path.dirname(output_file))
+    with open(output_file, "w") as json_file:
+        json.dump({
+            "commit": commit,
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results
+        }, json_file, indent=2)
+    print("Results written to {0}".format(output_file))
+
+    if compare_file:
+        compare(results, compare_file)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_bench(sys.argv[1:]))
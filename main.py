@@ -24,14 +24,15 @@ from logging.handlers import RotatingFileHandler
 import os
 import glob
 import pyagent
-import pyagentui
 import json
-import importlib
+import importlib.util
 import random
 import haversine
 import hashlib
+import time
+import signal
+import threading
 from base64 import b64encode
-from scrapy.crawler import CrawlerProcess
 
 has_browsers_file = False
 
@@ -46,10 +47,45 @@ regular_filter = None
 CONFIG_FILE = "options.ini"
 OUTPUT_DIR = "output"
 OUTPUT_CACHE_BASE = "scrape_results_*.json"
-CHAR_OUTPUT_FILE = "output/characterization.json"
+# Also matches compressed scrape results
+OUTPUT_CACHE_GLOB = OUTPUT_CACHE_BASE + "*"
+CHAR_OUTPUT_FILE = "output/characterization.dat"
+GEOCODE_STATS_FILE = "output/geocode_stats.json"
+HTTP_CACHE_DIR = "cache/http"
+THROTTLE_STATE_DIR = "cache/throttle"
+STATION_INDEX_FILE = "data/stations.idx"
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8080
+# Listing fields whose values are stored in the characterization file, for the web page's filters and source list
+FILTER_CHOICE_FIELDS = ("neighborhood", "suburb", "city", "source")
 
 scrape_website_list = []
 train_data = None
+# Multi-region scraping, maps region name to {source key: source config}
+scrape_regions = {}
+scrape_parallelism = 1
+# Shared detail page frontier, empty to scrape detail pages in-process
+frontier_uri = ""
+frontier_lease = pyagent.frontier.DEFAULT_LEASE
+# Compression codec for scrape results and the characterization file
+output_compression = pyagent.compression.COMPRESSION_NONE
+# Base config of each enabled source
+source_configs = {}
+# Daemon mode schedule, default seconds between scrapes and per source overrides
+daemon_interval = pyagent.daemon.DEFAULT_INTERVAL
+daemon_intervals = {}
+metrics_textfile = ""
+metrics_port = 0
+# HTTP response cache, default seconds until a cached page expires (0 never expires) and per source overrides
+http_cache_enabled = False
+http_cache_expiry = 24 * 60 * 60
+http_cache_expiries = {}
+# Only parse cached pages, without any network traffic
+http_cache_offline = False
+# Adaptive throttle, limits for every source and per source overrides
+throttle_enabled = True
+throttle_limits = {}
+throttle_source_limits = {}
 
 housing_criteria = [pyagent.CriterionLesser(name="Rent", key="rent", weight=100, lower=1500,
                                             result_format=pyagent.ResultFormat.Currency, upper=2500),
@@ -90,6 +126,15 @@ def generate_uid(address, unit) -> str:
     return hashlib.sha256(s + p).hexdigest()
 
 
+def listing_id(housing: dict) -> str:
+    """
+    Gets the stable ID of a listing, the same across scrapes
+    :param housing: The listing
+    :return: Listing ID
+    """
+    return generate_uid(housing["address"], housing["unit"])
+
+
 def setup_logger():
     global regular_filter
 
@@ -121,14 +166,28 @@ def print_help() -> None:
     :return: None
     """
     print()
-    print("Usage: pyagent [-h] [-v level] [-s] [--gui]")
+    print("Usage: pyagent [-h] [-v level] [-s [--offline]] [--worker] [--daemon] [--gui] [--serve [--host address] "
+          "[--port port]] [--import-gtfs dir[,dir...]] [--stats] [--import-cache file[,file...] [--merge-policy policy]] "
+          "[--export-cache file]")
     print()
     print("Options:")
     print("\t-h\t\t\tDisplays command help")
     print("\t-v level\tEnables verbose output, 1 is only info, 2 is debug")
     print("\t-s\t\t\tScrapes the enabled websites and caches the results")
     print("\t-n\t\t\tDo not perform characterization")
+    print("\t--offline\tScrape only pages in the HTTP cache, without any network traffic")
+    print("\t--worker\tScrape detail pages from the shared frontier of a running scrape")
+    print("\t--daemon\tKeep running, scraping each source on the schedule in the [daemon] section")
     print("\t--gui\t\tOpen the characterization UI. Mutually exclusive with scraping.")
+    print("\t--serve\t\tServe the characterization UI over HTTP instead of opening a window")
+    print("\t--host addr\tAddress to serve on, default {0}".format(SERVE_HOST))
+    print("\t--port port\tPort to serve on, default {0}".format(SERVE_PORT))
+    print("\t--import-gtfs dirs\tBuild the station index from GTFS feed directories, separated by commas")
+    print("\t--stats\t\tPrint the market statistics of each neighborhood, suburb and city")
+    print("\t--import-cache files\tMerge location cache snapshots into the location cache, separated by commas")
+    print("\t--merge-policy policy\tHow imported entries replace cached ones, {0} (default) or {1}".format(
+        pyagent.cache.MERGE_POSITIVE, pyagent.cache.MERGE_NEWEST))
+    print("\t--export-cache file\tWrite the location cache to a snapshot, after any import")
     print()
     print("\tSee options.ini for scrape-able websites.")
     print()
@@ -159,7 +218,7 @@ def get_latest_cache(caches: list) -> (str, int):
     max_index = 1
     max_cache_name = ""
     for cache in caches:
-        cache = cache.split("\\")[1]
+        cache = os.path.basename(cache)
         num_pos = OUTPUT_CACHE_BASE.find("*")
         num_str = cache[num_pos:]
         num_end = 0
@@ -199,12 +258,12 @@ def get_nearby_trains(location, radius_mi: float):
                     lines_to_add = ["Commuter Rail"]
                 elif "Silver Line" in line:
                     lines_to_add = ["Silver Line"]
-                elif "Green Line" in line:
+                elif "Green Line" in line and "(" in line:
                     line_branches = line[line.find("(") + 1:line.find(")")]
                     branch_tokens = line_branches.split(",")
                     for branch in branch_tokens:
                         lines_to_add.append("Green Line (" + branch.replace(" ", "") + ")")
-                elif "Red Line" in line:
+                elif "Red Line" in line and "(" in line:
                     line_branches = line[line.find("(") + 1:line.find(")")]
                     branch_tokens = line_branches.split(",")
                     for branch in branch_tokens:
@@ -221,76 +280,393 @@ def get_nearby_trains(location, radius_mi: float):
     return nearby_stations
 
 
-def perform_scrape() -> bool:
+def get_crawler_settings() -> dict:
     """
-    Performs a scrape of the supported and enabled websites.
-    :return: True if successfully scraped all websites, false if otherwise
+    Builds the scrapy settings shared by every crawl, without the output feed
+    :return: Crawler settings
     """
-    logging.info("Performing scrape of sources specified in {0}".format(CONFIG_FILE))
-    logger.debug("Scraping the following sources: {0}".format(", ".join(scrape_website_list)))
+    crawler_settings = {
+        'FEED_EXPORTERS': dict(pyagent.compression.FEED_EXPORTERS),
+        # Only used with the adaptive throttle turned off, otherwise it sets the delay of each source
+        'DOWNLOAD_DELAY': 1,
+        'DOWNLOADER_MIDDLEWARES': {"pyagent.throttle.AdaptiveThrottleMiddleware": 950},
+        'PYAGENT_THROTTLE_ENABLED': throttle_enabled,
+        'PYAGENT_THROTTLE_LIMITS': dict(throttle_limits),
+        'PYAGENT_THROTTLE_STATE_DIR': os.path.abspath(THROTTLE_STATE_DIR),
+        # Read by shard workers, offline scrapes only geocode from the location cache
+        'PYAGENT_GEOCODE_CACHE_ONLY': http_cache_offline,
+        'LOG_LEVEL': 'WARNING',
+        'DOWNLOADER_CLIENT_TLS_METHOD': "TLSv1.2"       # for craigslist?
+    }
+    # Get a header
+    if has_browsers_file:
+        crawler_settings["DEFAULT_REQUEST_HEADERS"] = random.choice(browsers.header_list)
+    else:
+        logger.warning("You have not provided any headers! Your scrape requests may get blocked. Please see README for "
+                       "information.")
+        crawler_settings["USER_AGENT"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:84.0) Gecko/20100101 Firefox/84.0"
+    # Response cache, compressed on disk. Pages are cached under their URL without volatile query parameters.
+    if http_cache_enabled or http_cache_offline:
+        crawler_settings.update({
+            'HTTPCACHE_ENABLED': True,
+            'HTTPCACHE_DIR': os.path.abspath(HTTP_CACHE_DIR),
+            'HTTPCACHE_STORAGE': "pyagent.httpcache.NormalizedFilesystemCacheStorage",
+            'HTTPCACHE_GZIP': True,
+            'HTTPCACHE_EXPIRATION_SECS': 0 if http_cache_offline else http_cache_expiry,
+            # Blocked and failed pages are fetched again next time
+            'HTTPCACHE_IGNORE_HTTP_CODES': [403, 429, 500, 502, 503, 504],
+            'HTTPCACHE_IGNORE_MISSING': http_cache_offline,
+        })
+    return crawler_settings
+
+
+def get_source_settings(source_key: str) -> dict:
+    """
+    Gets the scrapy settings specific to a source, its custom headers, response cache expiry and throttle limits
+    :param source_key: The source key
+    :return: Scrapy settings
+    """
+    source_settings = {"PYAGENT_THROTTLE_KEY": source_key}
+    if source_key in throttle_source_limits:
+        source_settings["PYAGENT_THROTTLE_SOURCE_LIMITS"] = dict(throttle_source_limits[source_key])
+    if has_browsers_file and source_key in browsers.headers_per_source:
+        source_settings["DEFAULT_REQUEST_HEADERS"] = random.choice(browsers.headers_per_source[source_key])
+    if source_key in http_cache_expiries and not http_cache_offline:
+        source_settings["HTTPCACHE_EXPIRATION_SECS"] = http_cache_expiries[source_key]
+    return source_settings
 
-    pyagent.init_sources()
 
-    # Get the most recent cache
+def get_enabled_scrapy_sources() -> list:
+    """
+    Gets the enabled sources that are scraped with scrapy. Only these spiders are imported.
+    :return: List of sources
+    """
+    sources = []
+    for source_key in scrape_website_list:
+        source = pyagent.get_source(source_key)
+        if isinstance(source.spider, pyagent.ScrapySpider):
+            sources.append(source)
+    return sources
+
+
+def apply_source_settings(source) -> None:
+    """
+    Sets a source's own settings on its spider, if it has any
+    :param source: The source
+    :return: Nothing
+    """
+    if not source.spider.scrapy_spider.custom_settings:
+        source.spider.scrapy_spider.custom_settings = {}
+    source.spider.scrapy_spider.custom_settings.update(get_source_settings(source.key))
+
+
+def get_next_cache_path() -> str:
+    """
+    Gets the path of the next scrape results file
+    :return: Path to the scrape results file
+    """
     cache_index = 0
     if not os.path.isdir(OUTPUT_DIR):
         logger.debug("Folder {0} does not exist, so it was created".format(OUTPUT_DIR))
         os.makedirs(OUTPUT_DIR)
     else:
-        cache_files = glob.glob(OUTPUT_DIR + "/" + OUTPUT_CACHE_BASE)
+        cache_files = glob.glob(OUTPUT_DIR + "/" + OUTPUT_CACHE_GLOB)
         _, cache_index = get_latest_cache(cache_files)
-    cache_path = OUTPUT_DIR + "\\" + OUTPUT_CACHE_BASE.replace("*", str(cache_index+1))
+    return OUTPUT_DIR + "/" + OUTPUT_CACHE_BASE.replace("*", str(cache_index+1)) + \
+        pyagent.compression.EXTENSIONS[output_compression]
+
+
+def perform_scrape() -> bool:
+    """
+    Performs a scrape of the supported and enabled websites.
+    :return: True if successfully scraped all websites, false if otherwise
+    """
+    logging.info("Performing scrape of sources specified in {0}".format(CONFIG_FILE))
+    logger.debug("Scraping the following sources: {0}".format(", ".join(scrape_website_list)))
+
+    if scrape_regions:
+        return perform_region_scrape()
+
+    from scrapy.crawler import CrawlerProcess
+    pyagent.init_sources(scrape_website_list)
+
+    # Get the most recent cache
+    cache_path = get_next_cache_path()
 
     # Crawler settings
-    crawler_settings ={
-        "FEEDS": {
-            cache_path: {"format": "jsonlines"},
-        },
-        'DOWNLOAD_DELAY': 1,
-        'LOG_LEVEL': 'WARNING',
-        'DOWNLOADER_CLIENT_TLS_METHOD': "TLSv1.2"       # for craigslist?
+    crawler_settings = get_crawler_settings()
+    crawler_settings["FEEDS"] = {
+        cache_path: {"format": pyagent.compression.FEED_FORMATS[output_compression]},
     }
-    # Get a header
-    if has_browsers_file:
-        headers = random.choice(browsers.header_list)
-        crawler_settings["DEFAULT_REQUEST_HEADERS"] = headers
-        # Set custom headers for each source that has them
-        for source in pyagent.get_source_list():
-            if isinstance(source.spider, pyagent.ScrapySpider):
-                source_key = source.key
-                if source_key in browsers.headers_per_source:
-                    source_header = random.choice(browsers.headers_per_source[source_key])
-                    if not source.spider.scrapy_spider.custom_settings:
-                        source.spider.scrapy_spider.custom_settings = {}
-                    source.spider.scrapy_spider.custom_settings["DEFAULT_REQUEST_HEADERS"] = source_header
-    else:
-        logger.warning("You have not provided any headers! Your scrape requests may get blocked. Please see README for "
-                       "information.")
-        crawler_settings["USER_AGENT"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:84.0) Gecko/20100101 Firefox/84.0"
+    # Set custom headers and cache expiry for each source that has them
+    for source in get_enabled_scrapy_sources():
+        apply_source_settings(source)
+
+    # Detail pages go through the shared frontier, so workers started with --worker can help
+    frontier = None
+    if frontier_uri:
+        frontier = pyagent.open_frontier(frontier_uri, frontier_lease)
+        if frontier is None:
+            return False
+        frontier.reset()
 
     # Crawl scrapy sources
     process = CrawlerProcess(crawler_settings)
-    for source in pyagent.get_source_list():
-        if isinstance(source.spider, pyagent.ScrapySpider):
-            if source.key in scrape_website_list:
-                logger.debug("Scraping source: {0} ({1})".format(source.name, source.key))
-                process.crawl(source.spider.scrapy_spider)
-            else:
-                logger.debug("Skipping source: {0}".format(source.name))
-    process.start()
+    for source in get_enabled_scrapy_sources():
+        logger.debug("Scraping source: {0} ({1})".format(source.name, source.key))
+        if frontier is not None:
+            source.spider.set_frontier(frontier)
+        crawler = process.create_crawler(source.spider.scrapy_spider)
+        pyagent.metrics.instrument_crawler(crawler)
+        process.crawl(crawler)
+    with pyagent.metrics.stage_duration.time(stage="crawl"):
+        process.start()
+
+    if frontier is not None:
+        # Listings scraped by workers, their UIDs are only unique within the worker
+        worker_listings = 0
+        with pyagent.compression.open_compressed(cache_path, "a") as cache_file:
+            for housing in frontier.results():
+                housing["uid"] = pyagent.spider.BaseSpider.get_next_uid()
+                cache_file.write(pyagent.serialize.dumps(housing) + "\n")
+                worker_listings += 1
+        for source in get_enabled_scrapy_sources():
+            failed = frontier.failed(source.spider.scrapy_spider.name)
+            if failed:
+                logger.warning("{0} detail pages from {1} could not be scraped".format(len(failed), source.name))
+        frontier.close()
+        logger.info("Added {0} listings scraped by workers".format(worker_listings))
 
     logger.info("Finished scrape of specified sources")
 
     return True
 
 
+def perform_worker_scrape() -> bool:
+    """
+    Scrapes detail pages from the frontier of a scrape running elsewhere, until it has drained
+    :return: True if the worker ran, false if otherwise
+    """
+    if not frontier_uri:
+        logger.critical("Worker mode requires a frontier, see the [frontier] section of {0}".format(CONFIG_FILE))
+        return False
+    frontier = pyagent.open_frontier(frontier_uri, frontier_lease)
+    if frontier is None:
+        return False
+    logger.info("Working on frontier {0} as {1}".format(frontier_uri, pyagent.frontier.worker_id()))
+
+    from scrapy.crawler import CrawlerProcess
+    pyagent.init_sources(scrape_website_list)
+    crawler_settings = get_crawler_settings()
+    # Listings go back to the coordinator through the frontier instead of a feed
+    crawler_settings["ITEM_PIPELINES"] = {"pyagent.frontier.FrontierResultPipeline": 100}
+    process = CrawlerProcess(crawler_settings)
+    for source in get_enabled_scrapy_sources():
+        if not source.spider.set_frontier(frontier, worker=True):
+            logger.debug("Source {0} does not use the frontier".format(source.name))
+            continue
+        apply_source_settings(source)
+        crawler = process.create_crawler(source.spider.scrapy_spider)
+        pyagent.metrics.instrument_crawler(crawler)
+        process.crawl(crawler)
+    with pyagent.metrics.stage_duration.time(stage="crawl"):
+        process.start()
+    frontier.close()
+
+    logger.info("Frontier drained, worker finished")
+    return True
+
+
+def perform_region_scrape() -> bool:
+    """
+    Scrapes every region/source pair in its own worker process, then merges the shards into one scrape results file
+    :return: True if every shard was scraped, false if otherwise
+    """
+    cache_path = get_next_cache_path()
+    shard_dir = os.path.join(OUTPUT_DIR, "shards", os.path.splitext(os.path.basename(cache_path))[0])
+    if not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+
+    crawler_settings = get_crawler_settings()
+    shards = []
+    for region, sources in scrape_regions.items():
+        for source_key, source_config in sources.items():
+            shards.append(pyagent.ScrapeShard(source_key, region, source_config,
+                                              os.path.join(shard_dir, "{0}@{1}.json".format(source_key, region)),
+                                              crawler_settings, get_source_settings(source_key)))
+    if not shards:
+        logger.error("No enabled sources are configured for any region")
+        return False
+    logger.info("Scraping {0} shards across {1} regions with {2} workers".format(len(shards), len(scrape_regions),
+                                                                               scrape_parallelism))
+
+    with pyagent.metrics.stage_duration.time(stage="crawl"):
+        results = pyagent.run_shards(shards, scrape_parallelism)
+    with pyagent.metrics.stage_duration.time(stage="merge"):
+        listing_count = pyagent.merge_shards(shards, cache_path)
+    try:
+        os.rmdir(shard_dir)
+    except OSError:
+        pass
+
+    failed = [result["shard"] for result in results if not result["success"]]
+    logger.info("Finished scrape of specified sources, merged {0} listings into {1}".format(listing_count, cache_path))
+    if failed:
+        logger.error("The following shards failed: {0}".format(", ".join(failed)))
+        return False
+    return True
+
+
+def load_scrape_results(cache_name: str) -> list:
+    """
+    Loads a scrape results file, with any daemon deltas written on top of it applied
+    :param cache_name: The scrape results file
+    :return: List of listings
+    """
+    with pyagent.compression.open_compressed(cache_name, "r") as cache_file:
+        housing_data = [pyagent.Listing.from_dict(pyagent.serialize.loads(jline)) for jline in cache_file]
+    deltas = list(pyagent.daemon.read_deltas(cache_name))
+    if deltas:
+        state = pyagent.ListingState(listing_id)
+        state.load(housing_data)
+        for delta in deltas:
+            state.apply(delta)
+        housing_data = [housing for _, housing in state.items()]
+        logger.debug("Applied {0} deltas to {1}".format(len(deltas), cache_name))
+    return housing_data
+
+
+def update_market_stats(cache_name: str, housing_data: list, delta_path: str = None) -> None:
+    """
+    Adds a scrape run to the market statistics, unless it has been added already
+    :param cache_name: The scrape results file of the run
+    :param housing_data: The run's listings
+    :param delta_path: The delta file of the run, if it was a daemon cycle on top of the scrape results file
+    :return: Nothing
+    """
+    market_stats = pyagent.MarketStats.load()
+    run_id = os.path.basename(cache_name)
+    if delta_path:
+        # Delta file names repeat across scrape results files
+        run_id = "{0}/{1}".format(run_id, os.path.basename(delta_path))
+    if market_stats.has_run(run_id):
+        return
+    with pyagent.metrics.stage_duration.time(stage="stats"):
+        market_stats.ingest(housing_data, run_id)
+    try:
+        market_stats.save()
+    except OSError as e:
+        logger.error("Failed to write market statistics: {0}".format(e))
+
+
+def transfer_location_cache(import_paths: list, export_path: str, policy: str) -> bool:
+    """
+    Merges location cache snapshots into the location cache, then writes the result to a snapshot. Importing several
+    snapshots and exporting merges caches from several machines into one.
+    :param import_paths: Snapshots to merge, in order
+    :param export_path: The snapshot to write, empty to not write one
+    :param policy: The merge policy, one of pyagent.cache.MERGE_POLICIES
+    :return: True if every snapshot was imported and the export was written, false if otherwise
+    """
+    for path in import_paths:
+        start = time.perf_counter()
+        try:
+            changed = pyagent.LocationCache.import_snapshot(path, policy)
+        except (OSError, ValueError) as e:
+            logger.critical("Failed to import location cache snapshot {0}: {1}".format(path, e))
+            return False
+        logger.info("Imported {0} location cache entries from {1} in {2:.2f}s".format(
+            changed, path, time.perf_counter() - start))
+    if export_path:
+        try:
+            count = pyagent.LocationCache.export_snapshot(export_path)
+        except OSError as e:
+            logger.critical("Failed to export location cache to {0}: {1}".format(export_path, e))
+            return False
+        logger.info("Exported {0} location cache entries to {1}".format(count, export_path))
+    return True
+
+
+def print_market_stats() -> bool:
+    """
+    Prints the market statistics of each neighborhood, suburb and city
+    :return: True if there were statistics to print, false if otherwise
+    """
+    market_stats = pyagent.MarketStats.load()
+    if not market_stats.runs:
+        logger.info("There are no market statistics yet. Run characterization to add the latest scrape.")
+        return False
+
+    def format_value(value, pattern):
+        return pattern.format(value) if value is not None else "-"
+
+    print("Market statistics from {0} runs, latest {1}".format(len(market_stats.runs), market_stats.runs[-1]))
+    print("{0:<12} {1:<28} {2:>8} {3:>9} {4:>9} {5:>9} {6:>8} {7:>7} {8:>8}".format(
+        "Level", "Name", "Listings", "Rent p25", "Rent p50", "Rent p75", "$/sqft", "Sqft", "Outliers"))
+    for group in market_stats.query():
+        print("{0:<12} {1:<28.28} {2:>8} {3:>9} {4:>9} {5:>9} {6:>8} {7:>7} {8:>8}".format(
+            group["level"], group["name"], group["latest_listings"],
+            format_value(group["rent"]["p25"], "${0:,.0f}"), format_value(group["rent"]["p50"], "${0:,.0f}"),
+            format_value(group["rent"]["p75"], "${0:,.0f}"),
+            format_value(group["rent_per_sqft"]["p50"], "${0:.2f}"), format_value(group["sqft"]["p50"], "{0:.0f}"),
+            group["outliers"]["rent"] + group["outliers"]["fake_sqft"]))
+    return True
+
+
+def characterize_housing(housing) -> (pyagent.ListingResult, dict):
+    """
+    Scores a listing against the housing criteria
+    :param housing: The listing, a Listing or its dict form
+    :return: The result summary, and the characterization file entry
+    """
+    criterion_results = []
+    # Each criterion's result out of its weight, so the listing can be scored again with other weights
+    criterion_scores = []
+    total = 0
+    possible_points = 0
+    for criterion in housing_criteria:
+        if criterion.key not in housing:
+            logger.error("Invalid key '{0}' for criterion {1}".format(criterion.key, criterion.name))
+        result = criterion.evaluate(housing[criterion.key])
+        criterion_results.append((criterion, result, criterion.result_info))
+        if result != -1:
+            total += result
+            possible_points += criterion.weight
+            criterion_scores.append(result / criterion.weight if criterion.weight else 0.0)
+        else:
+            criterion_scores.append(None)
+    score = total / possible_points if possible_points > 0 else 0.0
+    pyagent.metrics.listings_scored.inc()
+
+    # The characterization entry is written out as JSON, so it holds the dict form of the listing
+    return pyagent.ListingResult(housing, criterion_results, total, score, possible_points), {
+        "housing_data": dict(housing),
+        "char_output": {
+            "address": housing["address"],
+            "score": score,
+            "total": total,
+            "possible": possible_points,
+            "scores": criterion_scores,
+            "trains": get_nearby_trains(housing["coordinates"], radius_mi=0.5),
+        },
+    }
+
+
+def get_criteria_meta() -> list:
+    """
+    Gets the name and weight of each housing criterion, in the order of the characterization scores
+    :return: List of {"name", "weight"}
+    """
+    return [{"name": criterion.name, "weight": criterion.weight} for criterion in housing_criteria]
+
+
 def perform_characterization() -> bool:
     """
     Characterizes housing data from latest scrape
     :return: True if successfully characterized, false if otherwise
     """
     # Check for cached scrape data
-    cache_files = glob.glob(OUTPUT_DIR + "/" + OUTPUT_CACHE_BASE)
+    cache_files = glob.glob(OUTPUT_DIR + "/" + OUTPUT_CACHE_GLOB)
     if not cache_files:
         logger.info("There was not cached housing data to characterize. Try running pyagent -s to scrape data.")
         return False
@@ -304,91 +680,60 @@ def perform_characterization() -> bool:
     logger.info("Characterizing housing data from cache '{0}'...".format(cache_name))
 
     try:
-        with open(cache_name, "r") as cache_file:
-            jsonlines = cache_file.readlines()
-            housing_data = [json.loads(jline) for jline in jsonlines]
+        with pyagent.metrics.stage_duration.time(stage="load"):
+            housing_data = load_scrape_results(cache_name)
     except json.decoder.JSONDecodeError as e:
         logger.critical("Failed to read scraped data file: {0}".format(e))
         return False
     except OSError as e:
         logger.critical("Failed to load scrapy data from {0}: {1}".format(cache_name, e))
         return False
+    update_market_stats(cache_name, housing_data)
 
     # Characterize each
     char_results_good = []      # Good apartments
     char_results_bad = []       # Bad apartments (have a 0 in some category)
     char_results_dq = []        # Disqualified apartments
-    char_output = {}            # Dumps to JSON file for GUI
+    filter_choices = {field: set() for field in FILTER_CHOICE_FIELDS}
     total_houses = len(housing_data)
-    used_uids = []
+    try:
+        char_writer = pyagent.CharacterizationWriter(CHAR_OUTPUT_FILE, codec=output_compression,
+                                                     criteria=get_criteria_meta())
+    except OSError as e:
+        logger.error("Failed to write {0}: {1}".format(CHAR_OUTPUT_FILE, e))
+        return False
+    used_uids = set()
+    characterize_start = time.perf_counter()
+    write_time = 0.0
     for housing in housing_data:
-        result_dict = {
-            "uid": -1,
-            "address": housing["address"],
-            "link": housing["link"],
-            "source": housing["source"],
-            "unit": housing["unit"],
-            "criterion": [],
-            "TOTAL": 0.0,
-            "SCORE": 0.0,
-            "POSSIBLE_POINTS": 0.0
-        }
-        output_data = {
-            "address": "",
-            "score": 0.0,
-            "total": 0.0,
-            "possible": 0.0,
-            "trains": []
-        }
-        total = 0
-        possible_points = 0
-        for criterion in housing_criteria:
-            if criterion.key not in housing:
-                logger.error("Invalid key '{0}' for criterion {1}".format(criterion.key, criterion.name))
-            result = criterion.evaluate(housing[criterion.key])
-            result_dict["criterion"].append([criterion, result, criterion.result_info])
-            if result != -1:
-                total += result
-                possible_points += criterion.weight
-        result_dict["TOTAL"] = total
-        if possible_points > 0:
-            result_dict["SCORE"] = total / possible_points
-        else:
-            result_dict["SCORE"] = 0.0
-        result_dict["POSSIBLE_POINTS"] = possible_points
-        result_dict["uid"] = housing["uid"]
+        listing_result, char_entry = characterize_housing(housing)
         if housing["uid"] in used_uids:
-            logger.error("UID {0} has already been used!".format(used_uids))
+            logger.error("UID {0} has already been used!".format(housing["uid"]))
         else:
-            used_uids.append(housing["uid"])
+            used_uids.add(housing["uid"])
 
-        # Add to characterization data
-        output_data["address"] = housing["address"]
-        output_data["score"] = result_dict["SCORE"]
-        output_data["total"] = result_dict["TOTAL"]
-        output_data["possible"] = result_dict["POSSIBLE_POINTS"]
-        output_data["trains"] = get_nearby_trains(housing["coordinates"], radius_mi=0.5)
+        hash_uid = listing_id(housing)
+        write_start = time.perf_counter()
+        char_writer.add(hash_uid, char_entry, char_entry["char_output"]["scores"])
+        write_time += time.perf_counter() - write_start
+        for field, choices in filter_choices.items():
+            if housing[field]:
+                choices.add(housing[field])
 
-        hash_uid = generate_uid(housing["address"], housing["unit"])
-        char_output[hash_uid] = {
-            "housing_data": housing,
-            "char_output": output_data,
-        }
+        if listing_result.score > PERFECT_SCORE:
 
-        if result_dict["SCORE"] > PERFECT_SCORE:
-
-            char_results_good.append(result_dict)
+            char_results_good.append(listing_result)
         else:
-            char_results_bad.append(result_dict)
+            char_results_bad.append(listing_result)
 
     def print_results(result_list, name):
-        result_list = sorted(result_list, key=lambda x: x["SCORE"])
+        result_list = sorted(result_list, key=lambda x: x.score)
         logger.info("Printing Results for {0}:".format(name))
         for result in result_list:
-            logger.info("{0}\tUnit {1}".format(result["address"], result["unit"]))
-            logger.info("  " + result["link"])
-            logger.info("  Source: " + result["source"])
-            for criterion_data in result["criterion"]:
+            logger.info("{0}\tUnit {1}".format(result.listing["address"], result.listing["unit"]))
+            logger.info("  " + result.listing["link"])
+            logger.info("  Source: " + result.listing["source"])
+            for criterion_data in result.criterion:
                 criterion = criterion_data[0]
                 result_val = criterion_data[1]
                 key_val = criterion_data[2]
@@ -396,20 +741,25 @@ def perform_characterization() -> bool:
                     logger.info("  {0:16.16s} = {1:2.2f}\t({2})".format(criterion.name, result_val, key_val))
                 else:
                     logger.info("  {0:16.16s} = ----\t({1})".format(criterion.name, key_val))
-            logger.info("  {0:16.16s} = {1:2.2f}/{2}".format("POSSIBLE POINTS", result["TOTAL"], result["POSSIBLE_POINTS"]))
-            logger.info("  {0:16.16s} = {1:2.2f}%".format("SCORE", result["SCORE"]*100))
+            logger.info("  {0:16.16s} = {1:2.2f}/{2}".format("POSSIBLE POINTS", result.total, result.possible_points))
+            logger.info("  {0:16.16s} = {1:2.2f}%".format("SCORE", result.score*100))
 
         logger.info("\nResults Printed Bottom Down (Best Result at Bottom)\n")
 
     #print_results(char_results_bad, "Okay Housing")
     #print_results(char_results_good, "Perfect Housing")
 
-    # Write characterization output
+    # Finish characterization output, the filter choices are stored so the GUI does not need to scan every entry
+    char_writer.meta["filter_choices"] = {field: sorted(choices) for field, choices in filter_choices.items()}
+    pyagent.metrics.stage_duration.observe(time.perf_counter() - characterize_start - write_time,
+                                           stage="characterize")
+    write_start = time.perf_counter()
     try:
-        with open(CHAR_OUTPUT_FILE, "w") as output_file:
-            json.dump(char_output, output_file)
+        char_writer.close()
     except OSError as e:
-        logger.error("Failed to write characterization.json: {0}".format(e))
+        logger.error("Failed to write {0}: {1}".format(CHAR_OUTPUT_FILE, e))
+    write_time += time.perf_counter() - write_start
+    pyagent.metrics.stage_duration.observe(write_time, stage="write")
 
     logger.info("\nCharacterized {0} Entries of Housing Data".format(total_houses))
     logger.info("  Of those entries, {0} were considered PERFECT and {1} were considered OKAY".format(
@@ -418,12 +768,241 @@ def perform_characterization() -> bool:
     return True
 
 
+def write_characterization(char_entries: dict, changed: list = None, removed: list = None) -> bool:
+    """
+    Writes the characterization file from already characterized entries. When only some entries changed, only those
+    are written to the end of the existing file, unless it has to be written again from scratch.
+    :param char_entries: Dict of listing ID to characterization entry
+    :param changed: Listing IDs of the added or changed entries, None to write every entry
+    :param removed: Listing IDs of the removed entries
+    :return: True if written, false if otherwise
+    """
+    filter_choices = {field: set() for field in FILTER_CHOICE_FIELDS}
+    if changed is not None:
+        # Every entry is still needed for the filter choices, but they are small and already in memory
+        for char_entry in char_entries.values():
+            for field, choices in filter_choices.items():
+                if char_entry["housing_data"][field]:
+                    choices.add(char_entry["housing_data"][field])
+        meta = {"filter_choices": {field: sorted(choices) for field, choices in filter_choices.items()}}
+        try:
+            with pyagent.metrics.stage_duration.time(stage="write"):
+                if pyagent.update_characterization(CHAR_OUTPUT_FILE,
+                                                   {hash_uid: (char_entries[hash_uid],
+                                                               char_entries[hash_uid]["char_output"].get("scores"))
+                                                    for hash_uid in changed},
+                                                   removed or [], meta, output_compression,
+                                                   criteria=get_criteria_meta()):
+                    return True
+        except OSError as e:
+            logger.warning("Failed to update {0}, writing it again: {1}".format(CHAR_OUTPUT_FILE, e))
+        logger.debug("Writing {0} from scratch".format(CHAR_OUTPUT_FILE))
+        filter_choices = {field: set() for field in FILTER_CHOICE_FIELDS}
+    try:
+        with pyagent.metrics.stage_duration.time(stage="write"), \
+                pyagent.CharacterizationWriter(CHAR_OUTPUT_FILE, codec=output_compression,
+                                               criteria=get_criteria_meta()) as char_writer:
+            for hash_uid, char_entry in char_entries.items():
+                char_writer.add(hash_uid, char_entry, char_entry["char_output"].get("scores"))
+                for field, choices in filter_choices.items():
+                    if char_entry["housing_data"][field]:
+                        choices.add(char_entry["housing_data"][field])
+            char_writer.meta["filter_choices"] = {field: sorted(choices) for field, choices in filter_choices.items()}
+    except OSError as e:
+        logger.error("Failed to write {0}: {1}".format(CHAR_OUTPUT_FILE, e))
+        return False
+    return True
+
+
+def perform_daemon_cycle(source_keys: list, cache_path: str, state, char_entries: dict, crawler_host) -> bool:
+    """
+    Scrapes the due sources on the crawler host, and writes a delta of what changed
+    :param source_keys: The sources to scrape
+    :param cache_path: The scrape results file the deltas apply to
+    :param state: The current listings
+    :param char_entries: The characterization of the current listings, updated in place
+    :param crawler_host: The crawler host the shards are scraped on
+    :return: True if every source was scraped, false if otherwise
+    """
+    logger.info("Scraping {0}".format(", ".join(source_keys)))
+    shard_dir = os.path.join(OUTPUT_DIR, "shards", "daemon")
+    if not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+
+    crawler_settings = get_crawler_settings()
+    shards = []
+    if scrape_regions:
+        for region, sources in scrape_regions.items():
+            for source_key, source_config in sources.items():
+                if source_key in source_keys:
+                    shards.append(pyagent.ScrapeShard(source_key, region, source_config,
+                                                      os.path.join(shard_dir, "{0}@{1}.json".format(source_key,
+                                                                                                    region)),
+                                                      crawler_settings, get_source_settings(source_key)))
+    else:
+        for source_key in source_keys:
+            shards.append(pyagent.ScrapeShard(source_key, "", source_configs[source_key],
+                                              os.path.join(shard_dir, "{0}.json".format(source_key)),
+                                              crawler_settings, get_source_settings(source_key)))
+    if not shards:
+        return True
+
+    with pyagent.metrics.stage_duration.time(stage="crawl"):
+        results = crawler_host.run(shards)
+    succeeded = {result["shard"] for result in results if result["success"]}
+    pyagent.LocationCache.save_cache()
+
+    # Listings a shard no longer returns are removed, unless the shard failed or came back empty
+    listings = []
+    scopes = set()
+    for shard in shards:
+        shard_listings = list(pyagent.read_shards([shard]))
+        if shard.name in succeeded and shard_listings:
+            scopes.update(pyagent.daemon.listing_scope(housing) for housing in shard_listings)
+        listings.extend(shard_listings)
+    delta = state.diff(listings, scopes)
+    if not delta:
+        logger.info("No listings changed")
+        return len(succeeded) == len(shards)
+
+    try:
+        delta_path = pyagent.daemon.write_delta(cache_path, delta)
+    except OSError as e:
+        logger.error("Failed to write delta for {0}: {1}".format(cache_path, e))
+        return False
+    state.apply(delta)
+
+    # Only the listings that changed are scored again, and written
+    changed = []
+    removed = []
+    with pyagent.metrics.stage_duration.time(stage="characterize"):
+        for record in delta:
+            if record["op"] == pyagent.daemon.DELTA_REMOVE:
+                char_entries.pop(record["id"], None)
+                removed.append(record["id"])
+            else:
+                _, char_entries[record["id"]] = characterize_housing(record["housing"])
+                changed.append(record["id"])
+    write_characterization(char_entries, changed, removed)
+    # Each cycle is its own run, with the listings it added or changed
+    update_market_stats(cache_path, [record["housing"] for record in delta
+                                     if record["op"] == pyagent.daemon.DELTA_UPSERT], delta_path)
+    logger.info("Wrote {0}: {1} listings added or changed, {2} removed, {3} total".format(
+        delta_path, len(changed), len(removed), len(state)))
+    return len(succeeded) == len(shards)
+
+
+def run_daemon() -> bool:
+    """
+    Keeps running, scraping each source when it is due and writing only what changed. The location cache, train
+    data and criteria stay loaded between cycles.
+    :return: True when stopped cleanly, false if the daemon could not start
+    """
+    # Deltas build on the latest scrape results, or a new empty one
+    cache_files = glob.glob(OUTPUT_DIR + "/" + OUTPUT_CACHE_GLOB)
+    cache_name, _ = get_latest_cache(cache_files)
+    if cache_name:
+        cache_path = OUTPUT_DIR + "/" + cache_name
+    else:
+        cache_path = get_next_cache_path()
+        pyagent.compression.open_compressed(cache_path, "w").close()
+
+    state = pyagent.ListingState(listing_id)
+    try:
+        state.load(load_scrape_results(cache_path))
+    except (OSError, json.JSONDecodeError) as e:
+        logger.critical("Failed to load {0}: {1}".format(cache_path, e))
+        return False
+    char_entries = {}
+    for hash_uid, housing in state.items():
+        _, char_entries[hash_uid] = characterize_housing(housing)
+    # Later cycles only write what changed, on top of a file matching these listings
+    if not write_characterization(char_entries):
+        return False
+    logger.info("Daemon started with {0} listings from {1}".format(len(state), cache_path))
+
+    stop = threading.Event()
+
+    def on_signal(signum, frame):
+        logger.info("Stopping daemon...")
+        stop.set()
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    schedule = pyagent.SourceSchedule({key: daemon_intervals.get(key, daemon_interval)
+                                       for key in scrape_website_list})
+    # The crawler processes start their reactor and load the location cache once, and are reused every cycle
+    with pyagent.CrawlerHost(scrape_parallelism if scrape_regions else len(scrape_website_list)) as crawler_host:
+        while not stop.is_set():
+            due = schedule.due()
+            if not due:
+                stop.wait(schedule.seconds_until_due())
+                continue
+            cycle_start = time.time()
+            for source_key in due:
+                schedule.mark_run(source_key, cycle_start)
+            perform_daemon_cycle(due, cache_path, state, char_entries, crawler_host)
+            pyagent.metrics.last_run_timestamp.set(time.time())
+            if metrics_textfile:
+                pyagent.metrics.REGISTRY.write_textfile(metrics_textfile)
+    return True
+
+
+def write_geocode_stats() -> None:
+    """
+    Reports the geocoding statistics for this run, in the log and as JSON
+    :return: Nothing
+    """
+    stats = pyagent.AddressLookup.get_stats()
+    if not stats:
+        return
+    pyagent.AddressLookup.log_stats()
+    try:
+        if not os.path.isdir(OUTPUT_DIR):
+            os.makedirs(OUTPUT_DIR)
+        with open(GEOCODE_STATS_FILE, "w") as stats_file:
+            json.dump({"timestamp": time.time(), "sources": stats}, stats_file, indent=2)
+    except OSError as e:
+        logger.error("Failed to write geocoding statistics to {0}: {1}".format(GEOCODE_STATS_FILE, e))
+
+
+def import_station_index(feed_dirs: list) -> bool:
+    """
+    Builds the station index from GTFS feeds. The index path and route types are read from the [train_data] section
+    of the options file, if it has them.
+    :param feed_dirs: The GTFS feed directories, one per agency
+    :return: True if successful, false if otherwise
+    """
+    index_path = STATION_INDEX_FILE
+    route_types = pyagent.gtfs.DEFAULT_ROUTE_TYPES
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
+    if config.has_section("train_data"):
+        index_path = config["train_data"].get("index", STATION_INDEX_FILE)
+        if config.has_option("train_data", "route_types"):
+            try:
+                route_types = [int(route_type) for route_type in config["train_data"]["route_types"].split(",")]
+            except ValueError:
+                logger.critical("Invalid route types {0}".format(config["train_data"]["route_types"]))
+                return False
+
+    logger.info("Importing stations from {0}".format(", ".join(feed_dirs)))
+    try:
+        station_count = pyagent.gtfs.import_gtfs(feed_dirs, index_path, route_types)
+    except (OSError, ValueError, KeyError) as e:
+        logger.critical("Failed to import GTFS feeds: {0}".format(e))
+        return False
+    logger.info("Wrote {0} stations to {1}".format(station_count, index_path))
+    return True
+
+
 def load_options() -> bool:
     """
     Loads the options file. If it does not exist, a default one will be created.
     :return: True if successfully loaded or created the file, false if otherwise.
     """
-    global train_data
+    global train_data, metrics_textfile, metrics_port, scrape_parallelism, frontier_uri, frontier_lease, \
+        daemon_interval, output_compression, http_cache_enabled, http_cache_expiry, throttle_enabled
     config = configparser.ConfigParser()
     if not os.path.isfile(CONFIG_FILE):
         logger.debug("Config file {0} not found, creating default".format(CONFIG_FILE))
@@ -437,10 +1016,12 @@ def load_options() -> bool:
                                     "search_url": "search/apa?hasPic=1&bundleDuplicates=1&min_bedrooms=2&max_bedrooms=2&min_bathrooms=1&availabilityMode=0&sale_date=all+dates"}
         config["zillow"] = {"search_url": 'boston-ma/apartments/2-bedrooms/?searchQueryState={"pagination"%%3A{}%%2C"usersSearchTerm"%%3A"Boston%%2C MA"%%2C"mapBounds"%%3A{"west"%%3A-71.24846881103517%%2C"east"%%3A-70.84678118896485%%2C"south"%%3A42.21141701120901%%2C"north"%%3A42.41528103566799}%%2C"regionSelection"%%3A[{"regionId"%%3A44269%%2C"regionType"%%3A6}]%%2C"isMapVisible"%%3Atrue%%2C"filterState"%%3A{"fsba"%%3A{"value"%%3Afalse}%%2C"fsbo"%%3A{"value"%%3Afalse}%%2C"nc"%%3A{"value"%%3Afalse}%%2C"fore"%%3A{"value"%%3Afalse}%%2C"cmsn"%%3A{"value"%%3Afalse}%%2C"auc"%%3A{"value"%%3Afalse}%%2C"pmf"%%3A{"value"%%3Afalse}%%2C"pf"%%3A{"value"%%3Afalse}%%2C"fr"%%3A{"value"%%3Atrue}%%2C"ah"%%3A{"value"%%3Atrue}%%2C"sf"%%3A{"value"%%3Afalse}%%2C"mf"%%3A{"value"%%3Afalse}%%2C"manu"%%3A{"value"%%3Afalse}%%2C"land"%%3A{"value"%%3Afalse}%%2C"tow"%%3A{"value"%%3Afalse}%%2C"beds"%%3A{"min"%%3A2%%2C"max"%%3A2}%%2C"mp"%%3A{"max"%%3A3000}%%2C"price"%%3A{"max"%%3A913943}}%%2C"isListVisible"%%3Atrue%%2C"mapZoom"%%3A12}'}
 
-        config["train_data"] = {"source": "data/mbta.json"}
+        config["train_data"] = {"source": "data/mbta.json", "index": STATION_INDEX_FILE}
 
         config["gui_settings"] = {"filter_city": "", "filter_suburb": "", "filter_neighborhood": ""}
 
+        config["metrics"] = {"textfile": "", "port": "0"}
+
         with open(CONFIG_FILE, "w") as configfile:
             config.write(configfile)
 
@@ -462,7 +1043,19 @@ def load_options() -> bool:
         logger.critical("Config file missing section [scrape_websites]")
         return False
 
-    if config.has_option("train_data", "source"):
+    station_index = STATION_INDEX_FILE
+    if config.has_section("train_data"):
+        station_index = config["train_data"].get("index", STATION_INDEX_FILE)
+    if os.path.isfile(station_index):
+        # Prebuilt station index from --import-gtfs, mapped instead of loaded
+        logger.debug("Using station index {0}".format(station_index))
+        try:
+            train_data = pyagent.StationIndex(station_index)
+        except (OSError, ValueError) as e:
+            logger.critical("Failed to open station index {0}: {1}".format(station_index, e))
+            return False
+        pyagent.set_train_data(train_data)
+    elif config.has_option("train_data", "source"):
         # Load train data
         train_source = config["train_data"]["source"]
         logger.debug("Loading train data from {0}".format(train_source))
@@ -480,6 +1073,24 @@ def load_options() -> bool:
         logger.critical("Missing train data!")
         return False
 
+    # Metrics export, both optional
+    if config.has_section("metrics"):
+        metrics_textfile = config["metrics"].get("textfile", "")
+        try:
+            metrics_port = config["metrics"].getint("port", 0)
+        except ValueError:
+            logger.critical("Invalid metrics port {0}".format(config["metrics"]["port"]))
+            return False
+
+    # Shared frontier, optional
+    if config.has_section("frontier"):
+        frontier_uri = config["frontier"].get("backend", "")
+        try:
+            frontier_lease = config["frontier"].getfloat("lease", pyagent.frontier.DEFAULT_LEASE)
+        except ValueError:
+            logger.critical("Invalid frontier lease {0}".format(config["frontier"]["lease"]))
+            return False
+
     # Get settings for each source
     for source_key in scrape_sites:
         if not config.has_section(source_key):
@@ -488,6 +1099,7 @@ def load_options() -> bool:
         # Add to source
         source_obj = pyagent.get_source(source_key)
         if source_obj:
+            source_configs[source_key] = dict(config[source_key])
             for key in config[source_key]:
                 source_obj.add_config(key, config[source_key][key])
             if not source_obj.verify_config():
@@ -497,6 +1109,125 @@ def load_options() -> bool:
             logger.critical("No source with name {0}".format(source_key))
             return False
 
+    # Output compression, optional
+    if config.has_section("output"):
+        output_compression = config["output"].get("compression", pyagent.compression.COMPRESSION_NONE).lower()
+        if output_compression not in pyagent.compression.EXTENSIONS:
+            logger.critical("Unknown output compression '{0}', use none, gzip or zstd".format(output_compression))
+            return False
+        if not pyagent.compression.is_available(output_compression):
+            logger.critical("zstd compression requires the zstandard package")
+            return False
+
+    # Location criteria rasters, optional
+    if config.has_section("raster"):
+        try:
+            raster_enabled = config["raster"].getboolean("enabled", True)
+            raster_cell = config["raster"].getfloat("cell", pyagent.raster.DEFAULT_CELL_MI)
+            raster_bounds = None
+            if config["raster"].get("bounds", ""):
+                raster_bounds = [float(bound) for bound in config["raster"]["bounds"].split(",")]
+                if len(raster_bounds) != 4:
+                    raise ValueError("bounds must be south,west,north,east")
+        except ValueError as e:
+            logger.critical("Invalid raster option: {0}".format(e))
+            return False
+        for criterion in housing_criteria:
+            if isinstance(criterion, pyagent.CriterionTrain):
+                criterion.set_raster_options(raster_enabled, raster_cell, raster_bounds)
+
+    # Commute time criterion, optional
+    if config.has_section("commute"):
+        commute_config = config["commute"]
+        try:
+            destination = [float(value) for value in commute_config["destination"].split(",")]
+            feeds = [feed.strip() for feed in commute_config["feeds"].split(",") if feed.strip()]
+            if len(destination) != 2 or not feeds:
+                raise ValueError("destination must be lat,long and feeds must name at least one feed")
+            route_types = pyagent.commute.DEFAULT_ROUTE_TYPES
+            if "route_types" in commute_config:
+                route_types = [int(route_type) for route_type in commute_config["route_types"].split(",")]
+            window = commute_config.get("window", pyagent.commute.DEFAULT_WINDOW)
+            pyagent.commute.parse_window(window)
+            service_day = commute_config.get("service_day", pyagent.commute.DEFAULT_SERVICE_DAY)
+            pyagent.gtfs.parse_service_day(service_day)
+            housing_criteria.append(pyagent.CriterionCommute(
+                name=commute_config.get("name", "Commute"), key="coordinates",
+                weight=commute_config.getint("weight", 50), max_minutes=commute_config.getfloat("max_minutes", 60),
+                destination=destination, feeds=feeds, window=window, route_types=route_types,
+                max_walk=commute_config.getfloat("max_walk", pyagent.commute.DEFAULT_MAX_WALK),
+                walk_speed=commute_config.getfloat("walk_speed", pyagent.commute.DEFAULT_WALK_SPEED),
+                service_day=service_day))
+        except (KeyError, ValueError) as e:
+            logger.critical("Invalid commute option: {0}".format(e))
+            return False
+
+    # HTTP response cache, optional
+    if config.has_section("http_cache"):
+        try:
+            http_cache_enabled = config["http_cache"].getboolean("enabled", False)
+            http_cache_expiry = config["http_cache"].getint("expiry", http_cache_expiry)
+            for source_key in scrape_website_list:
+                if config.has_option("http_cache", source_key):
+                    http_cache_expiries[source_key] = config["http_cache"].getint(source_key)
+        except ValueError as e:
+            logger.critical("Invalid http cache option: {0}".format(e))
+            return False
+
+    # Adaptive throttle limits, optional. Options named <source>.<limit> only apply to that source.
+    if config.has_section("throttle"):
+        try:
+            throttle_enabled = config["throttle"].getboolean("enabled", True)
+            for option in config["throttle"]:
+                source_key, _, limit = option.rpartition(".")
+                if limit == "enabled":
+                    continue
+                if limit not in pyagent.throttle.DEFAULT_LIMITS:
+                    logger.warning("Unknown throttle option {0}".format(option))
+                    continue
+                value = config["throttle"].getfloat(option)
+                if source_key:
+                    throttle_source_limits.setdefault(source_key, {})[limit] = value
+                else:
+                    throttle_limits[limit] = value
+        except ValueError as e:
+            logger.critical("Invalid throttle option: {0}".format(e))
+            return False
+
+    # Daemon schedule, optional
+    if config.has_section("daemon"):
+        try:
+            daemon_interval = config["daemon"].getfloat("interval", pyagent.daemon.DEFAULT_INTERVAL)
+            for source_key in scrape_website_list:
+                if config.has_option("daemon", source_key):
+                    daemon_intervals[source_key] = config["daemon"].getfloat(source_key)
+        except ValueError as e:
+            logger.critical("Invalid daemon interval: {0}".format(e))
+            return False
+
+    # Regions are optional, each enabled source with a [source@region] section is scraped once per region
+    if config.has_section("regions"):
+        region_names = [name.strip() for name in config["regions"].get("names", "").split(",") if name.strip()]
+        try:
+            scrape_parallelism = config["regions"].getint("parallelism", os.cpu_count() or 1)
+        except ValueError:
+            logger.critical("Invalid region parallelism {0}".format(config["regions"]["parallelism"]))
+            return False
+        if scrape_parallelism < 1:
+            logger.critical("Region parallelism must be at least 1")
+            return False
+        for region in region_names:
+            scrape_regions[region] = {}
+            for source_key in scrape_website_list:
+                section = "{0}@{1}".format(source_key, region)
+                if not config.has_section(section):
+                    logger.debug("Source {0} is not configured for region {1}".format(source_key, region))
+                    continue
+                # Region options override the source's own section
+                source_config = dict(config[source_key])
+                source_config.update(config[section])
+                scrape_regions[region][source_key] = source_config
+
     return True
 
 
@@ -513,22 +1244,43 @@ def open_gui() -> bool:
                      "characterization data.")
         return False
 
+    import pyagentui
     pyagentui.open_gui(char_file=CHAR_OUTPUT_FILE)
     return True
 
 
+def serve_results(host: str, port: int) -> bool:
+    """
+    Serves the PyAgent GUI over HTTP
+    :param host: The address to listen on
+    :param port: The port to listen on
+    :return: True if the server ran, false if otherwise
+    """
+    if not os.path.exists(CHAR_OUTPUT_FILE):
+        logger.error("There was no characterization data. Run pyagent.py without arguments to generate "
+                     "characterization data.")
+        return False
+
+    import pyagentui
+    pyagentui.serve(char_file=CHAR_OUTPUT_FILE, host=host, port=port)
+    return True
+
+
 def main(argv) -> int:
     """
     Program main entry point. Parses command line arguments.
     :param argv: Command line arguments
     :return: Program return code
     """
+    global http_cache_offline
 
     logger.info("Starting PyAgent...")
 
     # Get command line arguments
     try:
-        opts, args = getopt.getopt(argv, "hvsn", ["gui"])
+        opts, args = getopt.getopt(argv, "hvsn", ["gui", "serve", "host=", "port=", "worker", "daemon",
+                                                  "offline", "import-gtfs=", "stats", "import-cache=",
+                                                  "export-cache=", "merge-policy="])
     except getopt.GetoptError:
         logger.critical("Invalid command line arguments.")
         print_help()
@@ -539,6 +1291,16 @@ def main(argv) -> int:
     do_verbose = False
     do_charact = True
     do_gui = False
+    do_serve = False
+    do_worker = False
+    do_daemon = False
+    do_stats = False
+    gtfs_feeds = []
+    cache_imports = []
+    cache_export = ""
+    merge_policy = pyagent.cache.MERGE_POSITIVE
+    serve_host = SERVE_HOST
+    serve_port = SERVE_PORT
 
     for opt, arg in opts:
         if opt == "-h":
@@ -551,6 +1313,37 @@ def main(argv) -> int:
             do_charact = False
         elif opt == "--gui":
             do_gui = True
+        elif opt == "--serve":
+            do_serve = True
+        elif opt == "--worker":
+            do_worker = True
+        elif opt == "--daemon":
+            do_daemon = True
+        elif opt == "--offline":
+            http_cache_offline = True
+            pyagent.AddressLookup.cache_only = True
+        elif opt == "--stats":
+            do_stats = True
+        elif opt == "--import-cache":
+            cache_imports = [path.strip() for path in arg.split(",") if path.strip()]
+        elif opt == "--export-cache":
+            cache_export = arg
+        elif opt == "--merge-policy":
+            if arg not in pyagent.cache.MERGE_POLICIES:
+                logger.critical("Invalid merge policy '{0}', use one of {1}".format(
+                    arg, ", ".join(pyagent.cache.MERGE_POLICIES)))
+                return 2
+            merge_policy = arg
+        elif opt == "--import-gtfs":
+            gtfs_feeds = [feed.strip() for feed in arg.split(",") if feed.strip()]
+        elif opt == "--host":
+            serve_host = arg
+        elif opt == "--port":
+            try:
+                serve_port = int(arg)
+            except ValueError:
+                logger.critical("Invalid port '{0}'".format(arg))
+                return 2
 
     if do_help:
         logger.debug("Showing help, no other action is performed")
@@ -559,15 +1352,47 @@ def main(argv) -> int:
     if do_verbose:
         enable_verbose()
 
+    if gtfs_feeds:
+        if not import_station_index(gtfs_feeds):
+            return 1
+        return 0
+
+    if cache_imports or cache_export:
+        if not transfer_location_cache(cache_imports, cache_export, merge_policy):
+            return 1
+        return 0
+
+    if do_stats:
+        if not print_market_stats():
+            return 1
+        return 0
+
     # Load the options file
     if not load_options():
         return 1
+    if metrics_port:
+        pyagent.metrics.REGISTRY.start_http_server(metrics_port)
 
     if do_gui:
         if not open_gui():
             return 1
         return 0
 
+    if do_serve:
+        if not serve_results(serve_host, serve_port):
+            return 1
+        return 0
+
+    if do_daemon:
+        if not run_daemon():
+            return 1
+        return 0
+
+    if do_worker:
+        if not perform_worker_scrape():
+            return 1
+        return 0
+
     if do_scrape:
         if not perform_scrape():
             return 1
@@ -594,5 +1419,9 @@ if __name__ == "__main__":
     pyagent.LocationCache.init_cache()
     ret_val = main(sys.argv[1:])
     pyagent.LocationCache.save_cache()
+    write_geocode_stats()
+    if metrics_textfile:
+        pyagent.metrics.last_run_timestamp.set(time.time())
+        pyagent.metrics.REGISTRY.write_textfile(metrics_textfile)
     sys.exit(ret_val)
 
@@ -20,27 +20,106 @@ import logging
 from typing import Optional
 from .data_source import Source
 from .spider import ScrapySpider
-from .source_apartments_com import ApartmentsComSpider
-from .source_craiglist import CraigslistSpider
-from .source_zillow import ZillowSpider
+from . import cache
 from .cache import LocationCache
+from .addresses import AddressLookup
+from . import metrics
+from . import compression
+from . import serialize
+from . import throttle
+from . import gtfs
+from . import commute
+from . import raster
+from . import marketstats
+from .compression import open_compressed
+from .listing import Listing, ListingResult
+from .stations import StationIndex, write_station_index
+from .marketstats import MarketStats
+from .shards import ScrapeShard, CrawlerHost, run_shards, read_shards, merge_shards
+from . import daemon
+from .daemon import SourceSchedule, ListingState
+from . import frontier
+from .frontier import (Frontier,
+                       MemoryFrontier,
+                       SQLiteFrontier,
+                       open_frontier,
+                       register_frontier_backend)
+from .charfile import (CharacterizationWriter,
+                       CharacterizationFile,
+                       open_characterization,
+                       update_characterization)
 from .criteria import (Criterion,
                        CriterionLesser,
                        CriterionGreater,
                        CriterionBeds,
                        CriterionSqFt,
                        CriterionTrain,
+                       CriterionCommute,
                        ResultFormat)
 
 logger = logging.getLogger(__name__)
 
-# Initialize default sources
+# Entry point group for sources from other packages. Each entry point is named after the source key and loads a
+# Source, or a callable returning one.
+SOURCE_ENTRY_POINT_GROUP = "pyagent.sources"
+
+# Initialize default sources, the spiders (and scrapy) are only imported once a source is used
 _source_list = [Source("apartments_com", "apartments.com", required_conf=["search_url"],
-                       spider=ApartmentsComSpider()),
+                       spider="pyagent.source_apartments_com:ApartmentsComSpider"),
                 Source("craigslist_bos", "boston.craigslist.com", required_conf=["subdomain", "search_url"],
-                       spider=CraigslistSpider()),
+                       spider="pyagent.source_craiglist:CraigslistSpider"),
                 Source("zillow", "zillow.com", required_conf=["search_url"],
-                       spider=ZillowSpider())]
+                       spider="pyagent.source_zillow:ZillowSpider")]
+# Entry points found but not loaded yet, by source key
+_source_entry_points = None
+
+
+def _get_source_entry_points() -> dict:
+    global _source_entry_points
+    if _source_entry_points is None:
+        _source_entry_points = {}
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return _source_entry_points
+        found = entry_points()
+        if hasattr(found, "select"):
+            found = found.select(group=SOURCE_ENTRY_POINT_GROUP)
+        else:
+            found = found.get(SOURCE_ENTRY_POINT_GROUP, [])
+        for entry_point in found:
+            _source_entry_points[entry_point.name] = entry_point
+    return _source_entry_points
+
+
+def _load_source_entry_point(key) -> Optional[Source]:
+    entry_point = _get_source_entry_points().pop(key, None)
+    if entry_point is None:
+        return None
+    try:
+        source = entry_point.load()
+        if not isinstance(source, Source):
+            source = source()
+    except Exception as e:
+        logger.error("Failed to load source {0} from {1}: {2}".format(key, entry_point.value, e))
+        return None
+    if source.key != key:
+        logger.warning("Source entry point {0} loaded source {1}".format(key, source.key))
+    register_source(source)
+    return source
+
+
+def register_source(source: Source) -> None:
+    """
+    Adds a housing source, replacing any source with the same key
+    :param source: The source
+    :return: Nothing
+    """
+    for idx, item in enumerate(_source_list):
+        if item.key == source.key:
+            _source_list[idx] = source
+            return
+    _source_list.append(source)
 
 
 def get_source(key) -> Optional[Source]:
@@ -52,31 +131,40 @@ def get_source(key) -> Optional[Source]:
     for item in _source_list:
         if item.key == key:
             return item
-    return None
+    # Only import a plugin when its source is asked for
+    return _load_source_entry_point(key)
 
 
-def init_sources() -> None:
+def init_sources(keys: list = None) -> None:
     """
-    Initialize all the sources after config data is loaded
+    Initialize the sources after config data is loaded
+    :param keys: The keys of the sources to initialize, all sources if None
     :return: None
     """
     logger.debug("Initializing sources...")
-    for item in _source_list:
-        item.init()
+    if keys is None:
+        sources = get_source_list()
+    else:
+        sources = [get_source(key) for key in keys]
+    for item in sources:
+        if item is not None:
+            item.init()
 
 
 def get_source_list() -> list:
     """
-    Gets the list of housing sources
+    Gets the list of housing sources, including every plugin source
     :return: List of housing sources
     """
+    for key in list(_get_source_entry_points()):
+        _load_source_entry_point(key)
     return _source_list
 
 
 def set_train_data(data) -> None:
     """
-    Sets the train data loaded from json
-    :param data: Train data loaded from json
+    Sets the train data, loaded from json or a station index
+    :param data: List of station dicts, or a StationIndex
     :return: Nothing
     """
     Criterion.train_data = data
@@ -17,11 +17,11 @@
 """
 
 import logging
+import threading
 import time
-import geopy
-import geopy.geocoders as gc
 from typing import Optional
 from .cache import LocationCache
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -94,6 +94,84 @@ class AddressLookup:
     """
 
     last_nom_request = 0
+    # Held for each backend request, so requests from several threads still honor the request delay
+    _request_lock = threading.Lock()
+    # Lookups with a backend request running, by key, so other lookups of the same key wait for it
+    _in_flight = {}
+    _in_flight_lock = threading.Lock()
+    # Reverse lookups whose request failed, not tried again this run. Failed forward lookups are cached as invalid.
+    _failed = set()
+    # Only answer lookups from the location cache, without backend requests, such as when scraping offline.
+    # Lookups that are not cached find nothing, and their listings are skipped.
+    cache_only = False
+
+    @staticmethod
+    def wait_for_rate_limit(source: str = "") -> None:
+        """
+        Blocks until NOMINATIM_REQUEST_DELAY has passed since the last request
+        :param source: The spider doing the lookup, for geocoding statistics
+        :return: Nothing
+        """
+        time_since_last = (time.time() - AddressLookup.last_nom_request)
+        if time_since_last < NOMINATIM_REQUEST_DELAY:
+            delay = NOMINATIM_REQUEST_DELAY - time_since_last
+            time.sleep(delay)
+            metrics.geocode_rate_limit_wait.inc(delay, source=source)
+
+    @staticmethod
+    def get_stats() -> dict:
+        """
+        Collects the geocoding statistics for this run, broken down by source spider
+        :return: Dict of source to statistics
+        """
+        stats = {}
+
+        def source_stats(source):
+            if source not in stats:
+                stats[source] = {
+                    "forward": {"hit": 0, "negative_hit": 0, "miss": 0},
+                    "reverse": {"hit": 0, "miss": 0},
+                    "requests": {"forward": {}, "reverse": {}},
+                    "request_seconds": {"forward": 0.0, "reverse": 0.0},
+                    "rate_limit_wait_seconds": 0.0,
+                }
+            return stats[source]
+
+        for (kind, source, result), count in metrics.geocode_cache_lookups.samples().items():
+            source_stats(source)[kind][result] = int(count)
+        for (kind, source, result), count in metrics.geocode_requests.samples().items():
+            source_stats(source)["requests"][kind][result] = int(count)
+        for (kind, source), (total, _) in metrics.geocode_latency.samples().items():
+            source_stats(source)["request_seconds"][kind] = total
+        for (source,), total in metrics.geocode_rate_limit_wait.samples().items():
+            source_stats(source)["rate_limit_wait_seconds"] = total
+        return stats
+
+    @staticmethod
+    def log_stats() -> None:
+        """
+        Logs a summary of the geocoding statistics for this run
+        :return: Nothing
+        """
+        stats = AddressLookup.get_stats()
+        if not stats:
+            return
+        logger.info("Geocoding summary:")
+        for source, source_stats in sorted(stats.items()):
+            forward = source_stats["forward"]
+            reverse = source_stats["reverse"]
+            forward_total = sum(forward.values())
+            reverse_total = sum(reverse.values())
+            logger.info("  {0}".format(source if source else "(unknown source)"))
+            if forward_total:
+                logger.info("    Forward: {0} lookups, {1:.1f}% cache hits, {2} negative hits, {3} misses".format(
+                    forward_total, 100.0 * forward["hit"] / forward_total, forward["negative_hit"], forward["miss"]))
+            if reverse_total:
+                logger.info("    Reverse: {0} lookups, {1:.1f}% cache hits, {2} misses".format(
+                    reverse_total, 100.0 * reverse["hit"] / reverse_total, reverse["miss"]))
+            logger.info("    Backend time: {0:.1f}s forward, {1:.1f}s reverse, {2:.1f}s waiting on rate limit".format(
+                source_stats["request_seconds"]["forward"], source_stats["request_seconds"]["reverse"],
+                source_stats["rate_limit_wait_seconds"]))
 
     @staticmethod
     def extract_address_dict(location) -> dict:
@@ -138,74 +216,159 @@ class AddressLookup:
         return loc_dict
 
     @staticmethod
-    def lookup_coordinates(coordinates) -> Optional[dict]:
+    def _coalesce(key: tuple, source: str, get_cached, request):
         """
-        Looks up the address of the given coordinates. Uses cache for cached coordinates. This will block until
-        NOMINATIM_REQUEST_DELAY passes since last request
+        Does a backend request for a key, unless a request for the key is already running on another thread, in which
+        case its result is used. Each key costs at most one backend request per run.
+        :param key: (kind, key), where kind is "forward" or "reverse"
+        :param source: The spider doing the lookup, for geocoding statistics
+        :param get_cached: Callable returning the cached result, None if there is none
+        :param request: Callable doing the backend request and caching its result
+        :return: The result, None if it could not be found
+        """
+        with AddressLookup._in_flight_lock:
+            cached = get_cached()
+            if cached is not None or key in AddressLookup._failed:
+                return cached
+            if AddressLookup.cache_only:
+                logger.debug("No cached {0} lookup for {1}, skipping it offline".format(key[0], key[1]))
+                return None
+            event = AddressLookup._in_flight.get(key)
+            is_owner = event is None
+            if is_owner:
+                event = AddressLookup._in_flight[key] = threading.Event()
+        if not is_owner:
+            metrics.geocode_coalesced.inc(kind=key[0], source=source, reason="in_flight")
+            event.wait()
+            return get_cached()
+        try:
+            result = request()
+            if result is None:
+                AddressLookup._failed.add(key)
+            return result
+        finally:
+            with AddressLookup._in_flight_lock:
+                del AddressLookup._in_flight[key]
+            event.set()
+
+    @staticmethod
+    def _request_coordinates(coordinates, source: str) -> Optional[dict]:
+        """
+        Asks Nominatim for the address of coordinates and caches it. This will block until NOMINATIM_REQUEST_DELAY
+        passes since last request
         :param coordinates: The coordinates to lookup
+        :param source: The spider doing the lookup, for geocoding statistics
+        :return: The address dict, or None if the request failed
         """
-        location = LocationCache.get_address(coordinates)
-        if location is None:
+        # geopy is only needed on a cache miss
+        import geopy
+        import geopy.geocoders as gc
+
+        with AddressLookup._request_lock:
             # Sleep if necessary
-            time_since_last = (time.time() - AddressLookup.last_nom_request)
-            if time_since_last < NOMINATIM_REQUEST_DELAY:
-                time.sleep(NOMINATIM_REQUEST_DELAY - time_since_last)
+            AddressLookup.wait_for_rate_limit(source)
 
             address_obj = None
+            result = "error"
             try:
                 geolocator = gc.Nominatim(user_agent="pyagent")
-                address_obj = geolocator.reverse(query=geopy.point.Point(coordinates[0], coordinates[1]),
-                                                 exactly_one=True)
+                with metrics.geocode_latency.time(kind="reverse", source=source):
+                    address_obj = geolocator.reverse(query=geopy.point.Point(coordinates[0], coordinates[1]),
+                                                     exactly_one=True)
+                result = "ok" if address_obj else "empty"
             except geopy.exc.ConfigurationError as e:
                 logger.error("Geocoder error looking up coordinates {0}: {1}".format(coordinates, e))
                 address_obj = None
             except geopy.exc.GeocoderTimedOut as e:
                 logger.error("Geocoder timed out for address {0}: {1}".format(coordinates, e))
                 address_obj = None
+            metrics.geocode_requests.inc(kind="reverse", source=source, result=result)
             AddressLookup.last_nom_request = time.time()
 
-            if address_obj:
-                location = AddressLookup.extract_address_dict(address_obj)
-            else:
-                return None
-            LocationCache.add_to_reverse_cache(coordinates, location)
-            return location
-        else:
-            return location
+        if not address_obj:
+            return None
+        location = AddressLookup.extract_address_dict(address_obj)
+        LocationCache.add_to_reverse_cache(coordinates, location)
+        return location
 
     @staticmethod
-    def lookup_address(address) -> Optional[dict]:
+    def _request_address(address: str, source: str) -> dict:
         """
-        Looks up the coordinates of a given address. Uses cache for cached addresses. This will block until
-        NOMINATIM_REQUEST_DELAY passes since last request
+        Asks Nominatim for the location of an address and caches it, addresses that are not found are cached as
+        invalid. This will block until NOMINATIM_REQUEST_DELAY passes since last request
         :param address: The address to lookup
+        :param source: The spider doing the lookup, for geocoding statistics
+        :return: The location dict, empty if the address was not found
         """
-        location = LocationCache.get_location(address)
-        if location is None:
+        import geopy
+        import geopy.geocoders as gc
+
+        with AddressLookup._request_lock:
             # Sleep if necessary
-            time_since_last = (time.time() - AddressLookup.last_nom_request)
-            if time_since_last < NOMINATIM_REQUEST_DELAY:
-                time.sleep(NOMINATIM_REQUEST_DELAY - time_since_last)
+            AddressLookup.wait_for_rate_limit(source)
 
             # Try to retrieve the address from Nominatim
             location_obj = None
+            result = "error"
             try:
                 geolocator = gc.Nominatim(user_agent="pyagent")
-                location_obj = geolocator.geocode(address, addressdetails=True)
+                with metrics.geocode_latency.time(kind="forward", source=source):
+                    location_obj = geolocator.geocode(address, addressdetails=True)
+                result = "ok" if location_obj else "empty"
             except geopy.exc.ConfigurationError as e:
                 logger.error("Geocoder error looking up address {0}: {1}".format(address, e))
                 location_obj = None
             except geopy.exc.GeocoderTimedOut as e:
                 logger.error("Geocoder timed out for address {0}: {1}".format(address, e))
                 location_obj = None
+            metrics.geocode_requests.inc(kind="forward", source=source, result=result)
             AddressLookup.last_nom_request = time.time()
 
-            if location_obj:
-                location = AddressLookup.extract_address_dict(location_obj)
-            else:
-                location = {}
-            LocationCache.add_to_cache(address, location)
-            if not location and location is not None:
+        if location_obj:
+            location = AddressLookup.extract_address_dict(location_obj)
+        else:
+            location = {}
+        LocationCache.add_to_cache(address, location)
+        return location
+
+    @staticmethod
+    def lookup_coordinates(coordinates, source: str = "") -> Optional[dict]:
+        """
+        Looks up the address of the given coordinates. Uses cache for cached coordinates. This will block until
+        NOMINATIM_REQUEST_DELAY passes since last request
+        :param coordinates: The coordinates to lookup
+        :param source: The spider doing the lookup, for geocoding statistics
+        """
+        location = LocationCache.get_address(coordinates)
+        metrics.geocode_cache_lookups.inc(kind="reverse", source=source,
+                                          result="miss" if location is None else "hit")
+        if location is None:
+            return AddressLookup._coalesce(("reverse", tuple(coordinates)), source,
+                                           lambda: LocationCache.get_address(coordinates),
+                                           lambda: AddressLookup._request_coordinates(coordinates, source))
+        return location
+
+    @staticmethod
+    def lookup_address(address, source: str = "") -> Optional[dict]:
+        """
+        Looks up the coordinates of a given address. Uses cache for cached addresses. This will block until
+        NOMINATIM_REQUEST_DELAY passes since last request
+        :param address: The address to lookup
+        :param source: The spider doing the lookup, for geocoding statistics
+        """
+        location = LocationCache.get_location(address)
+        if location is None:
+            cache_result = "miss"
+        elif not location:
+            cache_result = "negative_hit"
+        else:
+            cache_result = "hit"
+        metrics.geocode_cache_lookups.inc(kind="forward", source=source, result=cache_result)
+        if location is None:
+            location = AddressLookup._coalesce(("forward", address), source,
+                                               lambda: LocationCache.get_location(address),
+                                               lambda: AddressLookup._request_address(address, source))
+            if not location:
                 return None
             return location
         else:
@@ -215,6 +378,36 @@ class AddressLookup:
                 return None
             return location
 
+    @staticmethod
+    def prefetch_addresses(addresses, source: str = "") -> int:
+        """
+        Looks up a batch of addresses ahead of time, such as every address on a search page, so the lookups that
+        follow are cache hits. Addresses already in the cache and repeats within the batch are left out, and the rest
+        are requested one after another at the request delay.
+        :param addresses: Iterable of addresses
+        :param source: The spider doing the lookup, for geocoding statistics
+        :return: Number of addresses requested from the backend
+        """
+        pending = []
+        seen = set()
+        for address in addresses:
+            if not address:
+                continue
+            if address in seen:
+                metrics.geocode_coalesced.inc(kind="forward", source=source, reason="duplicate")
+                continue
+            seen.add(address)
+            if not LocationCache.entry_present(address):
+                pending.append(address)
+        if not pending or AddressLookup.cache_only:
+            return 0
+        logger.debug("Prefetching {0} of {1} addresses".format(len(pending), len(seen)))
+        for address in pending:
+            AddressLookup._coalesce(("forward", address), source,
+                                    lambda: LocationCache.get_location(address),
+                                    lambda: AddressLookup._request_address(address, source))
+        return len(pending)
+
     @staticmethod
     def construct_address(location) -> str:
         components = []
@@ -18,14 +18,25 @@
 
 import logging
 import os
-import json
+import time
 from typing import Optional
+from . import serialize
 
 logger = logging.getLogger(__name__)
 
 CACHE_DIR = "cache"
 LOCATION_CACHE = "location.json"
 LOCATION_CACHE_REVERSE = "location_reverse.json"
+# When each entry was added, for merging caches from other machines
+LOCATION_CACHE_TIMES = "location_times.json"
+LOCATION_SNAPSHOT = "location_snapshot.json.gz"
+SNAPSHOT_VERSION = 1
+
+# Snapshot merge policies. Newest keeps whichever entry was looked up last. Positive keeps an entry with a location over
+# one cached as invalid, which may only have been a failed request, and otherwise keeps the newest.
+MERGE_NEWEST = "newest"
+MERGE_POSITIVE = "positive"
+MERGE_POLICIES = (MERGE_NEWEST, MERGE_POSITIVE)
 
 import hashlib
 from base64 import b64encode
@@ -37,8 +48,11 @@ class LocationCache:
     """
     location_data = None
     location_reverse_data = None
+    # Unix time each entry was added, {"forward": {address: time}, "reverse": {uid: time}}
+    location_times = None
     cache_path = CACHE_DIR + "\\" + LOCATION_CACHE
     cache_path_rev = CACHE_DIR + "\\" + LOCATION_CACHE_REVERSE
+    cache_path_times = CACHE_DIR + "\\" + LOCATION_CACHE_TIMES
 
     @staticmethod
     def init_cache() -> None:
@@ -50,21 +64,26 @@ class LocationCache:
         # Read the cache into memory
         if os.path.isfile(LocationCache.cache_path):
             try:
-                with open(LocationCache.cache_path) as json_file:
-                    LocationCache.location_data = json.load(json_file)
-            except OSError as e:
+                LocationCache.location_data = serialize.load(LocationCache.cache_path)
+            except (OSError, ValueError) as e:
                 logger.critical("Failed to read cache from disk: {0}".format(e))
         else:
             LocationCache.location_data = {}
         # Read reverse cache into memory
         if os.path.isfile(LocationCache.cache_path_rev):
             try:
-                with open(LocationCache.cache_path_rev) as json_file:
-                    LocationCache.location_reverse_data = json.load(json_file)
-            except OSError as e:
+                LocationCache.location_reverse_data = serialize.load(LocationCache.cache_path_rev)
+            except (OSError, ValueError) as e:
                 logger.critical("Failed to read cache from disk: {0}".format(e))
         else:
             LocationCache.location_reverse_data = {}
+        # Entries cached before times were kept have none, and lose to any entry that has one
+        LocationCache.location_times = {"forward": {}, "reverse": {}}
+        if os.path.isfile(LocationCache.cache_path_times):
+            try:
+                LocationCache.location_times.update(serialize.load(LocationCache.cache_path_times))
+            except (OSError, ValueError) as e:
+                logger.error("Failed to read cache times from disk: {0}".format(e))
 
     @staticmethod
     def save_cache() -> None:
@@ -73,16 +92,11 @@ class LocationCache:
         :return: Nothing
         """
         try:
-            with open(LocationCache.cache_path, 'w') as outfile:
-                outfile.seek(0)
-                json.dump(LocationCache.location_data, outfile)
-                outfile.truncate()
-                logger.info("Saving location cache...")
-            with open(LocationCache.cache_path_rev, 'w') as outfile:
-                outfile.seek(0)
-                json.dump(LocationCache.location_reverse_data, outfile)
-                outfile.truncate()
-                logger.info("Saving location reverse cache...")
+            logger.info("Saving location cache...")
+            serialize.save(LocationCache.cache_path, LocationCache.location_data)
+            logger.info("Saving location reverse cache...")
+            serialize.save(LocationCache.cache_path_rev, LocationCache.location_reverse_data)
+            serialize.save(LocationCache.cache_path_times, LocationCache.location_times)
         except OSError as e:
             logger.critical("Failed to write cache to disk: {0}".format(e))
 
@@ -137,6 +151,7 @@ class LocationCache:
         :return: Nothing
         """
         LocationCache.location_data[addr] = location
+        LocationCache.location_times["forward"][addr] = time.time()
 
     @staticmethod
     def add_to_reverse_cache(coords: list, addr: str) -> None:
@@ -148,3 +163,95 @@ class LocationCache:
         """
         uid = hashlib.sha256(str(coords[0]).encode() + str(coords[1]).encode()).hexdigest()
         LocationCache.location_reverse_data[uid] = addr
+        LocationCache.location_times["reverse"][uid] = time.time()
+
+    @staticmethod
+    def export_snapshot(path: str = LOCATION_SNAPSHOT) -> int:
+        """
+        Writes the forward and reverse caches to a snapshot, with the time each entry was added. The snapshot is
+        compressed and serialized according to its extension, such as .json.gz or .msgpack.zst.
+        :param path: The snapshot file
+        :return: Number of entries written
+        """
+        times = LocationCache.location_times
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "created": time.time(),
+            "forward": {addr: [location, times["forward"].get(addr, 0)]
+                        for addr, location in LocationCache.location_data.items()},
+            "reverse": {uid: [addr, times["reverse"].get(uid, 0)]
+                        for uid, addr in LocationCache.location_reverse_data.items()},
+        }
+        serialize.save(path, snapshot)
+        return len(snapshot["forward"]) + len(snapshot["reverse"])
+
+    @staticmethod
+    def _valid_snapshot_entries(path: str, kind: str, entries) -> dict:
+        """
+        Picks out the well-formed entries of one cache in a snapshot, each a location dict and the time it was added.
+        Malformed entries are logged and left out.
+        :param path: The snapshot file, for logging
+        :param kind: "forward" or "reverse"
+        :param entries: The snapshot's entries for the cache
+        :return: Dict of key to (location, time added)
+        :raises ValueError: If the entries are not a dict
+        """
+        if not isinstance(entries, dict):
+            raise ValueError("{0} has no valid {1} cache".format(path, kind))
+        valid = {}
+        for key, entry in entries.items():
+            if isinstance(key, str) and isinstance(entry, (list, tuple)) and len(entry) == 2 \
+                    and isinstance(entry[0], dict) and isinstance(entry[1], (int, float)) \
+                    and not isinstance(entry[1], bool):
+                valid[key] = entry
+            else:
+                logger.debug("Skipping malformed {0} cache entry {1!r} in {2}".format(kind, key, path))
+        if len(valid) < len(entries):
+            logger.warning("Skipped {0} malformed {1} cache entries in {2}".format(len(entries) - len(valid), kind,
+                                                                                  path))
+        return valid
+
+    @staticmethod
+    def import_snapshot(path: str, policy: str = MERGE_POSITIVE) -> int:
+        """
+        Merges a snapshot into the caches
+        :param path: The snapshot file
+        :param policy: MERGE_NEWEST or MERGE_POSITIVE, decides between an entry in the cache and one in the snapshot
+        :return: Number of entries added or replaced, malformed entries are skipped
+        :raises ValueError: If the snapshot is not a location cache snapshot or the policy is unknown
+        """
+        if policy not in MERGE_POLICIES:
+            raise ValueError("Unknown merge policy '{0}'".format(policy))
+        snapshot = serialize.load(path)
+        if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("{0} is not a location cache snapshot".format(path))
+        # Every entry is checked before any is merged, so a bad snapshot cannot leave the caches half merged
+        valid = {kind: LocationCache._valid_snapshot_entries(path, kind, snapshot.get(kind, {}))
+                 for kind in ("forward", "reverse")}
+        changed = 0
+        for kind, data in (("forward", LocationCache.location_data),
+                           ("reverse", LocationCache.location_reverse_data)):
+            times = LocationCache.location_times[kind]
+            entries = valid[kind]
+            if not data:
+                # Nothing to merge with, take the snapshot as it is
+                for key, (value, added) in entries.items():
+                    data[key] = value
+                    times[key] = added
+                changed += len(entries)
+                continue
+            for key, (value, added) in entries.items():
+                if key in data:
+                    current = data[key]
+                    if current == value:
+                        times[key] = max(times.get(key, 0), added)
+                        continue
+                    newer = added > times.get(key, 0)
+                    if policy == MERGE_POSITIVE and bool(current) != bool(value):
+                        newer = bool(value)
+                    if not newer:
+                        continue
+                data[key] = value
+                times[key] = added
+                changed += 1
+        return changed
@@ -0,0 +1,442 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Optional
+from . import compression
+from . import serialize
+
+logger = logging.getLogger(__name__)
+
+# Indexed characterization files are laid out as
+#   header | record 0 | record 1 | ... | scores | metadata | index
+# Each record is one encoded characterization entry and the metadata is a JSON object describing the run. Records are
+# JSON, or msgpack when it is installed, which is recorded in the metadata as "serializer". The
+# index is a table of (sha256 digest, offset, length) entries sorted by digest, so a single entry can be found with a
+# binary search over the memory-mapped file without decoding anything else. Records may be compressed one at a time,
+# which is recorded in the metadata as "compression", so random access still only decompresses the requested record.
+# If the run stored each criterion's normalized score, the scores section is a float32 matrix with one row per entry,
+# in index order, and one column per criterion in the metadata's "criteria". Criteria that could not be evaluated are
+# NaN. Its position is in the metadata as "scores", so the whole dataset can be scored again without decoding records.
+# A file can be updated in place by appending the changed records and a new scores section, metadata and index, then
+# rewriting the header. Replaced records are left behind until the file is written again from scratch.
+CHAR_FILE_MAGIC = b"PYAGCHR\x00"
+CHAR_FILE_VERSION = 1
+
+# magic, version, entry count, metadata offset, index offset
+_HEADER = struct.Struct("<8sIQQQ")
+# sha256 digest, record offset, record length
+_INDEX_ENTRY = struct.Struct("<32sQI")
+# Size of one float32 score
+_VALUE_SIZE = 4
+# In place updates are refused once replaced records take up more than this many times the live records
+MAX_GARBAGE_RATIO = 1.0
+
+
+class CharacterizationWriter:
+    """
+    Streams characterization entries to an indexed characterization file
+    """
+    def __init__(self, path: str, meta: dict = None, codec: str = compression.COMPRESSION_NONE,
+                 fmt: str = serialize.INTERNAL_FORMAT, criteria: list = None):
+        """
+        Constructor
+        :param path: The path of the file to write
+        :param meta: Metadata to store with the entries
+        :param codec: The file compression codec, records are compressed individually
+        :param fmt: The record serialization format
+        :param criteria: List of {"name", "weight"} of the criteria, in the order of each entry's scores
+        """
+        self._path = path
+        self._meta = meta if meta is not None else {}
+        self._criteria_count = 0
+        if criteria:
+            self._meta["criteria"] = criteria
+            self._criteria_count = len(criteria)
+        self._record_codec = compression.record_codec(codec)
+        if self._record_codec != compression.COMPRESSION_NONE:
+            self._meta["compression"] = self._record_codec
+        self._format = fmt
+        if self._format != serialize.FORMAT_JSON:
+            self._meta["serializer"] = self._format
+        self._index = []
+        self._file = open(path + ".tmp", "wb")
+        self._file.write(_HEADER.pack(CHAR_FILE_MAGIC, CHAR_FILE_VERSION, 0, 0, 0))
+
+    def add(self, hash_val: str, entry: dict, scores: list = None) -> None:
+        """
+        Writes an entry. If the same hash is written more than once, the last entry wins.
+        :param hash_val: The sha256 hex digest identifying the entry
+        :param entry: The characterization entry, must be JSON serializable
+        :param scores: The normalized score of each criterion, None for criteria that were not evaluated
+        :return: Nothing
+        """
+        digest = bytes.fromhex(hash_val)
+        if len(digest) != 32:
+            raise ValueError("Invalid characterization hash '{0}'".format(hash_val))
+        data = compression.compress_record(serialize.encode(entry, self._format), self._record_codec)
+        self._index.append((digest, self._file.tell(), len(data), scores))
+        self._file.write(data)
+
+    @property
+    def meta(self) -> dict:
+        return self._meta
+
+    def close(self) -> None:
+        """
+        Writes the metadata and index, then moves the file into place
+        :return: Nothing
+        """
+        if self._file is None:
+            return
+        # Sort is stable, so the last write of a duplicate hash is the last one in its run
+        self._index.sort(key=lambda item: item[0])
+        unique_index = []
+        for item in self._index:
+            if unique_index and unique_index[-1][0] == item[0]:
+                unique_index[-1] = item
+            else:
+                unique_index.append(item)
+
+        if self._criteria_count:
+            # Aligned, so the matrix can be viewed as float32 in place
+            self._file.write(b"\x00" * (-self._file.tell() % 4))
+            self._meta["scores"] = {"offset": self._file.tell(), "criteria": self._criteria_count}
+            for _, _, _, scores in unique_index:
+                self._file.write(_pack_scores(scores, self._criteria_count))
+
+        meta_offset = self._file.tell()
+        self._file.write(serialize.dumpb(self._meta))
+        index_offset = self._file.tell()
+        for digest, offset, length, _ in unique_index:
+            self._file.write(_INDEX_ENTRY.pack(digest, offset, length))
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(CHAR_FILE_MAGIC, CHAR_FILE_VERSION, len(unique_index), meta_offset,
+                                      index_offset))
+        self._file.close()
+        self._file = None
+        os.replace(self._path + ".tmp", self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            self._file = None
+            os.remove(self._path + ".tmp")
+
+
+def _pack_scores(scores: list, criteria_count: int) -> bytes:
+    row = [math.nan] * criteria_count
+    for position, score in enumerate((scores or [])[:criteria_count]):
+        if score is not None:
+            row[position] = score
+    row = array("f", row)
+    if sys.byteorder != "little":
+        row.byteswap()
+    return row.tobytes()
+
+
+def update_characterization(path: str, entries: dict, removed=(), meta: dict = None,
+                            codec: str = compression.COMPRESSION_NONE, fmt: str = serialize.INTERNAL_FORMAT,
+                            criteria: list = None) -> bool:
+    """
+    Updates a characterization file in place, writing only the changed entries. They are appended to the file with a
+    new scores section, metadata and index, and the header is rewritten last, so a reader sees either the old or the
+    new file. Readers that already have the file open keep reading the old entries.
+    :param path: The characterization file
+    :param entries: Dict of hash value to (entry, scores) of the added or changed entries
+    :param removed: Hash values of the removed entries
+    :param meta: Metadata to store with the entries, replaces the old metadata
+    :param codec: The file compression codec, records are compressed individually
+    :param fmt: The record serialization format
+    :param criteria: List of {"name", "weight"} of the criteria, in the order of each entry's scores
+    :return: True if updated, false if the file must be written again from scratch instead, because it does not
+    exist, was written with different options or has too many replaced records
+    """
+    try:
+        old_file = CharacterizationFile(path)
+    except (OSError, ValueError):
+        return False
+    try:
+        record_codec = compression.record_codec(codec)
+        if old_file.meta.get("compression", compression.COMPRESSION_NONE) != record_codec or \
+                old_file.meta.get("serializer", serialize.FORMAT_JSON) != fmt or \
+                old_file.meta.get("criteria", []) != (criteria or []):
+            return False
+        criteria_count = len(criteria) if criteria else 0
+        score_meta = old_file.meta.get("scores")
+        row_size = criteria_count * _VALUE_SIZE
+        # Digest to (offset, length, packed scores) of every entry that stays as it is
+        index = {}
+        for position in range(len(old_file)):
+            digest, offset, length = old_file._index_entry(position)
+            row = b""
+            if criteria_count:
+                row_offset = score_meta["offset"] + position * row_size
+                row = old_file._map[row_offset:row_offset + row_size]
+            index[digest] = (offset, length, row)
+        for hash_val in removed:
+            index.pop(bytes.fromhex(hash_val), None)
+        for hash_val in entries:
+            index.pop(bytes.fromhex(hash_val), None)
+        # The records end where the scores or the metadata start
+        records_end = score_meta["offset"] if score_meta else old_file._meta_offset
+    finally:
+        old_file.close()
+
+    live_size = sum(length for offset, length, row in index.values())
+    garbage_size = records_end - _HEADER.size - live_size
+    if garbage_size > MAX_GARBAGE_RATIO * max(live_size, 1):
+        return False
+
+    new_meta = dict(meta) if meta is not None else {}
+    if criteria:
+        new_meta["criteria"] = criteria
+    if record_codec != compression.COMPRESSION_NONE:
+        new_meta["compression"] = record_codec
+    if fmt != serialize.FORMAT_JSON:
+        new_meta["serializer"] = fmt
+    with open(path, "r+b") as char_file:
+        char_file.seek(0, os.SEEK_END)
+        for hash_val, (entry, scores) in entries.items():
+            digest = bytes.fromhex(hash_val)
+            if len(digest) != 32:
+                raise ValueError("Invalid characterization hash '{0}'".format(hash_val))
+            data = compression.compress_record(serialize.encode(entry, fmt), record_codec)
+            index[digest] = (char_file.tell(), len(data), _pack_scores(scores, criteria_count) if criteria_count
+                             else b"")
+            char_file.write(data)
+        sorted_index = sorted(index.items())
+        if criteria_count:
+            char_file.write(b"\x00" * (-char_file.tell() % 4))
+            new_meta["scores"] = {"offset": char_file.tell(), "criteria": criteria_count}
+            for _, (_, _, row) in sorted_index:
+                char_file.write(row)
+        meta_offset = char_file.tell()
+        char_file.write(serialize.dumpb(new_meta))
+        index_offset = char_file.tell()
+        for digest, (offset, length, _) in sorted_index:
+            char_file.write(_INDEX_ENTRY.pack(digest, offset, length))
+        # Everything the new header points to must be on disk before the header is
+        char_file.flush()
+        os.fsync(char_file.fileno())
+        char_file.seek(0)
+        char_file.write(_HEADER.pack(CHAR_FILE_MAGIC, CHAR_FILE_VERSION, len(sorted_index), meta_offset,
+                                     index_offset))
+    return True
+
+
+class CharacterizationFile:
+    """
+    Memory-mapped, random-access reader for indexed characterization files. Entries are only decoded when requested.
+    """
+    def __init__(self, path: str):
+        """
+        Constructor
+        :param path: The path to the characterization file
+        """
+        self._path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self._file.close()
+            raise ValueError("Characterization file {0} is empty".format(path))
+        magic, version, self._count, self._meta_offset, self._index_offset = _HEADER.unpack_from(self._map, 0)
+        if magic != CHAR_FILE_MAGIC:
+            self.close()
+            raise ValueError("{0} is not a characterization file".format(path))
+        if version != CHAR_FILE_VERSION:
+            self.close()
+            raise ValueError("Unsupported characterization file version {0}".format(version))
+        self._meta = serialize.loads(self._map[self._meta_offset:self._index_offset])
+        self._record_codec = self._meta.get("compression", compression.COMPRESSION_NONE)
+        self._format = self._meta.get("serializer", serialize.FORMAT_JSON)
+        if not serialize.is_available(self._format):
+            self.close()
+            raise ValueError("Reading {0} requires the {1} package".format(path, self._format))
+
+    def _index_entry(self, position: int) -> (bytes, int, int):
+        return _INDEX_ENTRY.unpack_from(self._map, self._index_offset + position * _INDEX_ENTRY.size)
+
+    def _find(self, hash_val: str) -> int:
+        """
+        Binary searches the index for a hash
+        :param hash_val: The sha256 hex digest to find
+        :return: Position in the index, or -1 if not found
+        """
+        try:
+            digest = bytes.fromhex(hash_val)
+        except (ValueError, TypeError):
+            return -1
+        lower = 0
+        upper = self._count
+        while lower < upper:
+            middle = (lower + upper) // 2
+            entry_offset = self._index_offset + middle * _INDEX_ENTRY.size
+            middle_digest = self._map[entry_offset:entry_offset + 32]
+            if middle_digest < digest:
+                lower = middle + 1
+            elif middle_digest > digest:
+                upper = middle
+            else:
+                return middle
+        return -1
+
+    def _decode(self, position: int) -> (str, dict):
+        digest, offset, length = self._index_entry(position)
+        return digest.hex(), serialize.decode(compression.decompress_record(self._map[offset:offset + length],
+                                                                            self._record_codec), self._format)
+
+    def get(self, hash_val: str) -> Optional[dict]:
+        """
+        Gets a single entry
+        :param hash_val: The hash of the entry
+        :return: The entry, or None if it does not exist
+        """
+        position = self._find(hash_val)
+        if position < 0:
+            return None
+        return self._decode(position)[1]
+
+    def keys(self):
+        """
+        Iterates over the entry hashes without decoding entries
+        :return: Generator of entry hashes
+        """
+        for position in range(self._count):
+            yield self._index_entry(position)[0].hex()
+
+    def items(self, offset: int = 0, count: int = 0):
+        """
+        Iterates over a range of entries in index order
+        :param offset: The index of the first entry
+        :param count: The maximum number of entries, 0 for all remaining
+        :return: Generator of (hash, entry) tuples
+        """
+        end = self._count if count <= 0 else min(offset + count, self._count)
+        for position in range(max(offset, 0), end):
+            yield self._decode(position)
+
+    @property
+    def meta(self) -> dict:
+        return self._meta
+
+    @property
+    def criteria(self) -> list:
+        """
+        The criteria the entries were scored on, as {"name", "weight"}, in the order of the score matrix columns
+        """
+        return self._meta.get("criteria", [])
+
+    def scores(self) -> Optional[array]:
+        """
+        Reads the normalized score matrix, one row per entry in index order (the order of keys()) and one column per
+        criterion. Criteria that were not evaluated are NaN.
+        :return: Flat float32 array, or None if the file has no scores
+        """
+        score_meta = self._meta.get("scores")
+        if not score_meta:
+            return None
+        start = score_meta["offset"]
+        matrix = array("f")
+        matrix.frombytes(self._map[start:start + self._count * score_meta["criteria"] * matrix.itemsize])
+        if sys.byteorder != "little":
+            matrix.byteswap()
+        return matrix
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __contains__(self, hash_val) -> bool:
+        return self._find(hash_val) >= 0
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class LegacyCharacterizationFile:
+    """
+    Reader for characterization JSON files written before the indexed format, with the same interface as
+    CharacterizationFile. The whole file is loaded into memory.
+    """
+    def __init__(self, path: str):
+        """
+        Constructor
+        :param path: The path to the characterization JSON file
+        """
+        self._data = serialize.load(path, serialize.FORMAT_JSON)
+        self._keys = list(self._data.keys())
+
+    def get(self, hash_val: str) -> Optional[dict]:
+        return self._data.get(hash_val)
+
+    def keys(self):
+        return iter(self._keys)
+
+    def items(self, offset: int = 0, count: int = 0):
+        end = len(self._keys) if count <= 0 else min(offset + count, len(self._keys))
+        for key in self._keys[max(offset, 0):end]:
+            yield key, self._data[key]
+
+    @property
+    def meta(self) -> dict:
+        return {}
+
+    @property
+    def criteria(self) -> list:
+        return []
+
+    def scores(self) -> Optional[array]:
+        return None
+
+    def close(self) -> None:
+        pass
+
+    def __contains__(self, hash_val) -> bool:
+        return hash_val in self._data
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+def open_characterization(path: str):
+    """
+    Opens a characterization file, detecting whether it is indexed or legacy JSON
+    :param path: The path to the characterization file
+    :return: CharacterizationFile or LegacyCharacterizationFile
+    """
+    with open(path, "rb") as char_file:
+        magic = char_file.read(len(CHAR_FILE_MAGIC))
+    if magic == CHAR_FILE_MAGIC:
+        return CharacterizationFile(path)
+    return LegacyCharacterizationFile(path)
@@ -0,0 +1,394 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import heapq
+import logging
+import math
+import os
+from . import gtfs
+from . import serialize
+
+logger = logging.getLogger(__name__)
+
+COMMUTE_CACHE_DIR = "cache/commute"
+# Walking speed in miles per hour
+DEFAULT_WALK_SPEED = 3.0
+# Furthest walk in miles between the door and a stop, at either end
+DEFAULT_MAX_WALK = 0.75
+# Furthest walk in miles between two stops to transfer
+DEFAULT_TRANSFER_WALK = 0.25
+DEFAULT_WINDOW = "08:00-09:00"
+# Day whose timetable is used, a weekday name for the next such day or a date
+DEFAULT_SERVICE_DAY = "tuesday"
+# Longest wait in minutes assumed for a stop, however rarely it is served
+MAX_WAIT = 30.0
+# Seconds after the departure window during which trips are still ridden
+RIDE_SLACK = 2 * 60 * 60
+# Every route type, buses included
+DEFAULT_ROUTE_TYPES = (0, 1, 2, 3, 4, 5, 6, 7, 11, 12)
+
+EARTH_RADIUS_MI = 3958.8
+
+
+def distance_mi(lat1: float, long1: float, lat2: float, long2: float) -> float:
+    """
+    Distance between two points, as the crow flies. Uses the equirectangular approximation, which is well within a
+    walk's worth of accuracy at city scale and much faster than haversine.
+    :return: Distance in miles
+    """
+    x = math.radians(long2 - long1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_MI * math.sqrt(x * x + y * y)
+
+
+def parse_time(value: str) -> int:
+    """
+    Parses a GTFS or config time, GTFS times past midnight go past 24:00:00
+    :param value: The time, HH:MM or HH:MM:SS
+    :return: Seconds since midnight
+    """
+    parts = [int(part) for part in value.strip().split(":")]
+    if len(parts) == 2:
+        parts.append(0)
+    if len(parts) != 3:
+        raise ValueError("Invalid time '{0}'".format(value))
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def parse_window(window: str) -> (int, int):
+    """
+    Parses a departure window
+    :param window: The window, such as 08:00-09:00
+    :return: Start and end, in seconds since midnight
+    """
+    start, _, end = window.partition("-")
+    start = parse_time(start)
+    end = parse_time(end) if end else start + 3600
+    if end <= start:
+        raise ValueError("Invalid departure window '{0}'".format(window))
+    return start, end
+
+
+class _StopGrid:
+    """
+    Buckets points into cells about a walk wide, so the points near a location are found without checking all of them
+    """
+    def __init__(self, points: list, cell_mi: float):
+        """
+        Constructor
+        :param points: List of (lat, long)
+        :param cell_mi: The cell size in miles, the furthest distance searched for
+        """
+        self._points = points
+        self._cell_lat = cell_mi / 69.0
+        self._cells = {}
+        for position, (lat, long) in enumerate(points):
+            self._cells.setdefault(self._cell(lat, long), []).append(position)
+
+    def _cell(self, lat: float, long: float) -> (int, int):
+        # Long cells are kept to the same width as lat cells, assuming the points are not spread across many degrees
+        # of latitude
+        return int(math.floor(lat / self._cell_lat)), int(math.floor(long * math.cos(math.radians(lat)) /
+                                                                      self._cell_lat))
+
+    def near(self, lat: float, long: float, radius_mi: float):
+        """
+        Finds the points within a radius
+        :return: Generator of (position, distance in miles)
+        """
+        cell_lat, cell_long = self._cell(lat, long)
+        for lat_offset in (-1, 0, 1):
+            for long_offset in (-1, 0, 1):
+                for position in self._cells.get((cell_lat + lat_offset, cell_long + long_offset), ()):
+                    point_lat, point_long = self._points[position]
+                    distance = distance_mi(lat, long, point_lat, point_long)
+                    if distance <= radius_mi:
+                        yield position, distance
+
+
+class TransitGraph:
+    """
+    Transit and walking graph built from GTFS feeds, for one departure window. Stations are nodes, and every route
+    direction serving a station has its own boarding node, so waiting is only counted when boarding:
+        station -> boarding: half the route's headway in the window
+        boarding -> next boarding: the shortest ride between the stops
+        boarding -> station: alighting, free
+        station -> station: walking between nearby stations to transfer
+    Edges are stored reversed, since commutes are searched for from the destination.
+    """
+    def __init__(self):
+        # (lat, long) of each station, and its node
+        self.stations = []
+        self._station_nodes = []
+        # Reversed adjacency, node to list of (previous node, minutes)
+        self._reverse = []
+
+    def _add_node(self) -> int:
+        self._reverse.append([])
+        return len(self._reverse) - 1
+
+    def _add_edge(self, from_node: int, to_node: int, minutes: float) -> None:
+        self._reverse[to_node].append((from_node, minutes))
+
+    @classmethod
+    def from_gtfs(cls, feed_dirs: list, window: (int, int), route_types=DEFAULT_ROUTE_TYPES,
+                  transfer_walk: float = DEFAULT_TRANSFER_WALK, walk_speed: float = DEFAULT_WALK_SPEED,
+                  feed_services: list = None):
+        """
+        Builds the graph from GTFS feeds
+        :param feed_dirs: Directories of the GTFS feeds
+        :param window: Departure window, start and end in seconds since midnight
+        :param route_types: GTFS route types to ride
+        :param transfer_walk: Furthest walk in miles between two stops to transfer
+        :param walk_speed: Walking speed in miles per hour
+        :param feed_services: For each feed, the set of service IDs running on the day, or None to ride every trip.
+        Without a service day, trips of every day would count towards the headways.
+        :return: The graph
+        """
+        graph = cls()
+        window_start, window_end = window
+        window_minutes = (window_end - window_start) / 60.0
+        for feed_index, feed_dir in enumerate(feed_dirs):
+            stops = {row["stop_id"]: row for row in gtfs.read_table(os.path.join(feed_dir, "stops.txt"))}
+            routes = {row["route_id"] for row in gtfs.read_table(os.path.join(feed_dir, "routes.txt"))
+                      if gtfs.get_route_type(row) in route_types}
+            services = feed_services[feed_index] if feed_services else None
+            trip_routes = {}
+            for row in gtfs.read_table(os.path.join(feed_dir, "trips.txt")):
+                if services is not None and row["service_id"] not in services:
+                    continue
+                if row["route_id"] in routes:
+                    trip_routes[row["trip_id"]] = (row["route_id"], row.get("direction_id") or "0")
+
+            # Stops of each trip in the window, as (sequence, station, arrival, departure)
+            trip_stops = {}
+            for row in gtfs.read_table(os.path.join(feed_dir, "stop_times.txt")):
+                if row["trip_id"] not in trip_routes or row["stop_id"] not in stops:
+                    continue
+                try:
+                    arrival = parse_time(row["arrival_time"] or row["departure_time"])
+                    departure = parse_time(row["departure_time"] or row["arrival_time"])
+                except ValueError:
+                    # Untimed stops between timepoints
+                    continue
+                if departure < window_start or arrival > window_end + RIDE_SLACK:
+                    continue
+                trip_stops.setdefault(row["trip_id"], []).append((int(row["stop_sequence"]),
+                                                                  gtfs.get_station_id(stops, row["stop_id"]),
+                                                                  arrival, departure))
+
+            station_nodes = {}
+
+            def station_node(station_id: str) -> int:
+                if station_id not in station_nodes:
+                    stop = stops[station_id]
+                    station_nodes[station_id] = graph._add_node()
+                    graph.stations.append((float(stop["stop_lat"]), float(stop["stop_lon"])))
+                    graph._station_nodes.append(station_nodes[station_id])
+                return station_nodes[station_id]
+
+            boarding_nodes = {}
+            departures = {}
+            rides = {}
+            for trip_id, trip in trip_stops.items():
+                route = trip_routes[trip_id]
+                trip.sort()
+                for sequence, station_id, arrival, departure in trip:
+                    key = (station_id, route)
+                    if key not in boarding_nodes:
+                        boarding_nodes[key] = None
+                    if departure <= window_end:
+                        departures[key] = departures.get(key, 0) + 1
+                for (_, from_station, _, departure), (_, to_station, arrival, _) in zip(trip, trip[1:]):
+                    edge = ((from_station, route), (to_station, route))
+                    minutes = max(arrival - departure, 0) / 60.0
+                    if minutes < rides.get(edge, math.inf):
+                        rides[edge] = minutes
+
+            for key in boarding_nodes:
+                station = station_node(key[0])
+                boarding_nodes[key] = graph._add_node()
+                if departures.get(key):
+                    wait = min(window_minutes / departures[key] / 2.0, MAX_WAIT)
+                    graph._add_edge(station, boarding_nodes[key], wait)
+                graph._add_edge(boarding_nodes[key], station, 0.0)
+            for (from_key, to_key), minutes in rides.items():
+                graph._add_edge(boarding_nodes[from_key], boarding_nodes[to_key], minutes)
+            logger.debug("Feed {0}: {1} stations, {2} route stops, {3} rides".format(
+                feed_index, len(station_nodes), len(boarding_nodes), len(rides)))
+
+        # Transfers, between the stations of different feeds too
+        grid = _StopGrid(graph.stations, transfer_walk)
+        for station, (lat, long) in enumerate(graph.stations):
+            for other, distance in grid.near(lat, long, transfer_walk):
+                if other != station:
+                    graph._add_edge(graph._station_nodes[station], graph._station_nodes[other],
+                                    distance / walk_speed * 60.0)
+        return graph
+
+    def times_to(self, destination: (float, float), max_walk: float = DEFAULT_MAX_WALK,
+                 walk_speed: float = DEFAULT_WALK_SPEED) -> list:
+        """
+        Finds the time from every station to a destination, with one reverse search from the destination
+        :param destination: (lat, long) of the destination
+        :param max_walk: Furthest walk in miles from the last stop to the destination
+        :param walk_speed: Walking speed in miles per hour
+        :return: List of minutes from each station, math.inf if it cannot reach the destination
+        """
+        times = [math.inf] * len(self._reverse)
+        queue = []
+        grid = _StopGrid(self.stations, max_walk)
+        for station, distance in grid.near(destination[0], destination[1], max_walk):
+            node = self._station_nodes[station]
+            minutes = distance / walk_speed * 60.0
+            if minutes < times[node]:
+                times[node] = minutes
+                queue.append((minutes, node))
+        heapq.heapify(queue)
+        while queue:
+            minutes, node = heapq.heappop(queue)
+            if minutes > times[node]:
+                continue
+            for previous, edge_minutes in self._reverse[node]:
+                previous_minutes = minutes + edge_minutes
+                if previous_minutes < times[previous]:
+                    times[previous] = previous_minutes
+                    heapq.heappush(queue, (previous_minutes, previous))
+        return [times[node] for node in self._station_nodes]
+
+
+class CommuteTable:
+    """
+    Commute time from every station to one destination. Looking up a listing only checks the stations within a walk
+    of it.
+    """
+    def __init__(self, destination: (float, float), stations: list, max_walk: float = DEFAULT_MAX_WALK,
+                 walk_speed: float = DEFAULT_WALK_SPEED):
+        """
+        Constructor
+        :param destination: (lat, long) of the destination
+        :param stations: List of (lat, long, minutes to the destination), of the stations that can reach it
+        :param max_walk: Furthest walk in miles from the door to the first stop
+        :param walk_speed: Walking speed in miles per hour
+        """
+        self._destination = (float(destination[0]), float(destination[1]))
+        self._stations = [(float(lat), float(long), float(minutes)) for lat, long, minutes in stations]
+        self._max_walk = max_walk
+        self._walk_speed = walk_speed
+        self._grid = _StopGrid([(lat, long) for lat, long, _ in self._stations], max_walk)
+
+    def commute_time(self, coords) -> float:
+        """
+        Gets the door-to-door commute time from a location, the quickest of walking to any nearby station and riding
+        from there, or walking the whole way
+        :param coords: [lat, long] of the location
+        :return: Minutes
+        """
+        lat, long = float(coords[0]), float(coords[1])
+        best = distance_mi(lat, long, *self._destination) / self._walk_speed * 60.0
+        for position, distance in self._grid.near(lat, long, self._max_walk):
+            minutes = distance / self._walk_speed * 60.0 + self._stations[position][2]
+            if minutes < best:
+                best = minutes
+        return best
+
+    def __len__(self) -> int:
+        return len(self._stations)
+
+    def to_dict(self) -> dict:
+        return {"destination": list(self._destination), "stations": [list(station) for station in self._stations],
+                "max_walk": self._max_walk, "walk_speed": self._walk_speed}
+
+    @classmethod
+    def from_dict(cls, table: dict) -> "CommuteTable":
+        return cls(table["destination"], table["stations"], table["max_walk"], table["walk_speed"])
+
+
+# Graphs built this run, so criteria sharing feeds and a window only read the feeds once
+_graphs = {}
+
+
+def _feed_signature(feed_dirs: list) -> list:
+    # Size and modification time of every feed file, cheap to check and changes whenever a feed is updated
+    signature = []
+    for feed_dir in feed_dirs:
+        for file_name in gtfs.GTFS_FILES:
+            path = os.path.join(feed_dir, file_name)
+            if file_name in gtfs.CALENDAR_FILES and not os.path.isfile(path):
+                signature.append((os.path.abspath(path), None))
+                continue
+            stat = os.stat(path)
+            signature.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+def load_commute_table(feed_dirs: list, destination: (float, float), window: str = DEFAULT_WINDOW,
+                       route_types=DEFAULT_ROUTE_TYPES, max_walk: float = DEFAULT_MAX_WALK,
+                       walk_speed: float = DEFAULT_WALK_SPEED, transfer_walk: float = DEFAULT_TRANSFER_WALK,
+                       service_day: str = DEFAULT_SERVICE_DAY, cache_dir: str = COMMUTE_CACHE_DIR) -> CommuteTable:
+    """
+    Gets the commute table for a destination and departure window. Tables are cached on disk, and a table is only
+    computed again when the feeds, the services running on the day or any of the parameters change.
+    :param feed_dirs: Directories of the GTFS feeds
+    :param destination: (lat, long) of the destination
+    :param window: Departure window, such as 08:00-09:00
+    :param route_types: GTFS route types to ride
+    :param max_walk: Furthest walk in miles between the door and a stop
+    :param walk_speed: Walking speed in miles per hour
+    :param transfer_walk: Furthest walk in miles between two stops to transfer
+    :param service_day: The day whose timetable is used, a date such as 2021-09-14 or a weekday for the next such day
+    :param cache_dir: Directory of the cached tables, empty to not cache them
+    :return: The commute table
+    """
+    window_range = parse_window(window)
+    service_date = gtfs.parse_service_day(service_day)
+    feed_services = [gtfs.active_services(feed_dir, service_date) for feed_dir in feed_dirs]
+    for feed_dir, services in zip(feed_dirs, feed_services):
+        if services is not None and not services:
+            logger.warning("No service runs in {0} on {1}".format(feed_dir, service_date.isoformat()))
+    # Keyed on the services rather than the date, so a table stays valid on every day with the same timetable
+    graph_key = repr((_feed_signature(feed_dirs), window_range, sorted(route_types), transfer_walk, walk_speed,
+                      [sorted(services) if services is not None else None for services in feed_services]))
+    table_key = hashlib.sha256(repr((graph_key, round(destination[0], 5), round(destination[1], 5),
+                                     max_walk)).encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, table_key + ".json") if cache_dir else ""
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            return CommuteTable.from_dict(serialize.load(cache_path))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not read commute table {0}: {1}".format(cache_path, e))
+
+    graph = _graphs.get(graph_key)
+    if graph is None:
+        logger.info("Building transit graph from {0}".format(", ".join(feed_dirs)))
+        graph = TransitGraph.from_gtfs(feed_dirs, window_range, route_types, transfer_walk, walk_speed, feed_services)
+        _graphs[graph_key] = graph
+    times = graph.times_to(destination, max_walk, walk_speed)
+    stations = [(lat, long, minutes) for (lat, long), minutes in zip(graph.stations, times) if minutes < math.inf]
+    logger.info("{0} of {1} stations reach the commute destination".format(len(stations), len(graph.stations)))
+    table = CommuteTable(destination, stations, max_walk, walk_speed)
+
+    if cache_path:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            serialize.save(cache_path, table.to_dict())
+        except OSError as e:
+            logger.warning("Could not save commute table {0}: {1}".format(cache_path, e))
+    return table
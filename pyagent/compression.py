@@ -0,0 +1,158 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import gzip
+import io
+import logging
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# File compression codecs and their extensions
+COMPRESSION_NONE = "none"
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+EXTENSIONS = {COMPRESSION_NONE: "", COMPRESSION_GZIP: ".gz", COMPRESSION_ZSTD: ".zst"}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Feed formats for compressed scrape results, for the FEED_EXPORTERS setting. The exporters import scrapy, so they
+# are given by path.
+FEED_EXPORTERS = {
+    "jsonlines": "pyagent.exporters.FastJsonLinesItemExporter",
+    "jsonlines_gzip": "pyagent.exporters.GzipJsonLinesItemExporter",
+    "jsonlines_zstd": "pyagent.exporters.ZstdJsonLinesItemExporter",
+}
+FEED_FORMATS = {
+    COMPRESSION_NONE: "jsonlines",
+    COMPRESSION_GZIP: "jsonlines_gzip",
+    COMPRESSION_ZSTD: "jsonlines_zstd",
+}
+
+
+def is_available(codec: str) -> bool:
+    """
+    Checks whether a codec can be used, zstd needs the optional zstandard package
+    :param codec: The codec name
+    :return: True if available, false if otherwise
+    """
+    if codec == COMPRESSION_ZSTD:
+        return zstandard is not None
+    return codec in EXTENSIONS
+
+
+def codec_for_path(path: str) -> str:
+    """
+    Gets the codec a file is compressed with from its extension
+    :param path: The file path
+    :return: The codec name
+    """
+    for codec, extension in EXTENSIONS.items():
+        if extension and path.endswith(extension):
+            return codec
+    return COMPRESSION_NONE
+
+
+def strip_extension(path: str) -> str:
+    """
+    Removes the compression extension from a path
+    :param path: The file path
+    :return: The path without the compression extension
+    """
+    extension = EXTENSIONS[codec_for_path(path)]
+    return path[:-len(extension)] if extension else path
+
+
+def open_compressed(path: str, mode: str = "rt"):
+    """
+    Opens a file, compressed or not, based on its extension. Reads and writes are streamed, so large files are never
+    held in memory.
+    :param path: The file path, ending in .gz or .zst for a compressed file
+    :param mode: The open mode, "r", "w" or "a", with "t" (the default) or "b"
+    :return: File object
+    """
+    binary = "b" in mode
+    base_mode = mode.replace("t", "").replace("b", "")
+    codec = codec_for_path(path)
+    if codec == COMPRESSION_GZIP:
+        if binary:
+            return gzip.open(path, base_mode + "b", compresslevel=GZIP_LEVEL)
+        return gzip.open(path, base_mode + "t", compresslevel=GZIP_LEVEL, encoding="utf-8")
+    if codec == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise OSError("Reading {0} requires the zstandard package".format(path))
+        raw_file = open(path, base_mode + "b")
+        if base_mode == "r":
+            # Appended runs are separate frames
+            stream = zstandard.ZstdDecompressor().stream_reader(raw_file, read_across_frames=True, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw_file, closefd=True)
+        if binary:
+            return stream
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    if binary:
+        return open(path, base_mode + "b")
+    return open(path, base_mode, encoding="utf-8")
+
+
+def compress_record(data: bytes, codec: str) -> bytes:
+    """
+    Compresses a single record, for files that are read one record at a time
+    :param data: The record
+    :param codec: "zlib", "zstd" or "none"
+    :return: The compressed record
+    """
+    if codec == "zlib":
+        return zlib.compress(data, GZIP_LEVEL)
+    if codec == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def decompress_record(data: bytes, codec: str) -> bytes:
+    """
+    Decompresses a single record
+    :param data: The compressed record
+    :param codec: "zlib", "zstd" or "none"
+    :return: The record
+    """
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("Reading zstd compressed records requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def record_codec(codec: str) -> str:
+    """
+    Gets the per-record codec matching a file codec. Single records are too small for gzip's headers to be worth it,
+    so gzip files use bare zlib records.
+    :param codec: The file codec
+    :return: The record codec
+    """
+    if codec == COMPRESSION_GZIP:
+        return "zlib"
+    return codec
@@ -19,9 +19,15 @@
 import haversine
 import logging
 from enum import Enum
+from . import commute
+from . import raster
+from . import stations
 
 logger = logging.getLogger(__name__)
 
+# Placeholder square footages some listings use when the size is not known
+FAKE_SQFT_VALUES = ("999", "9999")
+
 
 class ResultFormat(Enum):
     Generic = 1,
@@ -29,7 +35,8 @@ class ResultFormat(Enum):
     SquareFoot = 3,
     Bedrooms = 4,
     Bathrooms = 5,
-    Miles = 6
+    Miles = 6,
+    Minutes = 7
 
 
 class Criterion:
@@ -59,6 +66,8 @@ class Criterion:
             return "{0} Bath".format(info)
         elif result_format == ResultFormat.Miles:
             return "{0} mi".format(info)
+        elif result_format == ResultFormat.Minutes:
+            return "{0} min".format(info)
         else:
             logger.warning("Invalid result format passed to criterion: {0}!".format(result_format))
             return info
@@ -205,7 +214,7 @@ class CriterionSqFt(CriterionGreater):
     Housing criterion for square footage, but filters out fake values.
     """
     def evaluate(self, data) -> float:
-        if data == "999" or data == "9999":
+        if data in FAKE_SQFT_VALUES:
             return 0
         result = CriterionGreater.evaluate(self, data)
         return result
@@ -244,6 +253,42 @@ class CriterionTrain(Criterion):
         self._weight = weight
         self._max_distance = max_distance
         self._required = required
+        self._raster_enabled = True
+        self._raster_cell = raster.DEFAULT_CELL_MI
+        self._raster_bounds = None
+        # The raster, and the train data it was built for
+        self._raster = None
+        self._raster_data = None
+
+    def set_raster_options(self, enabled: bool = True, cell_mi: float = raster.DEFAULT_CELL_MI,
+                           bounds: list = None) -> None:
+        """
+        Sets up the precomputed distance raster
+        :param enabled: Whether to use a raster at all
+        :param cell_mi: Grid spacing in miles
+        :param bounds: [south, west, north, east] of the grid, by default the area around the stations
+        :return: Nothing
+        """
+        self._raster_enabled = enabled
+        self._raster_cell = cell_mi
+        self._raster_bounds = bounds
+        self._raster = None
+        self._raster_data = None
+
+    def _get_raster(self):
+        if not self._raster_enabled or not Criterion.train_data:
+            return None
+        if self._raster_data is not Criterion.train_data:
+            self._raster_data = Criterion.train_data
+            if isinstance(Criterion.train_data, stations.StationIndex):
+                station_coords = list(Criterion.train_data.iter_coords())
+                digest = Criterion.train_data.digest
+            else:
+                station_coords = [station["coords"] for station in Criterion.train_data]
+                digest = stations.station_digest(Criterion.train_data)
+            self._raster = raster.load_station_distance_raster(station_coords, digest, self._max_distance,
+                                                               self._raster_cell, self._raster_bounds)
+        return self._raster
 
     def evaluate(self, data) -> float:
         """
@@ -251,23 +296,105 @@ class CriterionTrain(Criterion):
         :param data: Should be housing coords
         :return:
         """
-        # Find closest train
-        closest_station = []
-        closest_distance = None
         if not data:
             return -1
-        for station in Criterion.train_data:
-            distance = haversine.haversine(station["coords"], data, unit=haversine.Unit.MILES)
-            if closest_distance is None:
-                closest_distance = distance
-                closest_station = station
-                continue
-            elif distance < closest_distance:
+        # The raster is capped at max_distance, so listings further out only know they get no points. The default
+        # raster covers everything within max_distance of a station, so listings off it are further out too. Only
+        # listings off a raster with configured bounds are worked out from the stations.
+        station_raster = self._get_raster()
+        if station_raster is not None:
+            closest_distance = station_raster.sample(data[0], data[1])
+            if closest_distance is None and self._raster_bounds is None:
+                closest_distance = self._max_distance
+            if closest_distance is not None:
+                if closest_distance >= self._max_distance:
+                    self._result_info = Criterion.format_result(self._result_format,
+                                                                "> {0:2.2f}".format(self._max_distance))
+                    return 0
+                self._result_info = Criterion.format_result(self._result_format,
+                                                            "{0:2.2f}".format(closest_distance))
+                return self._weight - Criterion.map_to_range(closest_distance, 0, self._max_distance, self._weight)
+
+        # Find closest train
+        closest_distance = None
+        if hasattr(Criterion.train_data, "iter_coords"):
+            # Station index, only the coordinates are needed
+            station_coords = Criterion.train_data.iter_coords()
+        else:
+            station_coords = (station["coords"] for station in Criterion.train_data)
+        for coords in station_coords:
+            distance = haversine.haversine(coords, data, unit=haversine.Unit.MILES)
+            if closest_distance is None or distance < closest_distance:
                 closest_distance = distance
-                closest_station = station
 
         if closest_distance is not None:
             self._result_info = Criterion.format_result(self._result_format, "{0:2.2f}".format(closest_distance))
             return self._weight - Criterion.map_to_range(closest_distance, 0, self._max_distance, self._weight)
         return 0
 
+
+class CriterionCommute(Criterion):
+    """
+    Housing criterion for door-to-door commute time to a destination, over transit and walking. The commute time
+    from every station is found with one search from the destination the first time the criterion is evaluated, so
+    each listing only needs the stations near it.
+    """
+    def __init__(self, name: str, key: str, weight: int, max_minutes: float, destination: list, feeds: list,
+                 window: str = commute.DEFAULT_WINDOW, route_types=commute.DEFAULT_ROUTE_TYPES,
+                 max_walk: float = commute.DEFAULT_MAX_WALK, walk_speed: float = commute.DEFAULT_WALK_SPEED,
+                 service_day: str = commute.DEFAULT_SERVICE_DAY, result_format: ResultFormat = ResultFormat.Minutes,
+                 required: bool = False):
+        """
+        Constructor
+        :param name: The user-facing name of the criterion
+        :param key: The key from the scrape data to evaluate, must be coordinates
+        :param weight: The weight of the criterion in points, ex. 100 means it will contribute at most 100 points
+        :param max_minutes: Commutes this long or longer get no points
+        :param destination: [lat, long] of the destination, such as a workplace
+        :param feeds: Directories of the GTFS feeds to ride
+        :param window: Departure window, such as 08:00-09:00
+        :param route_types: GTFS route types to ride
+        :param max_walk: Furthest walk in miles between the door and a stop
+        :param walk_speed: Walking speed in miles per hour
+        :param service_day: The day whose timetable is used, a date such as 2021-09-14 or a weekday
+        :param result_format: How to format the result info string
+        :param required: If the criterion is required. If required, when it cannot be evaluated the housing will be
+        discarded. When false, if the criterion cannot be evaluated, then it simply will not be considered.
+        """
+        Criterion.__init__(self, name, key, weight, result_format, required)
+        self._max_minutes = max_minutes
+        self._destination = destination
+        self._feeds = feeds
+        self._window = window
+        self._route_types = route_types
+        self._max_walk = max_walk
+        self._walk_speed = walk_speed
+        self._service_day = service_day
+        self._table = None
+        self._failed = False
+
+    def _get_table(self):
+        if self._table is None and not self._failed:
+            try:
+                self._table = commute.load_commute_table(self._feeds, self._destination, self._window,
+                                                         self._route_types, self._max_walk, self._walk_speed,
+                                                         service_day=self._service_day)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error("Failed to compute commute times for {0}: {1}".format(self._name, e))
+                self._failed = True
+        return self._table
+
+    def evaluate(self, data) -> float:
+        """
+        Determine how long the commute is
+        :param data: Should be housing coords
+        :return:
+        """
+        if not data:
+            return -1
+        table = self._get_table()
+        if table is None:
+            return -1
+        minutes = table.commute_time(data)
+        self._result_info = Criterion.format_result(self._result_format, "{0:.0f}".format(minutes))
+        return self._weight - Criterion.map_to_range(minutes, 0, self._max_minutes, self._weight)
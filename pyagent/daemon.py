@@ -0,0 +1,221 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import glob
+import json
+import os
+import time
+from . import compression
+from . import serialize
+
+logger = logging.getLogger(__name__)
+
+# Default seconds between scrapes of a source
+DEFAULT_INTERVAL = 6 * 60 * 60
+
+DELTA_UPSERT = "upsert"
+DELTA_REMOVE = "remove"
+
+
+class SourceSchedule:
+    """
+    Tracks when each source is next due to be scraped
+    """
+    def __init__(self, intervals: dict):
+        """
+        Constructor
+        :param intervals: Dict of source key to seconds between scrapes
+        """
+        self._intervals = dict(intervals)
+        # Everything is due at start up
+        self._next_run = {key: 0.0 for key in self._intervals}
+
+    def due(self, now: float = None) -> list:
+        """
+        Gets the sources that are due
+        :param now: The current time, defaults to time.time()
+        :return: List of source keys
+        """
+        if now is None:
+            now = time.time()
+        return [key for key, next_run in self._next_run.items() if next_run <= now]
+
+    def mark_run(self, source_key: str, now: float = None) -> None:
+        """
+        Schedules the next scrape of a source
+        :param source_key: The source key
+        :param now: The time the scrape started, defaults to time.time()
+        :return: Nothing
+        """
+        if now is None:
+            now = time.time()
+        self._next_run[source_key] = now + self._intervals[source_key]
+
+    def seconds_until_due(self, now: float = None) -> float:
+        """
+        Gets the time until the next source is due
+        :param now: The current time, defaults to time.time()
+        :return: Seconds, 0 if a source is already due
+        """
+        if now is None:
+            now = time.time()
+        if not self._next_run:
+            return DEFAULT_INTERVAL
+        return max(0.0, min(self._next_run.values()) - now)
+
+
+def _fingerprint(housing: dict) -> str:
+    # UIDs are assigned per run, so they do not count as a change
+    return json.dumps({key: value for key, value in housing.items() if key != "uid"}, sort_keys=True)
+
+
+def listing_scope(housing: dict) -> tuple:
+    """
+    Gets the part of a scrape a listing came from, the unit that is replaced when it is scraped again
+    :param housing: The listing
+    :return: (source name, region), region is None outside of multi-region scrapes
+    """
+    return housing.get("source"), housing.get("region")
+
+
+class ListingState:
+    """
+    The current set of listings, keyed by a stable listing ID. Scrape cycles are applied as deltas, so only listings
+    that were added, changed or removed are written out.
+    """
+    def __init__(self, key_func):
+        """
+        Constructor
+        :param key_func: Callable taking a listing and returning its stable ID
+        """
+        self._key_func = key_func
+        self._listings = {}
+        self._fingerprints = {}
+        self._next_uid = 1
+
+    def __len__(self) -> int:
+        return len(self._listings)
+
+    def get(self, listing_id: str):
+        return self._listings.get(listing_id)
+
+    def items(self):
+        return self._listings.items()
+
+    def _set(self, listing_id: str, housing: dict) -> None:
+        self._listings[listing_id] = housing
+        self._fingerprints[listing_id] = _fingerprint(housing)
+        if isinstance(housing.get("uid"), int):
+            self._next_uid = max(self._next_uid, housing["uid"] + 1)
+
+    def load(self, listings) -> None:
+        """
+        Replaces the state with a full set of listings
+        :param listings: Iterable of listings
+        :return: Nothing
+        """
+        self._listings = {}
+        self._fingerprints = {}
+        for housing in listings:
+            self._set(self._key_func(housing), housing)
+
+    def apply(self, delta: list) -> None:
+        """
+        Applies delta records
+        :param delta: List of delta records
+        :return: Nothing
+        """
+        for record in delta:
+            if record["op"] == DELTA_UPSERT:
+                self._set(record["id"], record["housing"])
+            elif record["op"] == DELTA_REMOVE:
+                self._listings.pop(record["id"], None)
+                self._fingerprints.pop(record["id"], None)
+
+    def diff(self, listings: list, scopes: set) -> list:
+        """
+        Compares freshly scraped listings against the state
+        :param listings: The listings scraped this cycle
+        :param scopes: The listing scopes (see listing_scope) that were fully scraped this cycle, their listings that
+        were not seen again are removed
+        :return: List of delta records, empty if nothing changed
+        """
+        delta = []
+        seen = set()
+        for housing in listings:
+            listing_id = self._key_func(housing)
+            if listing_id in seen:
+                continue
+            seen.add(listing_id)
+            old = self._listings.get(listing_id)
+            if old is not None and self._fingerprints[listing_id] == _fingerprint(housing):
+                continue
+            # Keep the UID of a listing that changed, new listings continue the numbering
+            housing = dict(housing)
+            if old is not None:
+                housing["uid"] = old["uid"]
+            else:
+                housing["uid"] = self._next_uid
+                self._next_uid += 1
+            delta.append({"op": DELTA_UPSERT, "id": listing_id, "housing": housing})
+        for listing_id, housing in self._listings.items():
+            if listing_id not in seen and listing_scope(housing) in scopes:
+                delta.append({"op": DELTA_REMOVE, "id": listing_id})
+        return delta
+
+
+def get_delta_dir(cache_path: str) -> str:
+    """
+    Gets the directory holding the deltas applied on top of a scrape results file
+    :param cache_path: The scrape results file
+    :return: Delta directory path
+    """
+    base, _ = os.path.splitext(compression.strip_extension(cache_path))
+    return base + ".deltas"
+
+
+def write_delta(cache_path: str, delta: list) -> str:
+    """
+    Writes a cycle's delta next to the scrape results file it applies to
+    :param cache_path: The scrape results file
+    :param delta: The delta records
+    :return: The delta file path
+    """
+    delta_dir = get_delta_dir(cache_path)
+    if not os.path.isdir(delta_dir):
+        os.makedirs(delta_dir)
+    # Zero padded, so the files sort in the order they were written
+    delta_path = os.path.join(delta_dir, "{0:06d}.json".format(len(glob.glob(os.path.join(delta_dir, "*.json"))) + 1))
+    temp_path = delta_path + ".tmp"
+    with open(temp_path, "w") as delta_file:
+        for record in delta:
+            delta_file.write(serialize.dumps(record) + "\n")
+    os.replace(temp_path, delta_path)
+    return delta_path
+
+
+def read_deltas(cache_path: str):
+    """
+    Reads every delta written on top of a scrape results file, oldest first
+    :param cache_path: The scrape results file
+    :return: Generator of delta record lists
+    """
+    for delta_path in sorted(glob.glob(os.path.join(get_delta_dir(cache_path), "*.json"))):
+        with open(delta_path, "r") as delta_file:
+            yield [serialize.loads(line) for line in delta_file if line.strip()]
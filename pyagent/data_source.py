@@ -17,6 +17,8 @@
 """
 
 import logging
+import importlib
+from typing import Union
 from .spider import BaseSpider
 
 logger = logging.getLogger(__name__)
@@ -26,13 +28,14 @@ class Source:
     """
     A housing data source definition
     """
-    def __init__(self, key: str, name: str, required_conf: [str], spider: BaseSpider):
+    def __init__(self, key: str, name: str, required_conf: [str], spider: Union[BaseSpider, str]):
         """
         Initialize the data source
         :param key: A unique key that represents this source, used in options.ini
         :param name: A user-friendly name of this source
         :param required_conf: A list of required config keys
-        :param spider: The spider object for scraping data
+        :param spider: The spider object for scraping data, or its class as a "module:class" path, which is only
+        imported once the spider is first used
         """
         self._key = key
         self._name = name
@@ -68,7 +71,7 @@ class Source:
         Called after config loaded but before scrape
         :return: Nothing
         """
-        self._spider.init(config=self._config)
+        self.spider.init(config=self._config)
 
     @property
     def key(self) -> str:
@@ -80,4 +83,8 @@ class Source:
 
     @property
     def spider(self) -> BaseSpider:
+        if isinstance(self._spider, str):
+            module_name, _, class_name = self._spider.partition(":")
+            logger.debug("Loading spider for source {0} from {1}".format(self._key, self._spider))
+            self._spider = getattr(importlib.import_module(module_name), class_name)()
         return self._spider
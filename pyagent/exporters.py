@@ -0,0 +1,61 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import gzip
+from scrapy.exporters import JsonLinesItemExporter
+from . import compression
+from . import serialize
+
+
+class FastJsonLinesItemExporter(JsonLinesItemExporter):
+    """
+    JSON lines feed exporter that encodes with orjson when it is installed, the output is the same JSON
+    """
+    def export_item(self, item):
+        itemdict = dict(self._get_serialized_fields(item))
+        self.file.write(serialize.dumpb(itemdict) + b"\n")
+
+
+class GzipJsonLinesItemExporter(FastJsonLinesItemExporter):
+    """
+    JSON lines feed exporter that gzips the feed as it is written
+    """
+    def __init__(self, file, **kwargs):
+        self._raw_file = file
+        self._compressed_file = gzip.GzipFile(fileobj=file, mode="wb", compresslevel=compression.GZIP_LEVEL)
+        super(GzipJsonLinesItemExporter, self).__init__(self._compressed_file, **kwargs)
+
+    def finish_exporting(self):
+        # Only ends the gzip stream, scrapy closes the underlying file
+        self._compressed_file.close()
+
+
+class ZstdJsonLinesItemExporter(FastJsonLinesItemExporter):
+    """
+    JSON lines feed exporter that compresses the feed with zstd as it is written
+    """
+    def __init__(self, file, **kwargs):
+        if compression.zstandard is None:
+            raise RuntimeError("zstd feeds require the zstandard package")
+        self._raw_file = file
+        self._compressed_file = compression.zstandard.ZstdCompressor(level=compression.ZSTD_LEVEL).stream_writer(
+            file, closefd=False)
+        super(ZstdJsonLinesItemExporter, self).__init__(self._compressed_file, **kwargs)
+
+    def finish_exporting(self):
+        self._compressed_file.close()
@@ -0,0 +1,114 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import lxml.etree
+import lxml.html
+from parsel.csstranslator import HTMLTranslator
+
+logger = logging.getLogger(__name__)
+
+_translator = HTMLTranslator()
+
+
+def compile_css(css: str) -> lxml.etree.XPath:
+    """
+    Compiles a CSS selector once, instead of on every query. Supports the same ::text and ::attr(name) pseudo
+    elements as scrapy, and matches exactly what response.css() would.
+    :param css: The CSS selector
+    :return: Compiled XPath
+    """
+    return lxml.etree.XPath(_translator.css_to_xpath(css))
+
+
+def get_root(document):
+    """
+    Gets the lxml tree of a document, without parsing it again if scrapy already has
+    :param document: A scrapy response, a selector, an lxml element or HTML text
+    :return: Root lxml element
+    """
+    if isinstance(document, lxml.etree._Element):
+        return document
+    if isinstance(document, (str, bytes)):
+        return parse_html(document)
+    # Responses parse lazily into response.selector, selectors hold their element in root
+    selector = getattr(document, "selector", document)
+    return selector.root
+
+
+def parse_html(html) -> lxml.etree._Element:
+    """
+    Parses an HTML page into an lxml tree, for pages that did not come through scrapy
+    :param html: The HTML page, str or bytes
+    :return: Root lxml element
+    """
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    parser = lxml.html.HTMLParser(recover=True, encoding="utf-8")
+    root = lxml.etree.fromstring(html, parser=parser)
+    if root is None:
+        root = lxml.etree.fromstring(b"<html/>", parser=parser)
+    return root
+
+
+def _to_text(result) -> str:
+    # Text and attribute results are strings already, element results are serialized like selector.extract()
+    if isinstance(result, lxml.etree._Element):
+        return lxml.etree.tostring(result, method="html", encoding="unicode", with_tail=False)
+    return str(result)
+
+
+class FieldSet:
+    """
+    A group of fields extracted together from one element, such as a listing card or a unit row. Every selector is
+    compiled once when the field set is created, and extracting reads all of the fields straight from the lxml tree
+    without building a selector object per query.
+    """
+    def __init__(self, fields: dict, lists: dict = None):
+        """
+        Constructor
+        :param fields: Dict of field name to CSS selector, the first match is extracted
+        :param lists: Dict of field name to CSS selector, every match is extracted as a list
+        """
+        self._fields = [(name, compile_css(css)) for name, css in fields.items()]
+        self._lists = [(name, compile_css(css)) for name, css in (lists or {}).items()]
+
+    def extract(self, node) -> dict:
+        """
+        Extracts every field from an element
+        :param node: The lxml element, or anything get_root accepts
+        :return: Dict of field name to the first match as a string, or None, and list field name to list of strings
+        """
+        if not isinstance(node, lxml.etree._Element):
+            node = get_root(node)
+        values = {}
+        for name, xpath in self._fields:
+            result = xpath(node)
+            values[name] = _to_text(result[0]) if result else None
+        for name, xpath in self._lists:
+            values[name] = [_to_text(result) for result in xpath(node)]
+        return values
+
+    def extract_each(self, xpath: lxml.etree.XPath, document) -> list:
+        """
+        Extracts the fields from every element matching a selector, such as each card on a search page
+        :param xpath: Compiled selector for the elements, from compile_css
+        :param document: The page, or anything get_root accepts
+        :return: List of field dicts, one per element
+        """
+        return [self.extract(node) for node in xpath(get_root(document))]
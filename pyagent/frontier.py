@@ -0,0 +1,495 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+from abc import ABC, abstractmethod
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Optional
+from . import serialize
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker may hold a pulled task before it is handed to another worker
+DEFAULT_LEASE = 300
+# Number of tasks a spider pulls at once
+DEFAULT_BATCH = 16
+# Number of times a task is leased before it is given up on, so a page that crashes its parser is not retried forever
+MAX_ATTEMPTS = 3
+
+TASK_QUEUED = 0
+TASK_LEASED = 1
+TASK_DONE = 2
+TASK_FAILED = 3
+
+
+def worker_id() -> str:
+    """
+    Identifies this worker process across machines
+    :return: Worker ID
+    """
+    return "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+
+class FrontierTask:
+    """
+    A detail page request waiting in the frontier
+    """
+    __slots__ = ("url", "spider", "callback", "meta", "attempts", "state")
+
+    def __init__(self, url: str, spider: str, callback: str, meta: dict):
+        """
+        Constructor
+        :param url: The page URL, also the dedup key
+        :param spider: The name of the spider that parses the page
+        :param callback: The name of the spider method that parses the page
+        :param meta: Data carried over from the search page, must be JSON serializable
+        """
+        self.url = url
+        self.spider = spider
+        self.callback = callback
+        self.meta = meta
+        self.attempts = 0
+        self.state = TASK_QUEUED
+
+
+class Frontier(ABC):
+    """
+    Shared queue of requests for one scrape run. Every URL is only ever queued once. Workers pull tasks, which are
+    leased to them until acked; a task whose lease runs out is handed to the next worker that pulls, so a worker
+    dying mid-page does not lose it, up to MAX_ATTEMPTS times. Workers push the listings they scrape back to the
+    run, and the coordinator collects them once the frontier has drained.
+    """
+    def __init__(self, lease_seconds: float = DEFAULT_LEASE):
+        self._lease_seconds = lease_seconds
+
+    @abstractmethod
+    def reset(self) -> None:
+        """
+        Clears all tasks, results and seals, to start a new run
+        :return: Nothing
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def push(self, task: FrontierTask) -> bool:
+        """
+        Queues a task, unless its URL has already been seen this run
+        :param task: The task
+        :return: True if queued, false if it was a duplicate
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def pull(self, spider: str, count: int = 1, worker: str = "") -> list:
+        """
+        Leases queued tasks to a worker
+        :param spider: Only pull tasks for this spider
+        :param count: The maximum number of tasks
+        :param worker: The worker ID, for diagnostics
+        :return: List of tasks, empty if none are queued
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def ack(self, url: str, success: bool = True) -> None:
+        """
+        Marks a task as finished, it will not be handed out again
+        :param url: The task URL
+        :param success: False if the page could not be scraped
+        :return: Nothing
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def push_result(self, spider: str, item: dict) -> None:
+        """
+        Adds a scraped listing to the run
+        :param spider: The name of the spider that scraped it
+        :param item: The listing
+        :return: Nothing
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def results(self):
+        """
+        Iterates the listings pushed to the run
+        :return: Generator of listings
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def pending(self, spider: str) -> int:
+        """
+        Counts the tasks that are queued or leased
+        :param spider: The spider name
+        :return: Number of unfinished tasks
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def seal(self, spider: str) -> None:
+        """
+        Marks that no more tasks will be pushed for a spider, so idle workers may stop once its queue is empty
+        :param spider: The spider name
+        :return: Nothing
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def is_sealed(self, spider: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def failed(self, spider: str) -> list:
+        """
+        Gets the tasks that failed, acked as unsuccessful or given up on after MAX_ATTEMPTS leases
+        :param spider: The spider name
+        :return: List of task URLs
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryFrontier(Frontier):
+    """
+    In-process frontier. Each structure maps onto a Redis primitive (a set of seen URLs, a list per spider for the
+    queue, a hash of leases, a list of results and a set of seals), so it doubles as the reference for a
+    networked backend.
+    """
+    def __init__(self, lease_seconds: float = DEFAULT_LEASE):
+        Frontier.__init__(self, lease_seconds)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._tasks = {}
+            self._queues = {}
+            self._leases = {}
+            self._results = []
+            self._sealed = set()
+
+    def push(self, task: FrontierTask) -> bool:
+        with self._lock:
+            if task.url in self._tasks:
+                return False
+            self._tasks[task.url] = task
+            self._queues.setdefault(task.spider, deque()).append(task.url)
+            return True
+
+    def _reclaim_expired(self, now: float) -> None:
+        for url, lease_until in list(self._leases.items()):
+            if lease_until < now:
+                del self._leases[url]
+                task = self._tasks[url]
+                if task.attempts < MAX_ATTEMPTS:
+                    task.state = TASK_QUEUED
+                    self._queues.setdefault(task.spider, deque()).appendleft(url)
+                else:
+                    task.state = TASK_FAILED
+                    logger.error("Giving up on {0} after {1} attempts".format(url, task.attempts))
+
+    def pull(self, spider: str, count: int = 1, worker: str = "") -> list:
+        now = time.time()
+        with self._lock:
+            self._reclaim_expired(now)
+            queue = self._queues.get(spider)
+            tasks = []
+            while queue and len(tasks) < count:
+                url = queue.popleft()
+                self._leases[url] = now + self._lease_seconds
+                self._tasks[url].attempts += 1
+                self._tasks[url].state = TASK_LEASED
+                tasks.append(self._tasks[url])
+            return tasks
+
+    def ack(self, url: str, success: bool = True) -> None:
+        with self._lock:
+            self._leases.pop(url, None)
+            task = self._tasks.get(url)
+            if task is not None:
+                task.state = TASK_DONE if success else TASK_FAILED
+
+    def push_result(self, spider: str, item: dict) -> None:
+        # Round trip through JSON so results look the same as from any other backend
+        data = serialize.dumps(item)
+        with self._lock:
+            self._results.append(data)
+
+    def results(self):
+        with self._lock:
+            results = list(self._results)
+        for data in results:
+            yield serialize.loads(data)
+
+    def pending(self, spider: str) -> int:
+        with self._lock:
+            self._reclaim_expired(time.time())
+            leased = sum(1 for url in self._leases if self._tasks[url].spider == spider)
+            return len(self._queues.get(spider, ())) + leased
+
+    def seal(self, spider: str) -> None:
+        with self._lock:
+            self._sealed.add(spider)
+
+    def is_sealed(self, spider: str) -> bool:
+        with self._lock:
+            return spider in self._sealed
+
+    def failed(self, spider: str) -> list:
+        with self._lock:
+            self._reclaim_expired(time.time())
+            return [url for url, task in self._tasks.items() if task.spider == spider and task.state == TASK_FAILED]
+
+
+class SQLiteFrontier(Frontier):
+    """
+    Frontier in a SQLite database, shared by every worker process on one host
+    """
+    def __init__(self, path: str, lease_seconds: float = DEFAULT_LEASE):
+        """
+        Constructor
+        :param path: The database file, created if needed
+        :param lease_seconds: Seconds before an unacked task is handed out again
+        """
+        Frontier.__init__(self, lease_seconds)
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._path = path
+        self._lock = threading.Lock()
+        # Transactions are managed explicitly, so pulls can take the write lock before reading
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS tasks (url TEXT PRIMARY KEY, spider TEXT NOT NULL, "
+                         "callback TEXT NOT NULL, meta TEXT NOT NULL, state INTEGER NOT NULL, "
+                         "lease_until REAL NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, worker TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_queue ON tasks (spider, state)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "spider TEXT NOT NULL, data TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS sealed (spider TEXT PRIMARY KEY)")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM tasks")
+                self._db.execute("DELETE FROM results")
+                self._db.execute("DELETE FROM sealed")
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def push(self, task: FrontierTask) -> bool:
+        with self._lock:
+            cursor = self._db.execute("INSERT OR IGNORE INTO tasks (url, spider, callback, meta, state) "
+                                      "VALUES (?, ?, ?, ?, ?)",
+                                      (task.url, task.spider, task.callback, serialize.dumps(task.meta), TASK_QUEUED))
+            return cursor.rowcount == 1
+
+    def pull(self, spider: str, count: int = 1, worker: str = "") -> list:
+        now = time.time()
+        with self._lock:
+            # Take the write lock up front so two workers can not lease the same rows
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute("SELECT url, callback, meta FROM tasks WHERE spider = ? AND "
+                                        "(state = ? OR (state = ? AND lease_until < ? AND attempts < ?)) "
+                                        "ORDER BY rowid LIMIT ?",
+                                        (spider, TASK_QUEUED, TASK_LEASED, now, MAX_ATTEMPTS, count)).fetchall()
+                self._db.executemany("UPDATE tasks SET state = ?, lease_until = ?, worker = ?, "
+                                     "attempts = attempts + 1 WHERE url = ?",
+                                     [(TASK_LEASED, now + self._lease_seconds, worker, row[0]) for row in rows])
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        return [FrontierTask(url, spider, callback, serialize.loads(meta)) for url, callback, meta in rows]
+
+    def ack(self, url: str, success: bool = True) -> None:
+        with self._lock:
+            self._db.execute("UPDATE tasks SET state = ? WHERE url = ?", (TASK_DONE if success else TASK_FAILED, url))
+
+    def push_result(self, spider: str, item: dict) -> None:
+        with self._lock:
+            self._db.execute("INSERT INTO results (spider, data) VALUES (?, ?)", (spider, serialize.dumps(item)))
+
+    def results(self):
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute("SELECT id, data FROM results WHERE id > ? ORDER BY id LIMIT 1000",
+                                        (last_id,)).fetchall()
+            if not rows:
+                return
+            for row_id, data in rows:
+                yield serialize.loads(data)
+            last_id = rows[-1][0]
+
+    def pending(self, spider: str) -> int:
+        with self._lock:
+            # Expired leases that are out of attempts are as good as failed
+            return self._db.execute("SELECT COUNT(*) FROM tasks WHERE spider = ? AND (state = ? OR (state = ? AND "
+                                    "(lease_until >= ? OR attempts < ?)))",
+                                    (spider, TASK_QUEUED, TASK_LEASED, time.time(), MAX_ATTEMPTS)).fetchone()[0]
+
+    def seal(self, spider: str) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO sealed (spider) VALUES (?)", (spider,))
+
+    def is_sealed(self, spider: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM sealed WHERE spider = ?", (spider,)).fetchone() is not None
+
+    def failed(self, spider: str) -> list:
+        with self._lock:
+            rows = self._db.execute("SELECT url FROM tasks WHERE spider = ? AND (state = ? OR (state = ? AND "
+                                    "lease_until < ? AND attempts >= ?)) ORDER BY rowid",
+                                    (spider, TASK_FAILED, TASK_LEASED, time.time(), MAX_ATTEMPTS)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+# Frontier backends by URI scheme, new backends register a factory taking (location, lease_seconds)
+FRONTIER_BACKENDS = {
+    "memory": lambda location, lease_seconds: MemoryFrontier(lease_seconds),
+    "sqlite": lambda location, lease_seconds: SQLiteFrontier(location, lease_seconds),
+}
+
+
+def register_frontier_backend(scheme: str, factory) -> None:
+    """
+    Adds a frontier backend
+    :param scheme: The URI scheme, as in <scheme>:<location>
+    :param factory: Callable taking (location, lease_seconds) and returning a Frontier
+    :return: Nothing
+    """
+    FRONTIER_BACKENDS[scheme] = factory
+
+
+def open_frontier(uri: str, lease_seconds: float = DEFAULT_LEASE) -> Optional[Frontier]:
+    """
+    Opens a frontier from a URI, such as sqlite:output/frontier.db or memory:
+    :param uri: The frontier URI
+    :param lease_seconds: Seconds before an unacked task is handed out again
+    :return: The frontier, or None if the scheme is unknown
+    """
+    scheme, _, location = uri.partition(":")
+    factory = FRONTIER_BACKENDS.get(scheme)
+    if factory is None:
+        logger.error("Unknown frontier backend '{0}'".format(scheme))
+        return None
+    return factory(location, lease_seconds)
+
+
+class FrontierSpiderMixin:
+    """
+    Lets a scrapy spider send its detail pages through a frontier. The spider pushes pages with frontier_push,
+    schedules pulled pages with frontier_requests, and calls frontier_task_done once a page is parsed. In worker mode
+    the spider skips its search pages and only works off the frontier.
+    """
+    frontier = None
+    frontier_worker = False
+    frontier_batch = DEFAULT_BATCH
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        from scrapy import signals
+        spider = super(FrontierSpiderMixin, cls).from_crawler(crawler, *args, **kwargs)
+        if cls.frontier is not None:
+            crawler.signals.connect(spider._frontier_idle, signal=signals.spider_idle)
+        return spider
+
+    def start_requests(self):
+        if self.frontier is not None and self.frontier_worker:
+            return self.frontier_requests()
+        return super(FrontierSpiderMixin, self).start_requests()
+
+    def frontier_push(self, url: str, callback: str, meta: dict) -> bool:
+        """
+        Queues a detail page
+        :param url: The page URL
+        :param callback: The name of the method that parses it
+        :param meta: Data for the callback, available as response.meta["frontier_meta"]
+        :return: True if queued, false if the page was already seen this run
+        """
+        return self.frontier.push(FrontierTask(url, self.name, callback, meta))
+
+    def frontier_requests(self) -> list:
+        """
+        Pulls a batch of tasks and turns them into requests
+        :return: List of requests
+        """
+        import scrapy
+        requests = []
+        for task in self.frontier.pull(self.name, self.frontier_batch, worker_id()):
+            requests.append(scrapy.Request(url=task.url, callback=getattr(self, task.callback),
+                                           errback=self._frontier_error, dont_filter=True,
+                                           meta={"dont_merge_cookies": True, "frontier_url": task.url,
+                                                 "frontier_meta": task.meta}))
+        return requests
+
+    def frontier_task_done(self, response) -> None:
+        """
+        Acks the task a response belongs to
+        :param response: The detail page response
+        :return: Nothing
+        """
+        self.frontier.ack(response.meta["frontier_url"])
+
+    def _frontier_error(self, failure) -> None:
+        url = failure.request.meta["frontier_url"]
+        logger.error("Failed to scrape {0}: {1}".format(url, failure.value))
+        self.frontier.ack(url, success=False)
+
+    def _frontier_idle(self, spider) -> None:
+        from scrapy.exceptions import DontCloseSpider
+        if not self.frontier_worker:
+            # The coordinator only goes idle once all of its search pages are done, so nothing more will be pushed
+            self.frontier.seal(self.name)
+        requests = self.frontier_requests()
+        for request in requests:
+            self.crawler.engine.crawl(request, self)
+        if requests or not self.frontier.is_sealed(self.name):
+            raise DontCloseSpider
+        # The coordinator waits out other workers' leases, so expired ones can still be picked up here
+        if not self.frontier_worker and self.frontier.pending(self.name):
+            raise DontCloseSpider
+
+
+class FrontierResultPipeline:
+    """
+    Item pipeline for workers, pushes every scraped listing to the shared run
+    """
+    def process_item(self, item, spider):
+        if getattr(spider, "frontier", None) is not None:
+            spider.frontier.push_result(spider.name, dict(item))
+        return item
@@ -0,0 +1,238 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import csv
+import datetime
+import hashlib
+import logging
+import os
+import re
+from . import stations
+
+logger = logging.getLogger(__name__)
+
+# GTFS route types, https://developers.google.com/transit/gtfs/reference#routestxt
+ROUTE_TYPE_TRAM = 0
+ROUTE_TYPE_SUBWAY = 1
+ROUTE_TYPE_RAIL = 2
+ROUTE_TYPE_BUS = 3
+ROUTE_TYPE_FERRY = 4
+# Basic route type of each group of extended route types, by hundreds
+_EXTENDED_ROUTE_TYPES = {1: ROUTE_TYPE_RAIL, 4: ROUTE_TYPE_SUBWAY, 9: ROUTE_TYPE_TRAM, 10: ROUTE_TYPE_FERRY}
+# Everything but buses, whose stops are too many and too close together to count as stations
+DEFAULT_ROUTE_TYPES = (0, 1, 2, 4, 5, 6, 7, 11, 12)
+
+# Service calendars, which days each trip runs. A feed has at least one of them.
+CALENDAR_FILES = ("calendar.txt", "calendar_dates.txt")
+# Files read from each feed, stop_times links the stops to the routes through the trips
+GTFS_FILES = ("stops.txt", "routes.txt", "trips.txt", "stop_times.txt") + CALENDAR_FILES
+# calendar.txt columns, in date.weekday() order
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+# "Green Line B" is the B branch of the Green Line
+_BRANCH_PATTERN = re.compile(r"^(.+ Line) ([A-Z0-9])$")
+
+
+def normalize_line_name(short_name: str, long_name: str, route_type: int) -> str:
+    """
+    Normalizes a GTFS route name to the line names used for train data, such as "Red Line", "Green Line (B)" and
+    "Commuter Rail (Fitchburg Line)"
+    :param short_name: The route_short_name
+    :param long_name: The route_long_name
+    :param route_type: The route_type
+    :return: The line name
+    """
+    name = " ".join((long_name or short_name or "").split())
+    if name.isupper():
+        name = name.title()
+    branch = _BRANCH_PATTERN.match(name)
+    if branch:
+        name = "{0} ({1})".format(branch.group(1), branch.group(2))
+    if route_type == ROUTE_TYPE_RAIL and "Commuter Rail" not in name:
+        name = "Commuter Rail ({0})".format(name)
+    return name
+
+
+def read_table(path: str, digest=None):
+    """
+    Reads a GTFS file, adding its bytes to a digest as they are read
+    :param path: The file path
+    :param digest: hashlib object to update, if given
+    :return: Generator of row dicts
+    """
+    with open(path, "rb") as gtfs_file:
+        # The first line may start with a byte order mark
+        if digest is None:
+            lines = (line.decode("utf-8-sig") for line in gtfs_file)
+        else:
+            lines = (digest.update(line) or line.decode("utf-8-sig") for line in gtfs_file)
+        for row in csv.DictReader(lines):
+            yield row
+
+
+def get_route_type(route: dict) -> int:
+    """
+    Gets the basic route type of a route, extended route types (100 rail, 400 urban rail, ...) count as their basic
+    type
+    :param route: The routes.txt row
+    :return: The route type, or -1 if it has none
+    """
+    try:
+        route_type = int(route.get("route_type") or -1)
+    except ValueError:
+        return -1
+    if route_type >= 100:
+        route_type = _EXTENDED_ROUTE_TYPES.get(route_type // 100, ROUTE_TYPE_BUS)
+    return route_type
+
+
+def parse_service_day(service_day: str, today: datetime.date = None) -> datetime.date:
+    """
+    Parses the day to take the timetable of
+    :param service_day: A date, such as 2021-09-14, or a weekday name for the next such day
+    :param today: The day a weekday name counts from, defaults to today
+    :return: The date
+    """
+    service_day = service_day.strip().lower()
+    if service_day in WEEKDAYS:
+        if today is None:
+            today = datetime.date.today()
+        return today + datetime.timedelta(days=(WEEKDAYS.index(service_day) - today.weekday()) % 7)
+    try:
+        return datetime.datetime.strptime(service_day, "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("Invalid service day '{0}', expected YYYY-MM-DD or a weekday".format(service_day))
+
+
+def active_services(feed_dir: str, service_date: datetime.date):
+    """
+    Finds the services of a feed that run on a date, from calendar.txt and the exceptions in calendar_dates.txt
+    :param feed_dir: Directory of the GTFS feed
+    :param service_date: The date
+    :return: Set of service IDs, or None if the feed has no calendar and every trip counts
+    """
+    date_str = service_date.strftime("%Y%m%d")
+    weekday = WEEKDAYS[service_date.weekday()]
+    services = set()
+    has_calendar = False
+    calendar_path = os.path.join(feed_dir, "calendar.txt")
+    if os.path.isfile(calendar_path):
+        has_calendar = True
+        for row in read_table(calendar_path):
+            if row.get(weekday) == "1" and row["start_date"] <= date_str <= row["end_date"]:
+                services.add(row["service_id"])
+    dates_path = os.path.join(feed_dir, "calendar_dates.txt")
+    if os.path.isfile(dates_path):
+        has_calendar = True
+        for row in read_table(dates_path):
+            if row["date"] != date_str:
+                continue
+            # 1 adds the service for the day, 2 removes it
+            if row["exception_type"] == "1":
+                services.add(row["service_id"])
+            elif row["exception_type"] == "2":
+                services.discard(row["service_id"])
+    if not has_calendar:
+        return None
+    return services
+
+
+def get_station_id(stops: dict, stop_id: str) -> str:
+    """
+    Gets the station a stop belongs to, platforms belong to their parent station
+    :param stops: Dict of stop ID to stops.txt row
+    :param stop_id: The stop ID
+    :return: The station's stop ID
+    """
+    station_id = stops[stop_id].get("parent_station") or stop_id
+    return station_id if station_id in stops else stop_id
+
+
+def read_feed(feed_dir: str, route_types=DEFAULT_ROUTE_TYPES, digest=None) -> list:
+    """
+    Reads the stations of a GTFS feed. Platforms are folded into their parent station, and only stations served by
+    one of the route types are kept.
+    :param feed_dir: Directory holding the feed's stops.txt, routes.txt, trips.txt and stop_times.txt
+    :param route_types: GTFS route types to keep
+    :param digest: hashlib object the feed files are added to, if given
+    :return: List of station dicts, with name, coords and lines
+    """
+    if digest is None:
+        digest = hashlib.sha256()
+    for file_name in GTFS_FILES:
+        if file_name not in CALENDAR_FILES and not os.path.isfile(os.path.join(feed_dir, file_name)):
+            raise OSError("GTFS feed {0} is missing {1}".format(feed_dir, file_name))
+
+    stops = {}
+    for row in read_table(os.path.join(feed_dir, "stops.txt"), digest):
+        stops[row["stop_id"]] = row
+
+    route_lines = {}
+    for row in read_table(os.path.join(feed_dir, "routes.txt"), digest):
+        route_type = get_route_type(row)
+        if route_type in route_types:
+            route_lines[row["route_id"]] = normalize_line_name(row.get("route_short_name"),
+                                                               row.get("route_long_name"), route_type)
+
+    trip_lines = {}
+    for row in read_table(os.path.join(feed_dir, "trips.txt"), digest):
+        line = route_lines.get(row["route_id"])
+        if line is not None:
+            trip_lines[row["trip_id"]] = line
+
+    # Station stop ID to the lines serving it, in the order they were first seen
+    station_lines = {}
+    for row in read_table(os.path.join(feed_dir, "stop_times.txt"), digest):
+        line = trip_lines.get(row["trip_id"])
+        if line is None or row["stop_id"] not in stops:
+            continue
+        station_id = get_station_id(stops, row["stop_id"])
+        lines = station_lines.setdefault(station_id, [])
+        if line not in lines:
+            lines.append(line)
+
+    feed_stations = []
+    for station_id, lines in station_lines.items():
+        stop = stops[station_id]
+        try:
+            coords = [float(stop["stop_lat"]), float(stop["stop_lon"])]
+        except (KeyError, ValueError):
+            logger.warning("Skipping station {0} with no location in {1}".format(station_id, feed_dir))
+            continue
+        feed_stations.append({"name": " ".join(stop.get("stop_name", station_id).split()), "coords": coords,
+                              "lines": lines})
+    return feed_stations
+
+
+def import_gtfs(feed_dirs: list, index_path: str, route_types=DEFAULT_ROUTE_TYPES) -> int:
+    """
+    Imports the stations of one or more GTFS feeds, one per agency, into a station index
+    :param feed_dirs: Directories of the GTFS feeds
+    :param index_path: The station index to write
+    :param route_types: GTFS route types to keep
+    :return: Number of stations imported
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(sorted(route_types)).encode())
+    all_stations = []
+    for feed_dir in feed_dirs:
+        feed_stations = read_feed(feed_dir, route_types, digest)
+        logger.info("Read {0} stations from {1}".format(len(feed_stations), feed_dir))
+        all_stations.extend(feed_stations)
+    stations.write_station_index(index_path, all_stations, digest.hexdigest())
+    return len(all_stations)
@@ -0,0 +1,60 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from scrapy.extensions.httpcache import FilesystemCacheStorage
+from scrapy.utils.request import request_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that change between visits without changing the page, left out of cache keys
+VOLATILE_QUERY_PARAMS = ["_", "cb", "cachebust", "ts", "timestamp", "sid", "sessionid", "fbclid", "gclid"]
+VOLATILE_QUERY_PREFIXES = ["utm_"]
+
+
+def normalize_url(url: str, ignore_params: list = None) -> str:
+    """
+    Removes volatile query parameters from a URL, so the same page always has the same cache key
+    :param url: The URL
+    :param ignore_params: Query parameters to remove, defaults to VOLATILE_QUERY_PARAMS
+    :return: The URL without the volatile parameters
+    """
+    if ignore_params is None:
+        ignore_params = VOLATILE_QUERY_PARAMS
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+             if name not in ignore_params and not name.startswith(tuple(VOLATILE_QUERY_PREFIXES))]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+class NormalizedFilesystemCacheStorage(FilesystemCacheStorage):
+    """
+    Scrapy's filesystem HTTP cache, keyed on the URL without its volatile query parameters. Set as
+    HTTPCACHE_STORAGE, the PYAGENT_HTTPCACHE_IGNORE_PARAMS setting overrides the parameters that are ignored.
+    """
+    def __init__(self, settings):
+        super(NormalizedFilesystemCacheStorage, self).__init__(settings)
+        self._ignore_params = settings.getlist("PYAGENT_HTTPCACHE_IGNORE_PARAMS", VOLATILE_QUERY_PARAMS)
+
+    def _get_request_path(self, spider, request):
+        key = request_fingerprint(request.replace(url=normalize_url(request.url, self._ignore_params)))
+        return os.path.join(self.cachedir, spider.name, key[0:2], key)
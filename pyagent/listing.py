@@ -0,0 +1,128 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+from dataclasses import dataclass, fields
+from typing import Any, Optional
+
+# Fields with few distinct values, each value is stored once no matter how many listings share it
+INTERNED_FIELDS = ("neighborhood", "suburb", "city", "state", "source")
+
+
+@dataclass
+class Listing:
+    """
+    A scraped listing. Slots keep each listing to a fixed handful of pointers instead of a dict, which matters once
+    there are millions of them. Scrapy exports it like any other item, and it can be read like the dicts listings
+    used to be (listing["rent"], "rent" in listing, dict(listing)).
+    """
+    # Written out by hand, dataclass(slots=True) needs Python 3.10. No field can have a default, since defaults are
+    # class attributes and would clash with the slots.
+    __slots__ = ("uid", "address", "neighborhood", "suburb", "city", "state", "rent", "deposit", "sqft", "beds",
+                 "baths_str", "unit", "coordinates", "additional", "link", "source", "region")
+
+    uid: int
+    address: str
+    neighborhood: Optional[str]
+    suburb: Optional[str]
+    city: Optional[str]
+    state: Optional[str]
+    rent: Any
+    deposit: Any
+    sqft: Any
+    beds: Any
+    baths_str: Any
+    unit: Any
+    coordinates: Any
+    additional: Any
+    link: str
+    source: str
+    # region is a slot but not a field, it is only set on listings from multi-region scrapes
+
+    def __post_init__(self):
+        for name in INTERNED_FIELDS:
+            value = getattr(self, name)
+            if isinstance(value, str):
+                setattr(self, name, sys.intern(value))
+
+    @classmethod
+    def from_dict(cls, housing: dict) -> "Listing":
+        """
+        Creates a listing from its dict form, such as a line of a scrape results file
+        :param housing: The listing dict, missing fields are None
+        :return: The listing
+        """
+        listing = cls(*[housing.get(name) for name in _FIELD_NAMES])
+        if housing.get("region") is not None:
+            listing.region = housing["region"]
+        return listing
+
+    def to_dict(self) -> dict:
+        """
+        Gets the dict form of the listing, for JSON
+        :return: The listing dict
+        """
+        return dict(self.items())
+
+    def keys(self) -> list:
+        if getattr(self, "region", None) is not None:
+            return list(_FIELD_NAMES) + ["region"]
+        return list(_FIELD_NAMES)
+
+    def items(self) -> list:
+        return [(name, getattr(self, name)) for name in self.keys()]
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in _SLOTS else default
+
+    def __getitem__(self, key: str):
+        if key not in _SLOTS:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in _SLOTS:
+            raise KeyError(key)
+        if key in INTERNED_FIELDS and isinstance(value, str):
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in _SLOTS and hasattr(self, key)
+
+
+_FIELD_NAMES = tuple(field.name for field in fields(Listing))
+_SLOTS = frozenset(Listing.__slots__)
+
+
+@dataclass
+class ListingResult:
+    """
+    How a listing scored against the housing criteria
+    """
+    __slots__ = ("listing", "criterion", "total", "score", "possible_points")
+
+    listing: Listing
+    # List of (criterion, result, result info)
+    criterion: list
+    total: float
+    score: float
+    possible_points: float
@@ -0,0 +1,417 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import math
+import os
+from typing import Optional
+from . import serialize
+from .criteria import FAKE_SQFT_VALUES
+
+logger = logging.getLogger(__name__)
+
+MARKET_STATS_FILE = "cache/market_stats.json"
+MARKET_STATS_VERSION = 1
+
+# Listings are grouped by each of these fields, plus one group of every listing
+LEVELS = ("neighborhood", "suburb", "city")
+LEVEL_ALL = "all"
+# Statistics kept for each group
+FIELDS = ("rent", "sqft", "rent_per_sqft")
+QUANTILES = (0.25, 0.5, 0.75)
+# Rents under the lower quartile divided by this, or over the upper quartile times this, are outliers once the
+# quartiles have settled. Rents are skewed, so the fences are a ratio rather than a number of interquartile ranges.
+RENT_OUTLIER_RATIO = 4.0
+RENT_OUTLIER_MIN_COUNT = 20
+_FAKE_SQFT = {float(value) for value in FAKE_SQFT_VALUES}
+
+
+def parse_number(value) -> Optional[float]:
+    """
+    Reads a listing value such as 1500, "1500" or "$1,500"
+    :param value: The raw value
+    :return: The number, or None if it is missing or not a number
+    """
+    if value is None:
+        return None
+    try:
+        number = float(str(value).replace("$", "").replace(",", ""))
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+
+class RunningStats:
+    """
+    Count, mean, variance and range of a stream of values, updated one value at a time with Welford's method
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "min": self.minimum, "max": self.maximum}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RunningStats":
+        stats = cls()
+        stats.count = data["count"]
+        stats.mean = data["mean"]
+        stats.m2 = data["m2"]
+        stats.minimum = data["min"]
+        stats.maximum = data["max"]
+        return stats
+
+
+class P2Quantile:
+    """
+    Streaming estimate of a quantile with the P-square algorithm (Jain and Chlamtac, 1985). Only five markers are
+    kept, however many values are added, and the markers are moved toward their ideal positions with a parabolic fit.
+    """
+    def __init__(self, quantile: float):
+        """
+        Constructor
+        :param quantile: The quantile to estimate, between 0 and 1
+        """
+        self.quantile = quantile
+        # Marker heights and positions, the first five values are kept as they are until there are enough of them
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * quantile, 1 + 4 * quantile, 3 + 2 * quantile, 5]
+        self.increments = [0, quantile / 2, quantile, (1 + quantile) / 2, 1]
+
+    def add(self, value: float) -> None:
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+        positions = self.positions
+        for marker in range(cell + 1, 5):
+            positions[marker] += 1
+        for marker in range(5):
+            self.desired[marker] += self.increments[marker]
+
+        for marker in range(1, 4):
+            offset = self.desired[marker] - positions[marker]
+            if ((offset >= 1 and positions[marker + 1] - positions[marker] > 1)
+                    or (offset <= -1 and positions[marker - 1] - positions[marker] < -1)):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(marker, step)
+                if not heights[marker - 1] < height < heights[marker + 1]:
+                    height = heights[marker] + step * (heights[marker + step] - heights[marker]) / \
+                        (positions[marker + step] - positions[marker])
+                heights[marker] = height
+                positions[marker] += step
+
+    def _parabolic(self, marker: int, step: int) -> float:
+        heights = self.heights
+        positions = self.positions
+        return heights[marker] + step / (positions[marker + 1] - positions[marker - 1]) * (
+            (positions[marker] - positions[marker - 1] + step) * (heights[marker + 1] - heights[marker]) /
+            (positions[marker + 1] - positions[marker]) +
+            (positions[marker + 1] - positions[marker] - step) * (heights[marker] - heights[marker - 1]) /
+            (positions[marker] - positions[marker - 1]))
+
+    @property
+    def value(self) -> Optional[float]:
+        """
+        The current estimate, exact until there are five values
+        """
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            return self.heights[min(int(round(self.quantile * (len(self.heights) - 1))), len(self.heights) - 1)]
+        return self.heights[2]
+
+    def to_dict(self) -> dict:
+        return {"quantile": self.quantile, "heights": self.heights, "positions": self.positions,
+                "desired": self.desired}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "P2Quantile":
+        estimate = cls(data["quantile"])
+        estimate.heights = data["heights"]
+        estimate.positions = data["positions"]
+        estimate.desired = data["desired"]
+        return estimate
+
+
+class FieldStats:
+    """
+    Running statistics and quantile estimates of one listing field
+    """
+    def __init__(self):
+        self.stats = RunningStats()
+        self.quantiles = [P2Quantile(quantile) for quantile in QUANTILES]
+
+    def add(self, value: float) -> None:
+        self.stats.add(value)
+        for estimate in self.quantiles:
+            estimate.add(value)
+
+    def get_quantile(self, quantile: float) -> Optional[float]:
+        for estimate in self.quantiles:
+            if estimate.quantile == quantile:
+                return estimate.value
+        return None
+
+    def summary(self) -> dict:
+        """
+        Gets the statistics for display
+        :return: Dict of count, mean, stddev, min, max and each quantile as "p25", "p50", ...
+        """
+        summary = {"count": self.stats.count, "mean": self.stats.mean if self.stats.count else None,
+                   "stddev": self.stats.stddev, "min": self.stats.minimum, "max": self.stats.maximum}
+        for estimate in self.quantiles:
+            summary["p{0:g}".format(estimate.quantile * 100)] = estimate.value
+        return summary
+
+    def to_dict(self) -> dict:
+        return {"stats": self.stats.to_dict(), "quantiles": [estimate.to_dict() for estimate in self.quantiles]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FieldStats":
+        field = cls()
+        field.stats = RunningStats.from_dict(data["stats"])
+        field.quantiles = [P2Quantile.from_dict(estimate) for estimate in data["quantiles"]]
+        return field
+
+
+class GroupStats:
+    """
+    Market statistics of one neighborhood, suburb or city, across every ingested run
+    """
+    def __init__(self):
+        self.fields = {field: FieldStats() for field in FIELDS}
+        # Listings seen over all runs, and in the last run the group appeared in
+        self.listings = 0
+        self.runs = 0
+        self.latest_listings = 0
+        self.latest_run = None
+        self.outliers = {"fake_sqft": 0, "rent": 0, "missing_rent": 0, "missing_sqft": 0}
+
+    def is_rent_outlier(self, rent: float) -> bool:
+        """
+        Checks a rent against the quartiles so far, rents like $1 or $150,000 are typos or not rentals
+        :param rent: The monthly rent
+        :return: True if the rent is an outlier
+        """
+        if rent <= 0:
+            return True
+        rent_stats = self.fields["rent"]
+        if rent_stats.stats.count < RENT_OUTLIER_MIN_COUNT:
+            return False
+        return not (rent_stats.get_quantile(0.25) / RENT_OUTLIER_RATIO <= rent
+                    <= rent_stats.get_quantile(0.75) * RENT_OUTLIER_RATIO)
+
+    def add(self, housing, run_id: str) -> None:
+        """
+        Adds a listing to the statistics
+        :param housing: The listing, a Listing or its dict form
+        :param run_id: The run the listing was scraped in
+        :return: Nothing
+        """
+        if self.latest_run != run_id:
+            self.latest_run = run_id
+            self.latest_listings = 0
+            self.runs += 1
+        self.listings += 1
+        self.latest_listings += 1
+
+        rent = parse_number(housing["rent"])
+        if rent is None:
+            self.outliers["missing_rent"] += 1
+        elif self.is_rent_outlier(rent):
+            self.outliers["rent"] += 1
+            rent = None
+        else:
+            self.fields["rent"].add(rent)
+
+        sqft = parse_number(housing["sqft"])
+        if sqft in _FAKE_SQFT:
+            self.outliers["fake_sqft"] += 1
+            sqft = None
+        elif sqft is None or sqft <= 0:
+            self.outliers["missing_sqft"] += 1
+            sqft = None
+        else:
+            self.fields["sqft"].add(sqft)
+        if rent is not None and sqft is not None:
+            self.fields["rent_per_sqft"].add(rent / sqft)
+
+    def summary(self) -> dict:
+        summary = {"listings": self.listings, "runs": self.runs, "latest_listings": self.latest_listings,
+                   "latest_run": self.latest_run, "outliers": dict(self.outliers)}
+        for field, field_stats in self.fields.items():
+            summary[field] = field_stats.summary()
+        return summary
+
+    def to_dict(self) -> dict:
+        return {"fields": {field: field_stats.to_dict() for field, field_stats in self.fields.items()},
+                "listings": self.listings, "runs": self.runs, "latest_listings": self.latest_listings,
+                "latest_run": self.latest_run, "outliers": self.outliers}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "GroupStats":
+        group = cls()
+        group.fields = {field: FieldStats.from_dict(field_data) for field, field_data in data["fields"].items()}
+        group.listings = data["listings"]
+        group.runs = data["runs"]
+        group.latest_listings = data["latest_listings"]
+        group.latest_run = data["latest_run"]
+        group.outliers.update(data["outliers"])
+        return group
+
+
+class MarketStats:
+    """
+    Rent, size and availability statistics for each neighborhood, suburb and city, updated as each scrape run is
+    ingested. Only the running statistics are stored, so past scrape results never have to be read again, and a run
+    that was already ingested is skipped.
+    """
+    def __init__(self, path: str = MARKET_STATS_FILE):
+        """
+        Constructor
+        :param path: The file the statistics are stored in
+        """
+        self._path = path
+        self._runs = []
+        self._groups = {level: {} for level in LEVELS + (LEVEL_ALL,)}
+
+    @classmethod
+    def load(cls, path: str = MARKET_STATS_FILE) -> "MarketStats":
+        """
+        Loads the statistics, starting over if the file is missing or unreadable
+        :param path: The statistics file
+        :return: The statistics
+        """
+        market_stats = cls(path)
+        if not os.path.isfile(path):
+            return market_stats
+        try:
+            data = serialize.load(path)
+        except (OSError, ValueError) as e:
+            logger.error("Failed to read market statistics {0}: {1}".format(path, e))
+            return market_stats
+        if data.get("version") != MARKET_STATS_VERSION:
+            logger.warning("Market statistics {0} are from another version, starting over".format(path))
+            return market_stats
+        market_stats._runs = data["runs"]
+        for level, groups in data["groups"].items():
+            market_stats._groups[level] = {name: GroupStats.from_dict(group) for name, group in groups.items()}
+        return market_stats
+
+    def save(self) -> None:
+        """
+        Writes the statistics
+        :return: Nothing
+        """
+        stats_dir = os.path.dirname(self._path)
+        if stats_dir and not os.path.isdir(stats_dir):
+            os.makedirs(stats_dir)
+        serialize.save(self._path, {
+            "version": MARKET_STATS_VERSION,
+            "runs": self._runs,
+            "groups": {level: {name: group.to_dict() for name, group in groups.items()}
+                       for level, groups in self._groups.items()},
+        })
+
+    @property
+    def runs(self) -> list:
+        """
+        The IDs of the ingested runs, in the order they were ingested
+        """
+        return self._runs
+
+    def has_run(self, run_id: str) -> bool:
+        return run_id in self._runs
+
+    def ingest(self, listings, run_id: str) -> int:
+        """
+        Adds a scrape run to the statistics
+        :param listings: Iterable of the run's listings
+        :param run_id: Identifies the run, such as the scrape results file name
+        :return: Number of listings added, 0 if the run was already ingested
+        """
+        if self.has_run(run_id):
+            logger.debug("Run {0} is already in the market statistics".format(run_id))
+            return 0
+        count = 0
+        for housing in listings:
+            self._get_group(LEVEL_ALL, LEVEL_ALL).add(housing, run_id)
+            for level in LEVELS:
+                name = housing[level]
+                if name:
+                    self._get_group(level, name).add(housing, run_id)
+            count += 1
+        self._runs.append(run_id)
+        logger.info("Added {0} listings from {1} to the market statistics".format(count, run_id))
+        return count
+
+    def _get_group(self, level: str, name: str) -> GroupStats:
+        group = self._groups[level].get(name)
+        if group is None:
+            group = self._groups[level][name] = GroupStats()
+        return group
+
+    def query(self, level: str = None, name: str = None) -> list:
+        """
+        Gets the statistics of groups
+        :param level: "neighborhood", "suburb", "city" or "all", None for every level
+        :param name: The group name, None for every group of the level
+        :return: List of group summaries, each with its level and name, sorted by level and name
+        """
+        results = []
+        for group_level in LEVELS + (LEVEL_ALL,):
+            if level is not None and group_level != level:
+                continue
+            for group_name in sorted(self._groups[group_level]):
+                if name is not None and group_name != name:
+                    continue
+                summary = self._groups[group_level][group_name].summary()
+                summary["level"] = group_level
+                summary["name"] = group_name
+                results.append(summary)
+        return results
@@ -0,0 +1,441 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = ['{0}="{1}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    """
+    Base metric, tracks one value per combination of label values
+    """
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        """
+        Constructor
+        :param name: The metric name, in Prometheus naming style
+        :param documentation: The help text
+        :param labels: The label names
+        """
+        self._name = name
+        self._documentation = documentation
+        self._labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self._labels):
+            raise ValueError("Metric {0} expects labels {1}, got {2}".format(self._name, self._labels,
+                                                                            tuple(labels)))
+        return tuple(str(labels[name]) for name in self._labels)
+
+    def _render_samples(self) -> list:
+        return ["{0}{1} {2}".format(self._name, _format_labels(self._labels, key), repr(float(value)))
+                for key, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        """
+        Renders the metric in the Prometheus text exposition format
+        :return: Metric text
+        """
+        with self._lock:
+            lines = ["# HELP {0} {1}".format(self._name, self._documentation),
+                     "# TYPE {0} {1}".format(self._name, self.metric_type)]
+            lines.extend(self._render_samples())
+        return "\n".join(lines) + "\n"
+
+    def value(self, **labels):
+        """
+        Gets the current value for a set of labels
+        :param labels: The label values
+        :return: The value, None if never recorded
+        """
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def samples(self) -> dict:
+        """
+        Gets a copy of every recorded value
+        :return: Dict of label value tuples to value
+        """
+        with self._lock:
+            return {key: self._copy_value(value) for key, value in self._values.items()}
+
+    @staticmethod
+    def _copy_value(value):
+        return value
+
+    def snapshot(self) -> dict:
+        """
+        Gets a copy of the full state of every recorded value, to merge into the same metric in another process
+        :return: Dict of label value tuples to state
+        """
+        with self._lock:
+            return {key: self._copy_state(value) for key, value in self._values.items()}
+
+    def merge(self, snapshot: dict) -> None:
+        """
+        Merges a snapshot of this metric from another process
+        :param snapshot: The snapshot from snapshot()
+        :return: Nothing
+        """
+        with self._lock:
+            for key, value in snapshot.items():
+                current = self._values.get(key)
+                self._values[key] = self._copy_state(value) if current is None else self._merge_state(current, value)
+
+    @staticmethod
+    def _copy_state(value):
+        return value
+
+    @staticmethod
+    def _merge_state(current, value):
+        return value
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing count
+    """
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increments the counter
+        :param amount: The amount to add
+        :param labels: The label values
+        :return: Nothing
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @staticmethod
+    def _merge_state(current, value):
+        return current + value
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down
+    """
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values, such as latencies, in cumulative buckets
+    """
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Constructor
+        :param name: The metric name, in Prometheus naming style
+        :param documentation: The help text
+        :param labels: The label names
+        :param buckets: The bucket upper bounds, in increasing order
+        """
+        Metric.__init__(self, name, documentation, labels)
+        self._buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Records an observation
+        :param value: The observed value
+        :param labels: The label values
+        :return: Nothing
+        """
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * len(self._buckets), 0.0, 0]
+                self._values[key] = state
+            for idx, bound in enumerate(self._buckets):
+                if value <= bound:
+                    state[0][idx] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """
+        Times a block of code and records its duration in seconds
+        :param labels: The label values
+        :return: Context manager
+        """
+        return _Timer(self, labels)
+
+    def value(self, **labels):
+        """
+        Gets the sum and count for a set of labels
+        :param labels: The label values
+        :return: (sum, count), None if never recorded
+        """
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            if state is None:
+                return None
+            return state[1], state[2]
+
+    @staticmethod
+    def _copy_value(value):
+        return value[1], value[2]
+
+    @staticmethod
+    def _copy_state(value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def _merge_state(current, value):
+        for idx, bucket_count in enumerate(value[0]):
+            current[0][idx] += bucket_count
+        current[1] += value[1]
+        current[2] += value[2]
+        return current
+
+    def _render_samples(self) -> list:
+        lines = []
+        for key, (bucket_counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append("{0}_bucket{1} {2}".format(self._name, _format_labels(self._labels, key,
+                                                                                   'le="{0}"'.format(bound)),
+                                                        cumulative))
+            lines.append("{0}_bucket{1} {2}".format(self._name, _format_labels(self._labels, key, 'le="+Inf"'),
+                                                    count))
+            lines.append("{0}_sum{1} {2}".format(self._name, _format_labels(self._labels, key), repr(float(total))))
+            lines.append("{0}_count{1} {2}".format(self._name, _format_labels(self._labels, key), count))
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics that are exported together
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError("Metric {0} is already registered".format(metric.name))
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def snapshot(self) -> dict:
+        """
+        Gets the state of every metric, to send from a worker process to the parent
+        :return: Dict of metric name to metric snapshot
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def merge(self, snapshot: dict) -> None:
+        """
+        Merges the metrics of a worker process. Counters and histograms are added, gauges take the worker's value.
+        :param snapshot: The snapshot from snapshot()
+        :return: Nothing
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        for name, metric_snapshot in snapshot.items():
+            metric = metrics.get(name)
+            if metric is None:
+                logger.warning("Cannot merge unknown metric {0}".format(name))
+                continue
+            metric.merge(metric_snapshot)
+
+    def reset(self) -> None:
+        """
+        Clears the values of every metric
+        :return: Nothing
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format
+        :return: Metrics text
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+    def write_textfile(self, path: str) -> bool:
+        """
+        Writes the metrics for the node exporter textfile collector. The file is replaced atomically so the
+        collector never reads a partial file.
+        :param path: The .prom file to write
+        :return: True if written, false if otherwise
+        """
+        temp_path = path + ".tmp"
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(temp_path, "w") as prom_file:
+                prom_file.write(self.render())
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error("Failed to write metrics to {0}: {1}".format(path, e))
+            return False
+        logger.debug("Wrote metrics to {0}".format(path))
+        return True
+
+    def start_http_server(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        Exposes the metrics on a local HTTP endpoint, served from a background thread
+        :param port: The port to listen on
+        :param host: The address to listen on
+        :return: The server, call shutdown() to stop it
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+        thread.start()
+        logger.info("Serving metrics on http://{0}:{1}/metrics".format(host, port))
+        return server
+
+
+REGISTRY = MetricsRegistry()
+
+# Pipeline metrics
+stage_duration = REGISTRY.histogram("pyagent_stage_duration_seconds", "Time spent in each pipeline stage",
+                                    labels=("stage",))
+last_run_timestamp = REGISTRY.gauge("pyagent_last_run_timestamp_seconds", "Unix time the last run finished")
+pages_fetched = REGISTRY.counter("pyagent_pages_fetched_total", "Responses received by each spider",
+                                 labels=("spider", "status"))
+items_scraped = REGISTRY.counter("pyagent_items_scraped_total", "Listings yielded by each spider",
+                                 labels=("spider",))
+geocode_requests = REGISTRY.counter("pyagent_geocode_requests_total", "Geocoding backend requests",
+                                    labels=("kind", "source", "result"))
+geocode_latency = REGISTRY.histogram("pyagent_geocode_request_seconds", "Geocoding backend request latency",
+                                     labels=("kind", "source"))
+geocode_cache_lookups = REGISTRY.counter("pyagent_geocode_cache_lookups_total",
+                                         "Location cache lookups by result (hit, negative_hit, miss)",
+                                         labels=("kind", "source", "result"))
+geocode_rate_limit_wait = REGISTRY.counter("pyagent_geocode_rate_limit_wait_seconds_total",
+                                           "Time spent sleeping to honor the geocoder request delay",
+                                           labels=("source",))
+geocode_coalesced = REGISTRY.counter("pyagent_geocode_coalesced_total",
+                                     "Geocoding lookups answered by another lookup of the same key, by reason "
+                                     "(duplicate in a prefetch batch, in_flight on another thread)",
+                                     labels=("kind", "source", "reason"))
+listings_scored = REGISTRY.counter("pyagent_listings_scored_total", "Listings evaluated during characterization")
+
+
+def instrument_crawler(crawler) -> None:
+    """
+    Connects a scrapy crawler's signals to the spider metrics
+    :param crawler: The scrapy crawler
+    :return: Nothing
+    """
+    from scrapy import signals
+
+    def on_response(response, request, spider):
+        pages_fetched.inc(spider=spider.name, status=response.status)
+
+    def on_item(item, response, spider):
+        items_scraped.inc(spider=spider.name)
+
+    # Keep references on the crawler, scrapy only holds weak references to signal handlers
+    crawler.pyagent_metric_handlers = (on_response, on_item)
+    crawler.signals.connect(on_response, signal=signals.response_received)
+    crawler.signals.connect(on_item, signal=signals.item_scraped)
@@ -0,0 +1,280 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from .commute import distance_mi
+
+logger = logging.getLogger(__name__)
+
+RASTER_CACHE_DIR = "cache/raster"
+# Grid spacing in miles, about 80 m
+DEFAULT_CELL_MI = 0.05
+# Rasters with more cells than this are not built, 64 MiB of float32
+MAX_CELLS = 16 * 1024 * 1024
+MILES_PER_DEGREE_LAT = 69.0
+
+# Raster files are a header followed by rows * cols float32 values, row-major from the south west corner. The key
+# is a sha256 digest of everything the values were computed from, a raster whose key does not match is stale.
+RASTER_MAGIC = b"PYAGRST\x00"
+RASTER_VERSION = 1
+# magic, version, rows, cols, south, west, lat step, long step, key
+_HEADER = struct.Struct("<8sIII4d32s")
+_VALUE = struct.Struct("<f")
+
+
+def raster_key(*parts) -> str:
+    """
+    Hashes the inputs of a raster
+    :param parts: Anything with a stable repr, such as the station digest and the grid bounds
+    :return: The sha256 hex digest
+    """
+    return hashlib.sha256(repr((RASTER_VERSION,) + parts).encode()).hexdigest()
+
+
+def grid_bounds(points, margin_mi: float) -> list:
+    """
+    Gets the bounds of a grid covering points
+    :param points: Iterable of (lat, long)
+    :param margin_mi: Miles to add around the points
+    :return: [south, west, north, east], or None if there are no points
+    """
+    lats = []
+    longs = []
+    for lat, long in points:
+        lats.append(lat)
+        longs.append(long)
+    if not lats:
+        return None
+    lat_margin = margin_mi / MILES_PER_DEGREE_LAT
+    long_margin = lat_margin / max(math.cos(math.radians(max(abs(min(lats)), abs(max(lats))))), 0.01)
+    return [min(lats) - lat_margin, min(longs) - long_margin, max(lats) + lat_margin, max(longs) + long_margin]
+
+
+class LocationRaster:
+    """
+    Precomputed values of a location criterion over a regular lat/long grid. Sampling interpolates between the four
+    surrounding grid points, so a lookup takes the same time no matter how the value was computed.
+    """
+    def __init__(self, rows: int, cols: int, south: float, west: float, lat_step: float, long_step: float,
+                 values, key: str):
+        """
+        Constructor
+        :param rows: Number of grid rows, south to north
+        :param cols: Number of grid columns, west to east
+        :param south: Latitude of the first row
+        :param west: Longitude of the first column
+        :param lat_step: Degrees of latitude between rows
+        :param long_step: Degrees of longitude between columns
+        :param values: rows * cols float32 values, an array or a buffer
+        :param key: The key of the raster's inputs
+        """
+        self._rows = rows
+        self._cols = cols
+        self._south = south
+        self._west = west
+        self._lat_step = lat_step
+        self._long_step = long_step
+        self._values = values
+        self._key = key
+        self._map = None
+        self._file = None
+
+    @classmethod
+    def create(cls, bounds: list, cell_mi: float, fill: float, key: str):
+        """
+        Creates a raster with every value set to fill
+        :param bounds: [south, west, north, east]
+        :param cell_mi: Grid spacing in miles
+        :param fill: The initial value
+        :param key: The key of the raster's inputs
+        :return: The raster, or None if the grid would be too large
+        """
+        south, west, north, east = bounds
+        lat_step = cell_mi / MILES_PER_DEGREE_LAT
+        long_step = lat_step / max(math.cos(math.radians((south + north) / 2)), 0.01)
+        rows = int(math.ceil((north - south) / lat_step)) + 1
+        cols = int(math.ceil((east - west) / long_step)) + 1
+        if rows * cols > MAX_CELLS:
+            logger.warning("A {0} x {1} raster is too large, increase the cell size or set smaller bounds".format(
+                rows, cols))
+            return None
+        return cls(rows, cols, south, west, lat_step, long_step, array("f", [fill]) * (rows * cols), key)
+
+    @classmethod
+    def load(cls, path: str, key: str = None):
+        """
+        Maps a raster file
+        :param path: The raster file
+        :param key: The expected key, a raster with a different key is not loaded
+        :return: The raster, or None if there is no such raster or it is stale
+        """
+        if not os.path.isfile(path):
+            return None
+        raster_file = open(path, "rb")
+        try:
+            raster_map = mmap.mmap(raster_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raster_file.close()
+            return None
+        if len(raster_map) < _HEADER.size:
+            raster_map.close()
+            raster_file.close()
+            return None
+        magic, version, rows, cols, south, west, lat_step, long_step, file_key = _HEADER.unpack_from(raster_map, 0)
+        if (magic != RASTER_MAGIC or version != RASTER_VERSION or (key is not None and file_key.hex() != key)
+                or len(raster_map) < _HEADER.size + rows * cols * _VALUE.size):
+            raster_map.close()
+            raster_file.close()
+            return None
+        raster = cls(rows, cols, south, west, lat_step, long_step,
+                     memoryview(raster_map)[_HEADER.size:_HEADER.size + rows * cols * _VALUE.size].cast("f"),
+                     file_key.hex())
+        raster._map = raster_map
+        raster._file = raster_file
+        return raster
+
+    def save(self, path: str) -> None:
+        """
+        Writes the raster. The file is written next to the destination and swapped in.
+        :param path: The raster file
+        :return: Nothing
+        """
+        raster_dir = os.path.dirname(path)
+        if raster_dir and not os.path.isdir(raster_dir):
+            os.makedirs(raster_dir)
+        temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as raster_file:
+            raster_file.write(_HEADER.pack(RASTER_MAGIC, RASTER_VERSION, self._rows, self._cols, self._south,
+                                           self._west, self._lat_step, self._long_step, bytes.fromhex(self._key)))
+            values = array("f", self._values)
+            if sys.byteorder != "little":
+                values.byteswap()
+            values.tofile(raster_file)
+        os.replace(temp_path, path)
+
+    @property
+    def key(self) -> str:
+        return self._key
+
+    def splat_distance(self, lat: float, long: float, radius_mi: float) -> None:
+        """
+        Lowers every grid point within a radius of a point to its distance from the point. Splatting every station
+        gives the distance to the nearest one, up to the radius, touching only the grid points near each station.
+        :param lat: Latitude of the point
+        :param long: Longitude of the point
+        :param radius_mi: The radius in miles
+        :return: Nothing
+        """
+        values = self._values
+        lat_cells = int(math.ceil(radius_mi / MILES_PER_DEGREE_LAT / self._lat_step))
+        long_cells = int(math.ceil(radius_mi / (MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+                                   / self._long_step))
+        center_row = int(round((lat - self._south) / self._lat_step))
+        center_col = int(round((long - self._west) / self._long_step))
+        first_col = max(center_col - long_cells, 0)
+        last_col = min(center_col + long_cells, self._cols - 1)
+        for row in range(max(center_row - lat_cells, 0), min(center_row + lat_cells, self._rows - 1) + 1):
+            row_lat = self._south + row * self._lat_step
+            row_offset = row * self._cols
+            for col in range(first_col, last_col + 1):
+                distance = distance_mi(row_lat, self._west + col * self._long_step, lat, long)
+                if distance < values[row_offset + col]:
+                    values[row_offset + col] = distance
+
+    def sample(self, lat: float, long: float):
+        """
+        Samples the raster with bilinear interpolation
+        :param lat: Latitude
+        :param long: Longitude
+        :return: The interpolated value, or None if the point is outside the raster
+        """
+        row_position = (lat - self._south) / self._lat_step
+        col_position = (long - self._west) / self._long_step
+        if not (0 <= row_position <= self._rows - 1 and 0 <= col_position <= self._cols - 1):
+            return None
+        row = min(int(row_position), self._rows - 2) if self._rows > 1 else 0
+        col = min(int(col_position), self._cols - 2) if self._cols > 1 else 0
+        row_fraction = row_position - row
+        col_fraction = col_position - col
+        values = self._values
+        offset = row * self._cols + col
+        south_west = values[offset]
+        south_east = values[offset + 1] if self._cols > 1 else south_west
+        north_offset = offset + self._cols if self._rows > 1 else offset
+        north_west = values[north_offset]
+        north_east = values[north_offset + 1] if self._cols > 1 else north_west
+        south = south_west + (south_east - south_west) * col_fraction
+        north = north_west + (north_east - north_west) * col_fraction
+        return south + (north - south) * row_fraction
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._values.release()
+            self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
+
+
+def load_station_distance_raster(stations, station_digest: str, max_distance: float, cell_mi: float = DEFAULT_CELL_MI,
+                                 bounds: list = None, cache_dir: str = RASTER_CACHE_DIR):
+    """
+    Gets the raster of the distance to the nearest station, capped at max_distance. The raster is cached on disk and
+    built again when the stations, the grid or the cap change.
+    :param stations: Iterable of station (lat, long)
+    :param station_digest: Digest identifying the station data
+    :param max_distance: Distances are only computed up to this many miles, further points read as max_distance
+    :param cell_mi: Grid spacing in miles
+    :param bounds: [south, west, north, east] of the grid, by default the stations plus max_distance
+    :param cache_dir: Directory of the cached rasters, empty to not cache
+    :return: The raster, or None if it would be too large
+    """
+    stations = [(float(lat), float(long)) for lat, long in stations]
+    if bounds is None:
+        bounds = grid_bounds(stations, max_distance)
+        if bounds is None:
+            return None
+    key = raster_key("station_distance", station_digest, [round(bound, 6) for bound in bounds], cell_mi,
+                     max_distance)
+    # Named by the key, so rasters for different stations or options do not overwrite each other
+    path = os.path.join(cache_dir, "station_distance_{0}.rst".format(key[:16])) if cache_dir else ""
+    if path:
+        raster = LocationRaster.load(path, key)
+        if raster is not None:
+            logger.debug("Using station distance raster {0}".format(path))
+            return raster
+
+    raster = LocationRaster.create(bounds, cell_mi, max_distance, key)
+    if raster is None:
+        return None
+    logger.info("Building station distance raster for {0} stations".format(len(stations)))
+    for lat, long in stations:
+        raster.splat_distance(lat, long, max_distance)
+    if path:
+        try:
+            raster.save(path)
+        except OSError as e:
+            logger.warning("Could not save raster {0}: {1}".format(path, e))
+    return raster
@@ -0,0 +1,195 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import datetime
+import decimal
+import json
+import logging
+import os
+from . import compression
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Serialization formats. JSON is used for anything a person or another program may read, msgpack is a smaller and
+# faster binary format for files only PyAgent reads.
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+EXTENSIONS = {FORMAT_JSON: ".json", FORMAT_MSGPACK: ".msgpack"}
+
+# orjson is several times faster than the json module at both ends, and writes the same JSON
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+# Format for internal files, binary if msgpack is installed
+INTERNAL_FORMAT = FORMAT_MSGPACK if msgpack is not None else FORMAT_JSON
+
+if orjson is not None:
+    # Dataclasses go through _default like anything else, so listings keep their region. Integer dict keys are
+    # written as strings, like the json module does.
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    """
+    Converts the types that are not JSON types, for both JSON encoders and msgpack
+    :param obj: The object
+    :return: A JSON compatible object
+    """
+    # Listings, and any other record with a dict form
+    to_dict = getattr(obj, "to_dict", None)
+    if to_dict is not None:
+        return to_dict()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError("Object of type {0} is not serializable".format(type(obj).__name__))
+
+
+def is_available(fmt: str) -> bool:
+    """
+    Checks whether a format can be used, msgpack needs the optional msgpack package
+    :param fmt: The format name
+    :return: True if available, false if otherwise
+    """
+    if fmt == FORMAT_MSGPACK:
+        return msgpack is not None
+    return fmt == FORMAT_JSON
+
+
+def format_for_path(path: str) -> str:
+    """
+    Gets the format of a file from its extension, ignoring any compression extension
+    :param path: The file path
+    :return: The format name
+    """
+    if compression.strip_extension(path).endswith(EXTENSIONS[FORMAT_MSGPACK]):
+        return FORMAT_MSGPACK
+    return FORMAT_JSON
+
+
+def dumpb(obj) -> bytes:
+    """
+    Encodes an object as UTF-8 JSON
+    :param obj: The object
+    :return: The JSON, as bytes
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # Integers past 64 bits and the like, which the json module still handles
+            pass
+    return json.dumps(obj, default=_default).encode("utf-8")
+
+
+def dumps(obj) -> str:
+    """
+    Encodes an object as JSON
+    :param obj: The object
+    :return: The JSON, as a string
+    """
+    if orjson is not None:
+        return dumpb(obj).decode("utf-8")
+    return json.dumps(obj, default=_default)
+
+
+def loads(data):
+    """
+    Decodes JSON
+    :param data: The JSON, as str, bytes or a memoryview
+    :return: The object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def encode(obj, fmt: str = FORMAT_JSON) -> bytes:
+    """
+    Encodes an object in a format
+    :param obj: The object
+    :param fmt: The format name
+    :return: The encoded object
+    """
+    if fmt == FORMAT_MSGPACK:
+        if msgpack is None:
+            raise ValueError("The msgpack format requires the msgpack package")
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+    return dumpb(obj)
+
+
+def decode(data, fmt: str = FORMAT_JSON):
+    """
+    Decodes an object encoded with encode()
+    :param data: The encoded object
+    :param fmt: The format name
+    :return: The object
+    """
+    if fmt == FORMAT_MSGPACK:
+        if msgpack is None:
+            raise ValueError("Reading msgpack data requires the msgpack package")
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    return loads(data)
+
+
+def load(path: str, fmt: str = None):
+    """
+    Reads a whole file, compressed or not, in one go
+    :param path: The file path
+    :param fmt: The format, by default from the extension
+    :return: The object
+    """
+    with compression.open_compressed(path, "rb") as in_file:
+        data = in_file.read()
+    return decode(data, fmt if fmt is not None else format_for_path(path))
+
+
+def save(path: str, obj, fmt: str = None) -> None:
+    """
+    Writes a whole file. The file is written next to the destination first and swapped in, so a crash while saving
+    leaves the old file intact.
+    :param path: The file path, ending in .gz or .zst to compress it
+    :param obj: The object
+    :param fmt: The format, by default from the extension
+    :return: Nothing
+    """
+    data = encode(obj, fmt if fmt is not None else format_for_path(path))
+    # Keep the compression extension last, open_compressed goes by it
+    extension = compression.EXTENSIONS[compression.codec_for_path(path)]
+    temp_path = "{0}.{1}.tmp{2}".format(compression.strip_extension(path), os.getpid(), extension)
+    try:
+        with compression.open_compressed(temp_path, "wb") as out_file:
+            out_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,419 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import copy
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import threading
+from .cache import LocationCache
+from . import compression
+from . import serialize
+
+logger = logging.getLogger(__name__)
+
+WORKER_LOG_FORMAT = "[%(asctime)s][%(processName)12.12s][%(levelname)5.5s] %(message)s"
+
+
+class ScrapeShard:
+    """
+    One region/source pair of a multi-region scrape, run in its own worker process
+    """
+    def __init__(self, source_key: str, region: str, config: dict, output_path: str, settings: dict,
+                 source_settings: dict = None):
+        """
+        Constructor
+        :param source_key: The key of the source to scrape
+        :param region: The region name, empty for a scrape without regions
+        :param config: The source config options for this region
+        :param output_path: The JSON lines file the shard writes its listings to
+        :param settings: The scrapy crawler settings, without FEEDS
+        :param source_settings: Scrapy settings specific to this source, such as its request headers, or None
+        """
+        self.source_key = source_key
+        self.region = region
+        self.config = config
+        self.output_path = output_path
+        self.settings = settings
+        self.source_settings = source_settings
+
+    @property
+    def name(self) -> str:
+        if not self.region:
+            return self.source_key
+        return "{0}@{1}".format(self.source_key, self.region)
+
+
+# Start URLs and custom settings of each spider class as first seen. Sources set these on the class, so a process
+# scraping more than one shard puts them back before each one.
+_spider_defaults = {}
+
+
+def _new_result(shard: ScrapeShard) -> dict:
+    return {"shard": shard.name, "success": False, "location": {}, "reverse": {}, "times": {}, "metrics": {}}
+
+
+def run_shard(shard: ScrapeShard) -> dict:
+    """
+    Scrapes a single shard. Runs in a worker process, since the scrapy reactor can only be started once per process.
+    An exception fails only this shard, the other shards keep running.
+    :param shard: The shard to scrape
+    :return: Dict with the shard name, whether it succeeded, the location cache entries it added and a snapshot of
+    the worker's metrics
+    """
+    from . import metrics
+
+    logging.basicConfig(level=logging.WARNING, format=WORKER_LOG_FORMAT)
+    result = _new_result(shard)
+    try:
+        LocationCache.init_cache()
+        _scrape_shard(shard, result, _crawl_process)
+    except Exception as e:
+        logger.exception("Shard {0} raised an exception".format(shard.name))
+        result["error"] = "{0}: {1}".format(type(e).__name__, e)
+    result["metrics"] = metrics.REGISTRY.snapshot()
+    return result
+
+
+def _crawl_process(settings: dict, scrapy_spider) -> None:
+    """
+    Crawls with a CrawlerProcess, which starts and stops the reactor, so it only works once per process
+    :param settings: The crawler settings
+    :param scrapy_spider: The spider class
+    :return: Nothing
+    """
+    from scrapy.crawler import CrawlerProcess
+    from . import metrics
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(scrapy_spider)
+    metrics.instrument_crawler(crawler)
+    process.crawl(crawler)
+    process.start()
+
+
+def _crawl_runner(settings: dict, scrapy_spider) -> None:
+    """
+    Crawls with a CrawlerRunner on a reactor already running on another thread, and waits for the crawl to finish
+    :param settings: The crawler settings
+    :param scrapy_spider: The spider class
+    :return: Nothing
+    """
+    from scrapy.crawler import CrawlerRunner
+    from twisted.internet import reactor, threads
+    from . import metrics
+
+    def crawl():
+        runner = CrawlerRunner(settings)
+        crawler = runner.create_crawler(scrapy_spider)
+        metrics.instrument_crawler(crawler)
+        return runner.crawl(crawler)
+    threads.blockingCallFromThread(reactor, crawl)
+
+
+def _scrape_shard(shard: ScrapeShard, result: dict, crawl) -> None:
+    """
+    Runs the crawl of a shard and fills in its result
+    :param shard: The shard to scrape
+    :param result: The result to fill in
+    :param crawl: Callable running a crawl to the end, given the settings and the spider class
+    :return: Nothing
+    """
+    # Imported here so the parent process does not pay for scrapy until a shard actually runs
+    from . import get_source
+    from .addresses import AddressLookup
+
+    AddressLookup.cache_only = shard.settings.get("PYAGENT_GEOCODE_CACHE_ONLY", False)
+    known_locations = set(LocationCache.location_data)
+    known_reverse = set(LocationCache.location_reverse_data)
+
+    source = get_source(shard.source_key)
+    if source is None:
+        logger.error("No source with name {0}".format(shard.source_key))
+        return
+    for key, value in shard.config.items():
+        source.add_config(key, value)
+    if not source.verify_config():
+        logger.error("Invalid config for shard {0}".format(shard.name))
+        return
+
+    scrapy_spider = source.spider.scrapy_spider
+    defaults = _spider_defaults.get(scrapy_spider)
+    if defaults is None:
+        _spider_defaults[scrapy_spider] = (copy.copy(scrapy_spider.start_urls),
+                                           copy.copy(scrapy_spider.custom_settings))
+    else:
+        scrapy_spider.start_urls = copy.copy(defaults[0])
+        scrapy_spider.custom_settings = copy.copy(defaults[1])
+    source.init()
+
+    if shard.source_settings:
+        if not scrapy_spider.custom_settings:
+            scrapy_spider.custom_settings = {}
+        scrapy_spider.custom_settings.update(shard.source_settings)
+
+    settings = dict(shard.settings)
+    settings["FEEDS"] = {shard.output_path: {"format": "jsonlines"}}
+    crawl(settings, scrapy_spider)
+
+    # Only send back what this shard learned, the parent merges it into its own cache
+    result["location"] = {key: value for key, value in LocationCache.location_data.items()
+                          if key not in known_locations}
+    result["reverse"] = {key: value for key, value in LocationCache.location_reverse_data.items()
+                         if key not in known_reverse}
+    result["times"] = {"forward": {key: LocationCache.location_times["forward"][key] for key in result["location"]
+                                   if key in LocationCache.location_times["forward"]},
+                       "reverse": {key: LocationCache.location_times["reverse"][key] for key in result["reverse"]
+                                   if key in LocationCache.location_times["reverse"]}}
+    result["success"] = True
+
+
+def _merge_locations(update: dict) -> None:
+    LocationCache.location_data.update(update["location"])
+    LocationCache.location_reverse_data.update(update["reverse"])
+    for kind, times in update["times"].items():
+        LocationCache.location_times[kind].update(times)
+
+
+def _merge_result(result: dict) -> None:
+    """
+    Logs a shard result, and merges the location cache entries and metrics it recorded
+    :param result: The shard result
+    :return: Nothing
+    """
+    from . import metrics
+
+    if result["success"]:
+        logger.info("Finished shard {0}".format(result["shard"]))
+    elif "error" in result:
+        logger.error("Shard {0} failed: {1}".format(result["shard"], result["error"]))
+    else:
+        logger.error("Shard {0} failed".format(result["shard"]))
+    metrics.REGISTRY.merge(result["metrics"])
+    _merge_locations(result)
+
+
+def run_shards(shards: list, parallelism: int) -> list:
+    """
+    Scrapes shards in parallel worker processes and merges the location cache entries and metrics they recorded
+    :param shards: The shards to scrape
+    :param parallelism: The maximum number of worker processes
+    :return: List of shard results, in completion order
+    """
+    results = []
+    # Twisted's reactor does not survive a fork, so always start fresh interpreters
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=max(1, min(parallelism, len(shards))), maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(run_shard, shards):
+            _merge_result(result)
+            results.append(result)
+    return results
+
+
+def _host_main(connection) -> None:
+    """
+    Main loop of a crawler host process. The reactor runs on its own thread for the life of the process, and each
+    shard received is crawled on it with a CrawlerRunner.
+    :param connection: Pipe to the parent, receives (shard, location updates) and sends back shard results. None
+    stops the process.
+    :return: Nothing
+    """
+    from twisted.internet import reactor
+    from . import metrics
+
+    # The parent stops the host when it is interrupted
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.WARNING, format=WORKER_LOG_FORMAT)
+    LocationCache.init_cache()
+    threading.Thread(target=reactor.run, kwargs={"installSignalHandlers": False}, daemon=True).start()
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        shard, updates = message
+        for update in updates:
+            _merge_locations(update)
+        result = _new_result(shard)
+        try:
+            _scrape_shard(shard, result, _crawl_runner)
+        except Exception as e:
+            logger.exception("Shard {0} raised an exception".format(shard.name))
+            result["error"] = "{0}: {1}".format(type(e).__name__, e)
+        # Each result only carries the metrics of its own shard
+        result["metrics"] = metrics.REGISTRY.snapshot()
+        metrics.REGISTRY.reset()
+        connection.send(result)
+    reactor.callFromThread(reactor.stop)
+
+
+class CrawlerHost:
+    """
+    Long-lived worker processes for scraping shards again and again, such as every daemon cycle. Each process starts
+    its reactor once and keeps its location cache loaded between shards, and is sent the location cache entries the
+    other processes found along with its next shard. A process runs one shard at a time, since sources keep their
+    settings on the spider class.
+    """
+    def __init__(self, processes: int):
+        """
+        Constructor
+        :param processes: The maximum number of worker processes
+        """
+        # Twisted's reactor does not survive a fork, so always start fresh interpreters
+        self._context = multiprocessing.get_context("spawn")
+        self._size = max(1, processes)
+        self._workers = []
+        # Location cache entries of the shard results so far, until every worker has been sent them
+        self._updates = []
+        # Number of updates dropped from the front of _updates, update positions count from the first one
+        self._update_base = 0
+
+    def _start_worker(self) -> dict:
+        connection, child_connection = self._context.Pipe()
+        process = self._context.Process(target=_host_main, args=(child_connection,), daemon=True)
+        process.start()
+        child_connection.close()
+        # A new worker reads the location cache from disk, which may be missing the updates not yet saved
+        worker = {"process": process, "connection": connection, "cursor": self._update_base}
+        self._workers.append(worker)
+        return worker
+
+    def _stop_worker(self, worker: dict) -> None:
+        try:
+            worker["connection"].send(None)
+        except OSError:
+            pass
+        worker["process"].join(timeout=30)
+        if worker["process"].is_alive():
+            worker["process"].terminate()
+            worker["process"].join()
+        worker["connection"].close()
+        self._workers.remove(worker)
+
+    def run(self, shards: list) -> list:
+        """
+        Scrapes shards on the worker processes, starting them if they are not running, and merges the location cache
+        entries and metrics they recorded
+        :param shards: The shards to scrape
+        :return: List of shard results, in completion order
+        """
+        pending = list(shards)
+        while len(self._workers) < min(self._size, len(pending)):
+            self._start_worker()
+        idle = list(self._workers)
+        busy = {}
+        results = []
+        while pending or busy:
+            while pending and idle:
+                worker = idle.pop()
+                shard = pending.pop(0)
+                updates = self._updates[worker["cursor"] - self._update_base:]
+                worker["cursor"] = self._update_base + len(self._updates)
+                try:
+                    worker["connection"].send((shard, updates))
+                except OSError as e:
+                    logger.error("Crawler host {0} is gone, starting another: {1}".format(worker["process"].pid, e))
+                    self._stop_worker(worker)
+                    idle.append(self._start_worker())
+                    pending.insert(0, shard)
+                    continue
+                busy[worker["connection"]] = (worker, shard)
+            for connection in multiprocessing.connection.wait(list(busy)):
+                worker, shard = busy.pop(connection)
+                try:
+                    result = connection.recv()
+                except (EOFError, OSError):
+                    logger.error("Crawler host {0} exited while scraping shard {1}".format(worker["process"].pid,
+                                                                                          shard.name))
+                    result = _new_result(shard)
+                    result["error"] = "crawler host exited"
+                    self._stop_worker(worker)
+                    worker = self._start_worker()
+                _merge_result(result)
+                self._updates.append({key: result[key] for key in ("location", "reverse", "times")})
+                results.append(result)
+                idle.append(worker)
+
+        # Drop the updates every worker has been sent
+        sent = min(worker["cursor"] for worker in self._workers) - self._update_base
+        del self._updates[:sent]
+        self._update_base += sent
+        return results
+
+    def close(self) -> None:
+        """
+        Stops the worker processes
+        :return: Nothing
+        """
+        for worker in list(self._workers):
+            self._stop_worker(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_shards(shards: list, remove: bool = True):
+    """
+    Reads the listings from shard outputs, tagged with the region they came from
+    :param shards: The shards to read, in output order
+    :param remove: Whether to delete the shard files once read
+    :return: Generator of listings
+    """
+    for shard in shards:
+        if not os.path.isfile(shard.output_path):
+            logger.warning("Shard {0} produced no output".format(shard.name))
+            continue
+        with open(shard.output_path, "r") as shard_file:
+            for line in shard_file:
+                if not line.strip():
+                    continue
+                try:
+                    housing = serialize.loads(line)
+                except ValueError as e:
+                    logger.error("Skipping invalid line in shard {0}: {1}".format(shard.name, e))
+                    continue
+                if shard.region:
+                    housing["region"] = shard.region
+                yield housing
+        if remove:
+            os.remove(shard.output_path)
+
+
+def merge_shards(shards: list, output_path: str, remove: bool = True) -> int:
+    """
+    Merges shard outputs into a single scrape results file. UIDs are only unique within a worker process, so every
+    listing is given a new UID.
+    :param shards: The shards to merge, in output order
+    :param output_path: The merged JSON lines file, compressed if it ends in .gz or .zst
+    :param remove: Whether to delete the shard files once merged
+    :return: Number of listings merged
+    """
+    uid = 0
+    with compression.open_compressed(output_path, "w") as output_file:
+        for housing in read_shards(shards, remove):
+            uid += 1
+            housing["uid"] = uid
+            output_file.write(serialize.dumps(housing) + "\n")
+    return uid
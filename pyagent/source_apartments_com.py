@@ -18,6 +18,7 @@
 
 import logging
 import scrapy
+from twisted.internet import threads
 import geopy
 import re
 import geopy.geocoders as gc
@@ -25,6 +26,9 @@ import time
 from .cache import LocationCache
 from .spider import ScrapySpider, BaseSpider
 from .addresses import AddressLookup
+from .listing import Listing
+from .frontier import FrontierSpiderMixin
+from .extract import FieldSet, compile_css
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +38,33 @@ DO_MULTIPLE_PAGES = True
 # Set to 0 for infinite
 MAX_APARTMENT_SCRAPES = 0
 
+# Search page, one placard per property
+PLACARDS = compile_css('div#placardContainer > ul > li.mortar-wrapper')
+PLACARD_FIELDS = FieldSet({
+    "availability": '.property-information-wrapper > .availability ::text',
+    "title": '.property-title ::attr(title)',
+    "address_title": '.property-address ::attr(title)',
+    "link": '.property-link ::attr(href)',
+})
+PAGE_RANGE = FieldSet({"page_range": ".searchResults > .pageRange ::text"})
+# Property page, one row per unit in the first table
+PROPERTY_FIELDS = FieldSet({
+    "name": ".propertyNameRow > .propertyName ::text",
+    "address": ".propertyAddressRow > .propertyAddress > h2",
+})
+UNIT_TABS = compile_css(".tabContent")
+UNIT_TABLES = compile_css(".availabilityTable")
+UNIT_ROWS = compile_css(".rentalGridRow")
+UNIT_FIELDS = FieldSet({
+    "unit_button": ".rentalGridRow > .unit > button ::text",
+    "unit": ".rentalGridRow > .unit ::text",
+    "rent": ".rentalGridRow > .rent ::text",
+    "deposit": ".rentalGridRow > .deposit ::text",
+    "sqft": ".rentalGridRow > .sqft ::text",
+    "beds": ".rentalGridRow > .beds > .longText ::text",
+    "baths": ".rentalGridRow > .baths > .longText ::text",
+})
+
 
 class ApartmentsComSpider(ScrapySpider):
     """
@@ -49,7 +80,7 @@ class ApartmentsComSpider(ScrapySpider):
         self._spider.start_urls.append(start_urls)
 
 
-class ApartmentsComSpiderWorker(scrapy.Spider):
+class ApartmentsComSpiderWorker(FrontierSpiderMixin, scrapy.Spider):
     """
     scrapy spider class for scraping apartments.com search page
     """
@@ -68,40 +99,38 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
         self.handle_httpstatus_list = [400]
 
     def parse_apartment(self, response):
-        if self._apartment_index >= MAX_APARTMENT_SCRAPES != 0:
+        frontier_meta = response.meta.get("frontier_meta")
+        if frontier_meta is None and self._apartment_index >= MAX_APARTMENT_SCRAPES != 0:
             return
 
-        property_name = response.css(".propertyNameRow > .propertyName ::text").extract_first()
+        root = response.selector.root
+        property_fields = PROPERTY_FIELDS.extract(root)
+        property_name = property_fields["name"]
         # remove excess whitespace and control characters
         if property_name:
             property_name = BaseSpider.cleanup_garbage(property_name)
-        property_addr = response.css(".propertyAddressRow > .propertyAddress > h2").extract_first()
+        property_addr = property_fields["address"]
         if property_addr:
             property_addr = BaseSpider.cleanup_garbage(property_addr.replace("<span>", "").replace("</span>", "")
                                                  .replace("<h2>", "").replace("</h2>", ""))
-        property_neighborhood = response.css(".neighborhoodAddress > a.neighborhood ::text").extract_first()
 
         # Get the first table of units (usually All)
-        first_tab = response.css(".tabContent")
-        if first_tab:
-            first_tab = first_tab[0]
-        else:
-            # If it doesnt exist, true single rental table
-            first_tab = response.css(".availabilityTable")
-            if first_tab:
-                first_tab = first_tab[0]
+        # If it doesnt exist, true single rental table
+        first_tab = UNIT_TABS(root) or UNIT_TABLES(root)
+        unit_rows = UNIT_ROWS(first_tab[0]) if first_tab else []
 
         # Check each unit
-        for unit in first_tab.css(".rentalGridRow"):
-            unit_str = unit.css(".rentalGridRow > .unit > button ::text").extract_first()
+        for unit in unit_rows:
+            unit_fields = UNIT_FIELDS.extract(unit)
+            unit_str = unit_fields["unit_button"]
             if unit_str:
                 unit_str = BaseSpider.cleanup_garbage(unit_str)
             else:
-                unit_str = unit.css(".rentalGridRow > .unit ::text").extract_first()
+                unit_str = unit_fields["unit"]
                 if unit_str:
                     unit_str = BaseSpider.cleanup_garbage(unit_str)
 
-            rent_str = unit.css(".rentalGridRow > .rent ::text").extract_first()
+            rent_str = unit_fields["rent"]
             if rent_str:
                 rent_str = BaseSpider.cleanup_garbage(rent_str)
                 try:
@@ -109,7 +138,7 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
                     rent_str = rent_val
                 except ValueError:
                     pass
-            deposit_str = unit.css(".rentalGridRow > .deposit ::text").extract_first()
+            deposit_str = unit_fields["deposit"]
             if deposit_str:
                 deposit_str = BaseSpider.cleanup_garbage(deposit_str)
                 try:
@@ -117,7 +146,7 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
                     deposit_str = deposit_val
                 except ValueError:
                     pass
-            sqft_str = unit.css(".rentalGridRow > .sqft ::text").extract_first()
+            sqft_str = unit_fields["sqft"]
             if sqft_str:
                 sqft_str = BaseSpider.cleanup_garbage(sqft_str)
                 try:
@@ -126,7 +155,7 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
                 except ValueError:
                     pass
 
-            beds_str = unit.css(".rentalGridRow > .beds > .longText ::text").extract_first()
+            beds_str = unit_fields["beds"]
             if beds_str:
                 beds_str = BaseSpider.cleanup_garbage(beds_str)
                 integers = re.search(r'\d+', beds_str)
@@ -134,7 +163,7 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
                     beds_val = int(integers.group())
                     beds_str = beds_val
 
-            baths_str = unit.css(".rentalGridRow > .baths > .longText ::text").extract_first()
+            baths_str = unit_fields["baths"]
             if baths_str:
                 baths_str = BaseSpider.cleanup_garbage(baths_str)
                 half_bath = False
@@ -147,29 +176,36 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
                         baths_val += 0.5
                     baths_str = baths_val
 
-            location = self._locations[self._apartment_index]
+            if frontier_meta is not None:
+                location = frontier_meta["location"]
+                additional_tags = frontier_meta["additional"]
+            else:
+                location = self._locations[self._apartment_index]
+                additional_tags = self._additional_tags[self._apartment_index]
             address = AddressLookup.construct_address(location)
-            additional_tags = self._additional_tags[self._apartment_index]
-
-            yield {
-                "uid": BaseSpider.get_next_uid(),
-                "address": address,
-                "neighborhood": location["neighborhood"],
-                "suburb": location["suburb"],
-                "city": location["city"],
-                "state": location["state"],
-                "rent": rent_str,
-                "deposit": deposit_str,
-                "sqft": sqft_str,
-                "beds": beds_str,
-                "baths_str": baths_str,
-                "unit": unit_str,
-                "coordinates": (location["lat"], location["long"]),
-                "additional": additional_tags,
-                "link": response.request.url,
-                "source": "apartments.com"
-            }
 
+            yield Listing(
+                uid=BaseSpider.get_next_uid(),
+                address=address,
+                neighborhood=location["neighborhood"],
+                suburb=location["suburb"],
+                city=location["city"],
+                state=location["state"],
+                rent=rent_str,
+                deposit=deposit_str,
+                sqft=sqft_str,
+                beds=beds_str,
+                baths_str=baths_str,
+                unit=unit_str,
+                coordinates=(location["lat"], location["long"]),
+                additional=additional_tags,
+                link=response.request.url,
+                source="apartments.com"
+            )
+
+        if frontier_meta is not None:
+            self.frontier_task_done(response)
+            return
         # Move to the next one
         if self._apartment_index+1 < len(self._apartment_urls):
             self._apartment_index += 1
@@ -181,8 +217,8 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
         if response.status == 400:
             print(response.request.headers)
         # Get number of pages
-        page_range_selector = ".searchResults > .pageRange ::text"
-        page_range = response.css(page_range_selector).extract_first()
+        root = response.selector.root
+        page_range = PAGE_RANGE.extract(root)["page_range"]
         page_current = 1
         page_count = 1
         if page_range:
@@ -195,19 +231,13 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
         else:
             logger.error("Could not find page range, see source at {0}".format(response.request.url))
 
-        set_selector = 'div#placardContainer > ul > li.mortar-wrapper'
-        for apt_placard in response.css(set_selector):
-            availability_selector = '.property-information-wrapper > .availability ::text'
-            price_selector = '.price-wrapper > .price-range ::text'
-            link_selector = '.property-link ::attr(href)'
-
-            availability = apt_placard.css(availability_selector).extract_first()
-            if availability == "Unavailable":
+        placards = []
+        for placard in PLACARD_FIELDS.extract_each(PLACARDS, root):
+            if placard["availability"] == "Unavailable":
                 continue
 
             # Get the address
-            addr_selector = '.property-title ::attr(title)'
-            addr_title = apt_placard.css(addr_selector).extract_first()
+            addr_title = placard["title"]
             second_title = False
             additional_tags = []
             if "Condo for Rent" in addr_title:
@@ -217,16 +247,36 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
                 additional_tags.append("Townhome")
                 second_title = True
             if second_title:
-                addr_sub_selector = '.property-address ::attr(title)'
-                addr_title = apt_placard.css(addr_sub_selector).extract_first()
-
+                addr_title = placard["address_title"]
+            placards.append((placard, addr_title, additional_tags))
+
+        # Geocode the whole page at once, so repeated addresses are only requested once. Lookups wait on the
+        # geocoder, so they run on a thread instead of holding up the reactor, and the placards are followed after.
+        prefetch = threads.deferToThread(AddressLookup.prefetch_addresses,
+                                         [addr_title for _, addr_title, _ in placards], source=self.name)
+        prefetch.addCallback(lambda _: list(self._follow_placards(placards, page_current, page_count)))
+        return prefetch
+
+    def _follow_placards(self, placards, page_current, page_count):
+        """
+        Follows the placards of a search page once their addresses are geocoded, then the next search page
+        :param placards: List of (placard fields, address, additional tags)
+        :param page_current: The number of the search page
+        :param page_count: The number of search pages
+        :return: Generator of requests
+        """
+        for placard, addr_title, additional_tags in placards:
             # Check if address is in cache
-            location = AddressLookup.lookup_address(addr_title)
+            location = AddressLookup.lookup_address(addr_title, source=self.name)
             if location is None:
                 logger.warning("Skipping '{0}' due to invalid address".format(addr_title))
                 continue
 
-            apartment_link = apt_placard.css(link_selector).extract_first()
+            apartment_link = placard["link"]
+            if self.frontier is not None:
+                self.frontier_push(apartment_link, "parse_apartment", {"location": location,
+                                                                       "additional": additional_tags})
+                continue
             self._apartment_urls.append(apartment_link)
             self._additional_tags.append(additional_tags)
             self._locations.append(location)
@@ -238,7 +288,7 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
             request = scrapy.Request(url=next_page_url, meta={'dont_merge_cookies': True})
             yield request
         # Start parsing individual apartments
-        else:
+        elif self.frontier is None:
             self._apartment_index = 0
             if self._apartment_urls:
                 next_page_url = self._apartment_urls[self._apartment_index]
@@ -246,4 +296,7 @@ class ApartmentsComSpiderWorker(scrapy.Spider):
                 yield request
             else:
                 logger.warning("No housing found on page")
+        # Start on the detail pages while the remaining search pages load
+        if self.frontier is not None:
+            yield from self.frontier_requests()
 
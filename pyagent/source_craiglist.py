@@ -24,6 +24,9 @@ import geopy.geocoders as gc
 from .cache import LocationCache
 from .spider import ScrapySpider, BaseSpider
 from .addresses import AddressLookup
+from .listing import Listing
+from .frontier import FrontierSpiderMixin
+from .extract import FieldSet, compile_css
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +34,21 @@ logger = logging.getLogger(__name__)
 # Set to 0 for infinite
 MAX_HOUSING_SCRAPES = 50
 
+# Search page, one row per post
+RESULT_ROWS = compile_css(".rows > .result-row")
+RESULT_FIELDS = FieldSet({
+    "price": "span.result-price ::text",
+    "hood": "span.result-hood ::text",
+    "link": ".result-heading > a.result-title ::attr(href)",
+})
+# Post page
+POST_FIELDS = FieldSet({
+    "latitude": "#map ::attr(data-latitude)",
+    "longitude": "#map ::attr(data-longitude)",
+}, lists={
+    "post_infos": "p.postinginfo ::text",
+})
+
 class CraigslistSpider(ScrapySpider):
     """
     Scrapy spider for scraping craigslist
@@ -46,7 +64,7 @@ class CraigslistSpider(ScrapySpider):
         self._spider.start_urls.append(start_urls)
 
 
-class CraigslistSpiderWorker(scrapy.Spider):
+class CraigslistSpiderWorker(FrontierSpiderMixin, scrapy.Spider):
     """
     scrapy spider class for scraping craigslist.com search page
     """
@@ -60,9 +78,14 @@ class CraigslistSpiderWorker(scrapy.Spider):
         self._housing_link_list = []
 
     def parse_housing(self, response):
-        housing_data = self._housing_link_list[self._housing_index]
-        latitude = response.css("#map ::attr(data-latitude)").extract_first()
-        longitude = response.css("#map ::attr(data-longitude)").extract_first()
+        frontier_meta = response.meta.get("frontier_meta")
+        if frontier_meta is not None:
+            housing_data = frontier_meta
+        else:
+            housing_data = self._housing_link_list[self._housing_index]
+        post_fields = POST_FIELDS.extract(response)
+        latitude = post_fields["latitude"]
+        longitude = post_fields["longitude"]
         coordinates = None
         if latitude and longitude:
             try:
@@ -71,14 +94,14 @@ class CraigslistSpiderWorker(scrapy.Spider):
                 logger.error("Invalid floating-point coordinates ({0}, {1})".format(latitude, longitude))
 
         # Check if address is in cache
-        location = AddressLookup.lookup_coordinates(coordinates)
+        location = AddressLookup.lookup_coordinates(coordinates, source=self.name)
         if location is None:
             logger.warning("Skipping '{0}' due to invalid address".format(housing_data["link"]))
         else:
             address = AddressLookup.construct_address(location)
 
             # Get post ID
-            post_infos = response.css("p.postinginfo ::text").extract()
+            post_infos = post_fields["post_infos"]
             post_id = None
             for info in post_infos:
                 if "post id:" in info:
@@ -89,25 +112,28 @@ class CraigslistSpiderWorker(scrapy.Spider):
                         logger.error("Invalid post id '{0}'".format(post_id))
 
             # Yield info
-            yield {
-                "uid": BaseSpider.get_next_uid(),
-                "address": address,
-                "neighborhood": location["neighborhood"],
-                "suburb": location["suburb"],
-                "city": location["city"],
-                "state": location["state"],
-                "rent": housing_data["price"],
-                "deposit": None,
-                "sqft": None,
-                "beds": None,
-                "baths_str": None,
-                "unit": post_id,
-                "coordinates": coordinates,
-                "additional": None,
-                "link": response.request.url,
-                "source": "craigslist.com"
-            }
-
+            yield Listing(
+                uid=BaseSpider.get_next_uid(),
+                address=address,
+                neighborhood=location["neighborhood"],
+                suburb=location["suburb"],
+                city=location["city"],
+                state=location["state"],
+                rent=housing_data["price"],
+                deposit=None,
+                sqft=None,
+                beds=None,
+                baths_str=None,
+                unit=post_id,
+                coordinates=coordinates,
+                additional=None,
+                link=response.request.url,
+                source="craigslist.com"
+            )
+
+        if frontier_meta is not None:
+            self.frontier_task_done(response)
+            return
         # Go to next
         if self._housing_index+1 < len(self._housing_link_list):
             if self._housing_index+1 >= MAX_HOUSING_SCRAPES and MAX_HOUSING_SCRAPES != 0:
@@ -120,7 +146,7 @@ class CraigslistSpiderWorker(scrapy.Spider):
 
     def parse(self, response):
         # Try to get result rows
-        result_rows = response.css(".rows > .result-row")
+        result_rows = RESULT_FIELDS.extract_each(RESULT_ROWS, response)
         if not result_rows:
             logger.error("No results found on page")
             return
@@ -129,13 +155,13 @@ class CraigslistSpiderWorker(scrapy.Spider):
         price_text = None
         hood_text = None
         for row in result_rows:
-            price_text = row.css("span.result-price ::text").extract_first()
+            price_text = row["price"]
             if price_text:
                 price_text = price_text.replace("$", "").replace(",", "")
-            hood_text = row.css("span.result-hood ::text").extract_first()
+            hood_text = row["hood"]
             if hood_text:
                 hood_text = hood_text.lstrip().rstrip()
-            post_link = row.css(".result-heading > a.result-title ::attr(href)").extract_first()
+            post_link = row["link"]
 
             if post_link:
                 housing_data = {
@@ -143,10 +169,17 @@ class CraigslistSpiderWorker(scrapy.Spider):
                     "price": price_text,
                     "hood": hood_text
                 }
+                if self.frontier is not None:
+                    if len(self._housing_link_list) < MAX_HOUSING_SCRAPES or MAX_HOUSING_SCRAPES == 0:
+                        if self.frontier_push(post_link, "parse_housing", housing_data):
+                            self._housing_link_list.append(housing_data)
+                    continue
                 self._housing_link_list.append(housing_data)
 
+        if self.frontier is not None:
+            yield from self.frontier_requests()
         # Start parsing housing
-        if self._housing_link_list:
+        elif self._housing_link_list:
             self._housing_index = 0
             next_page_url = self._housing_link_list[self._housing_index]["link"]
             request = scrapy.Request(url=next_page_url, callback=self.parse_housing,
@@ -19,18 +19,33 @@
 import logging
 import scrapy
 from scrapy.shell import inspect_response
+from twisted.internet import threads
 import time
 import geopy
 import geopy.geocoders as gc
 from .spider import ScrapySpider, BaseSpider
 from .cache import LocationCache
 from .addresses import AddressLookup
+from .listing import Listing
+from .extract import FieldSet, compile_css
 
 logger = logging.getLogger(__name__)
 
 # Maximum number of pages to scrape
 MAX_SCRAPE_PAGES = 7
 
+# Search page, one card per listing
+HOUSING_LISTS = compile_css("ul.photo-cards")
+LIST_CARDS = compile_css("article.list-card")
+CARD_DETAILS = compile_css(".list-card-details > li")
+CARD_FIELDS = FieldSet({
+    "address": ".list-card-addr ::text",
+    "link": ".list-card-link ::attr(href)",
+    "price": ".list-card-price ::text",
+}, lists={
+    "details": ".list-card-details > li",
+})
+
 
 class ZillowSpider(ScrapySpider):
     """
@@ -52,151 +67,168 @@ class ZillowSpiderWorker(scrapy.Spider):
     """
     allowed_domains = ["zillow.com"]
     start_urls = []
+    # Zillow bans quickly, the [throttle] section of options.ini can override these
+    throttle_limits = {"start_delay": 5.0, "max_concurrency": 1}
 
     def __init__(self, *a, **kw):
         super(ZillowSpiderWorker, self).__init__(*a, **kw)
         self._pages_scraped = 0
         self._first_search = ZillowSpiderWorker.start_urls[0]
 
+        # The throttle never goes below this delay
         self.download_delay = 5
 
     def parse(self, response):
         #inspect_response(response, self)
-        housing_list = response.css("ul.photo-cards")
+        housing_list = HOUSING_LISTS(response.selector.root)
         if not housing_list:
             logger.error("Invalid zillow page")
-        else:
-            self._pages_scraped += 1
-            list_cards = housing_list[0].css("article.list-card")
-            # Check to make sure details are present
-            details_item = housing_list[0].css(".list-card-details > li")
-            if not details_item:
-                logger.critical("Did not find any card details...")
-                return
-            for card in list_cards:
-                address = card.css(".list-card-addr ::text").extract_first()
-                # If theres a pipe in the middle, use the right side
-                tokens = address.split('|')
-                if len(tokens) > 1:
-                    address = tokens[1]
-                address = BaseSpider.simplify_address(BaseSpider.cleanup_garbage(address))
-
-                # Check if address is in cache
-                location = AddressLookup.lookup_address(address)
-                if location is None:
-                    logger.warning("Skipping '{0}' due to invalid address".format(address))
+            return []
+        self._pages_scraped += 1
+        # Check to make sure details are present
+        details_item = CARD_DETAILS(housing_list[0])
+        if not details_item:
+            logger.critical("Did not find any card details...")
+            return []
+        cards = []
+        for card in CARD_FIELDS.extract_each(LIST_CARDS, housing_list[0]):
+            address = card["address"]
+            # If theres a pipe in the middle, use the right side
+            tokens = address.split('|')
+            if len(tokens) > 1:
+                address = tokens[1]
+            cards.append((card, BaseSpider.simplify_address(BaseSpider.cleanup_garbage(address))))
+
+        # Geocode the whole page at once, so repeated addresses are only requested once. Lookups wait on the
+        # geocoder, so they run on a thread instead of holding up the reactor, and the cards are parsed after.
+        prefetch = threads.deferToThread(AddressLookup.prefetch_addresses, [address for _, address in cards],
+                                         source=self.name)
+        prefetch.addCallback(lambda _: list(self._parse_cards(response, cards)))
+        return prefetch
+
+    def _parse_cards(self, response, cards):
+        """
+        Parses the listing cards of a search page, once their addresses are geocoded
+        :param response: The search page response
+        :param cards: List of (card fields, address)
+        :return: Generator of listings, and the request for the next page
+        """
+        for card, address in cards:
+            # Check if address is in cache
+            location = AddressLookup.lookup_address(address, source=self.name)
+            if location is None:
+                logger.warning("Skipping '{0}' due to invalid address".format(address))
+                continue
+            address = AddressLookup.construct_address(location)
+
+            # Get the link to the address
+            link = card["link"]
+            if "/b/" in link:
+                link = "https://www.zillow.com" + link
+            # Get the rent
+            price_str = card["price"]
+            price = None
+            if not price_str:
+                logger.warning("Could not find rent for apartment (link: {0}), checking details".format(link))
+            else:
+                price_str = price_str.replace("$", "").replace(",", "").replace("+", "").replace("/mo", "")
+                try:
+                    price = int(price_str)
+                except ValueError:
+                    pass
+
+            # Get the apartment details
+            details_str = ""
+            for detail in card["details"]:
+                if details_str != "":
+                    details_str += " "
+                details_str += BaseSpider.cleanup_garbage(detail)
+
+            # Tokenize and extract info
+            detail_tokens = details_str.split(' ')
+            bed_count = None
+            bath_count = None
+            rent = None
+            sqft = None
+            for idx, label in enumerate(detail_tokens):
+                if len(label) <= 0:
                     continue
-                address = AddressLookup.construct_address(location)
-
-                # Get the link to the address
-                link = card.css(".list-card-link ::attr(href)").extract_first()
-                if "/b/" in link:
-                    link = "https://www.zillow.com" + link
-                # Get the rent
-                price_str = card.css(".list-card-price ::text").extract_first()
-                price = None
-                if not price_str:
-                    logger.warning("Could not find rent for apartment (link: {0}), checking details".format(link))
-                else:
-                    price_str = price_str.replace("$", "").replace(",", "").replace("+", "").replace("/mo", "")
+                label = label.replace(",", "")
+                if label == "bds" and idx != 0:
                     try:
-                        price = int(price_str)
+                        bed_count = int(detail_tokens[idx-1])
                     except ValueError:
-                        pass
-
-                # Get the apartment details
-                details = card.css(".list-card-details > li")
-                details_str = ""
-                for detail in details:
-                    if details_str != "":
-                        details_str += " "
-                    details_str += BaseSpider.cleanup_garbage(detail.extract())
-
-                # Tokenize and extract info
-                detail_tokens = details_str.split(' ')
-                bed_count = None
-                bath_count = None
-                rent = None
-                sqft = None
-                for idx, label in enumerate(detail_tokens):
-                    if len(label) <= 0:
+                        logger.error("Found 'bds' label but integer did not preceeed it (link: {0})".format(link))
                         continue
-                    label = label.replace(",", "")
-                    if label == "bds" and idx != 0:
-                        try:
-                            bed_count = int(detail_tokens[idx-1])
-                        except ValueError:
-                            logger.error("Found 'bds' label but integer did not preceeed it (link: {0})".format(link))
-                            continue
-                    elif label == "ba" and idx != 0:
-                        try:
-                            bath_count = float(detail_tokens[idx-1])
-                        except ValueError:
-                            logger.error("Found 'ba' label but integer did not preceeed it (link: {0})".format(link))
-                            continue
-                    elif label == "sqft" and idx != 0:
-                        if detail_tokens[idx-1] != "--":
-                            try:
-                                sqft = int(detail_tokens[idx-1].replace(",", ""))
-                            except ValueError:
-                                logger.error("Found 'sqft' label but integer did not preceeed it (link: {0})".format(link))
-                                continue
-                    elif label[0] == "$":
-                        rent_str = label.replace("$", "").replace(",", "").replace("+", "").replace("/mo", "")
+                elif label == "ba" and idx != 0:
+                    try:
+                        bath_count = float(detail_tokens[idx-1])
+                    except ValueError:
+                        logger.error("Found 'ba' label but integer did not preceeed it (link: {0})".format(link))
+                        continue
+                elif label == "sqft" and idx != 0:
+                    if detail_tokens[idx-1] != "--":
                         try:
-                            rent = int(rent_str)
-                            continue
+                            sqft = int(detail_tokens[idx-1].replace(",", ""))
                         except ValueError:
-                            logger.error("Found possible '{0}' rent but could not convert to integer (link: {1})"
-                                         .format(label[0], link))
+                            logger.error("Found 'sqft' label but integer did not preceeed it (link: {0})".format(link))
                             continue
+                elif label[0] == "$":
+                    rent_str = label.replace("$", "").replace(",", "").replace("+", "").replace("/mo", "")
+                    try:
+                        rent = int(rent_str)
+                        continue
+                    except ValueError:
+                        logger.error("Found possible '{0}' rent but could not convert to integer (link: {1})"
+                                     .format(label[0], link))
+                        continue
 
-                # We can safely assume that zillow properties are listed with total rent, not rent per room.
-                # So we need to compensate
-                if price and bed_count:
-                    price = price
-                elif rent and bed_count:
-                    rent = rent
-
-                yield {
-                    "uid": BaseSpider.get_next_uid(),
-                    "address": address,
-                    "neighborhood": location["neighborhood"],
-                    "suburb": location["suburb"],
-                    "city": location["city"],
-                    "state": location["state"],
-                    "rent": price if price else rent,
-                    "deposit": None,
-                    "sqft": sqft,
-                    "beds": bed_count,
-                    "baths_str": bath_count,
-                    "unit": None,
-                    "coordinates": (location["lat"], location["long"]),
-                    "additional": None,
-                    "link": link,
-                    "source": "zillow.com"
-                }
-
-            # Get the page links and move to next page
-            if self._pages_scraped < MAX_SCRAPE_PAGES:
-                pagination = response.css(".search-pagination > nav > ul > li")
-                if pagination:
-                    next_button = False
-                    for page_item in pagination:
-                        item_html = page_item.extract()
-                        if "PaginationNumberItem" in item_html:
-                            disabled = page_item.css("::attr(disabled)")
-                            if disabled:
-                                next_button = True
-                                continue
-                            elif next_button:
-                                next_page = page_item.css("li > a ::text").extract_first()
-                                if next_page:
-                                    # Add pagination to search query
-                                    if "/?searchQueryState" in response.request.url:
-                                        pagination_query = '"pagination":{{"currentPage":{0}}},'.format(next_page)
-                                        idx = self._first_search.find("/?searchQueryState={")+len("/?searchQueryState={")
-                                        new_url = self._first_search[:idx] + pagination_query + self._first_search[idx:]
-                                        request = scrapy.Request(url=new_url, headers=response.request.headers, meta={'dont_merge_cookies': True})
-                                        yield request
-                                        return
+            # We can safely assume that zillow properties are listed with total rent, not rent per room.
+            # So we need to compensate
+            if price and bed_count:
+                price = price
+            elif rent and bed_count:
+                rent = rent
+
+            yield Listing(
+                uid=BaseSpider.get_next_uid(),
+                address=address,
+                neighborhood=location["neighborhood"],
+                suburb=location["suburb"],
+                city=location["city"],
+                state=location["state"],
+                rent=price if price else rent,
+                deposit=None,
+                sqft=sqft,
+                beds=bed_count,
+                baths_str=bath_count,
+                unit=None,
+                coordinates=(location["lat"], location["long"]),
+                additional=None,
+                link=link,
+                source="zillow.com"
+            )
+
+        # Get the page links and move to next page
+        if self._pages_scraped < MAX_SCRAPE_PAGES:
+            pagination = response.css(".search-pagination > nav > ul > li")
+            if pagination:
+                next_button = False
+                for page_item in pagination:
+                    item_html = page_item.extract()
+                    if "PaginationNumberItem" in item_html:
+                        disabled = page_item.css("::attr(disabled)")
+                        if disabled:
+                            next_button = True
+                            continue
+                        elif next_button:
+                            next_page = page_item.css("li > a ::text").extract_first()
+                            if next_page:
+                                # Add pagination to search query
+                                if "/?searchQueryState" in response.request.url:
+                                    pagination_query = '"pagination":{{"currentPage":{0}}},'.format(next_page)
+                                    idx = self._first_search.find("/?searchQueryState={")+len("/?searchQueryState={")
+                                    new_url = self._first_search[:idx] + pagination_query + self._first_search[idx:]
+                                    request = scrapy.Request(url=new_url, headers=response.request.headers, meta={'dont_merge_cookies': True})
+                                    yield request
+                                    return
@@ -17,9 +17,12 @@
 """
 
 import logging
-import scrapy
 import re
 import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import scrapy
 
 logger = logging.getLogger(__name__)
 
@@ -121,14 +124,28 @@ class ScrapySpider(BaseSpider):
     A scrapy spider source class
     """
 
-    def __init__(self, spider: scrapy.Spider):
+    def __init__(self, spider: "scrapy.Spider"):
         self._spider = spider
 
     def init(self, config) -> None:
         pass
 
+    def set_frontier(self, frontier, worker: bool = False) -> bool:
+        """
+        Sends this spider's detail pages through a shared frontier
+        :param frontier: The frontier
+        :param worker: If true, the spider skips its search pages and only scrapes pages pulled from the frontier
+        :return: True if the spider supports a frontier, false if otherwise
+        """
+        from .frontier import FrontierSpiderMixin
+        if not issubclass(self._spider, FrontierSpiderMixin):
+            return False
+        self._spider.frontier = frontier
+        self._spider.frontier_worker = worker
+        return True
+
     @property
-    def scrapy_spider(self) -> scrapy.Spider:
+    def scrapy_spider(self) -> "scrapy.Spider":
         """
         Get the scrapy spider object
         :return: Scrapy spider object
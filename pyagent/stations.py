@@ -0,0 +1,242 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+# Station index files are laid out as
+#   header | coordinates | stations | station lines | lines | strings
+# The coordinates are (lat, long) float64 pairs, one per station, so they can be scanned or handed to numpy without
+# decoding anything else. Each station points at its name in the string table and at a run of line numbers in the
+# station lines table. The header holds a sha256 digest of the data the index was built from, so anything derived
+# from the stations can tell when they have changed.
+STATION_INDEX_MAGIC = b"PYAGSTN\x00"
+STATION_INDEX_VERSION = 1
+
+# magic, version, station count, line count, station lines count, source digest, then the section offsets
+_HEADER = struct.Struct("<8sIIII32sQQQQQ")
+_COORDINATES = struct.Struct("<dd")
+# name offset, name length, first station line, line count
+_STATION = struct.Struct("<IIII")
+_STATION_LINE = struct.Struct("<H")
+# name offset, name length
+_LINE = struct.Struct("<II")
+
+
+def station_digest(stations: list) -> str:
+    """
+    Hashes station data, for indexes built from something other than GTFS files
+    :param stations: List of station dicts, with name, coords and lines
+    :return: The sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    for station in stations:
+        digest.update("{0}\x00{1!r}\x00{2}\x00".format(station["name"], list(station["coords"]),
+                                                    "\x00".join(station["lines"])).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def write_station_index(path: str, stations: list, digest: str = None) -> None:
+    """
+    Writes a station index. The file is written next to the destination and swapped in, so processes that already
+    have the old index mapped keep reading it.
+    :param path: The index file path
+    :param stations: List of station dicts, with name, coords ([lat, long]) and lines
+    :param digest: sha256 hex digest of the data the stations came from, by default a hash of the stations
+    :return: Nothing
+    """
+    if digest is None:
+        digest = station_digest(stations)
+    strings = bytearray()
+
+    def add_string(value: str) -> (int, int):
+        encoded = value.encode("utf-8")
+        offset = len(strings)
+        strings.extend(encoded)
+        return offset, len(encoded)
+
+    line_numbers = {}
+    line_records = []
+    station_records = []
+    station_lines = []
+    coordinates = []
+    for station in stations:
+        first_line = len(station_lines)
+        for line in station["lines"]:
+            if line not in line_numbers:
+                line_numbers[line] = len(line_records)
+                line_records.append(add_string(line))
+            station_lines.append(line_numbers[line])
+        name_offset, name_length = add_string(station["name"])
+        station_records.append((name_offset, name_length, first_line, len(station_lines) - first_line))
+        coordinates.append((float(station["coords"][0]), float(station["coords"][1])))
+    if len(line_records) > 0xFFFF:
+        raise ValueError("Too many lines for a station index: {0}".format(len(line_records)))
+
+    coordinates_offset = _HEADER.size
+    stations_offset = coordinates_offset + len(coordinates) * _COORDINATES.size
+    station_lines_offset = stations_offset + len(station_records) * _STATION.size
+    lines_offset = station_lines_offset + len(station_lines) * _STATION_LINE.size
+    strings_offset = lines_offset + len(line_records) * _LINE.size
+
+    index_dir = os.path.dirname(path)
+    if index_dir and not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(temp_path, "wb") as index_file:
+        index_file.write(_HEADER.pack(STATION_INDEX_MAGIC, STATION_INDEX_VERSION, len(station_records),
+                                      len(line_records), len(station_lines), bytes.fromhex(digest),
+                                      coordinates_offset, stations_offset, station_lines_offset, lines_offset,
+                                      strings_offset))
+        for lat, long in coordinates:
+            index_file.write(_COORDINATES.pack(lat, long))
+        for record in station_records:
+            index_file.write(_STATION.pack(*record))
+        for line_number in station_lines:
+            index_file.write(_STATION_LINE.pack(line_number))
+        for record in line_records:
+            index_file.write(_LINE.pack(*record))
+        index_file.write(strings)
+    os.replace(temp_path, path)
+
+
+class StationIndex:
+    """
+    Memory-mapped reader for station index files. Opening an index only reads the header, and every process that
+    opens the same index shares its pages. Iterating gives the same station dicts as the JSON train data did, so it
+    can be used in its place.
+    """
+    def __init__(self, path: str):
+        """
+        Constructor
+        :param path: The path to the station index
+        """
+        self._path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("Station index {0} is empty".format(path))
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise ValueError("{0} is not a station index".format(path))
+        (magic, version, self._count, self._line_count, station_line_count, digest, self._coordinates_offset,
+         self._stations_offset, self._station_lines_offset, self._lines_offset,
+         self._strings_offset) = _HEADER.unpack_from(self._map, 0)
+        if magic != STATION_INDEX_MAGIC:
+            self.close()
+            raise ValueError("{0} is not a station index".format(path))
+        if version != STATION_INDEX_VERSION:
+            self.close()
+            raise ValueError("Unsupported station index version {0}".format(version))
+        self._digest = digest.hex()
+        self._lines = None
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._strings_offset + offset
+        return self._map[start:start + length].decode("utf-8")
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def digest(self) -> str:
+        """
+        The sha256 hex digest of the data the index was built from
+        """
+        return self._digest
+
+    @property
+    def lines(self) -> list:
+        """
+        Every line in the index, in the order their numbers were given
+        """
+        if self._lines is None:
+            self._lines = [self._string(*_LINE.unpack_from(self._map, self._lines_offset + number * _LINE.size))
+                           for number in range(self._line_count)]
+        return self._lines
+
+    @property
+    def coordinates(self) -> memoryview:
+        """
+        Flat view of the station coordinates, lat and long of station i are at 2 * i and 2 * i + 1
+        """
+        end = self._coordinates_offset + self._count * _COORDINATES.size
+        return memoryview(self._map)[self._coordinates_offset:end].cast("d")
+
+    def iter_coords(self):
+        """
+        Iterates over the station coordinates without decoding the rest of each station
+        :return: Generator of (lat, long) tuples
+        """
+        return _COORDINATES.iter_unpack(self._map[self._coordinates_offset:
+                                                  self._coordinates_offset + self._count * _COORDINATES.size])
+
+    def get_coords(self, position: int) -> list:
+        return list(_COORDINATES.unpack_from(self._map, self._coordinates_offset + position * _COORDINATES.size))
+
+    def get_name(self, position: int) -> str:
+        name_offset, name_length, _, _ = _STATION.unpack_from(self._map, self._stations_offset +
+                                                              position * _STATION.size)
+        return self._string(name_offset, name_length)
+
+    def get_lines(self, position: int) -> list:
+        _, _, first_line, line_count = _STATION.unpack_from(self._map, self._stations_offset +
+                                                            position * _STATION.size)
+        lines = self.lines
+        return [lines[_STATION_LINE.unpack_from(self._map, self._station_lines_offset +
+                                                (first_line + offset) * _STATION_LINE.size)[0]]
+                for offset in range(line_count)]
+
+    def __getitem__(self, position: int) -> dict:
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError("Station index out of range")
+        return {"name": self.get_name(position), "coords": self.get_coords(position),
+                "lines": self.get_lines(position)}
+
+    def __iter__(self):
+        for position in range(self._count):
+            yield self[position]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __reduce__(self):
+        # Worker processes map the file again instead of copying the stations
+        return StationIndex, (self._path,)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
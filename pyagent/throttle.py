@@ -0,0 +1,255 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import json
+import os
+import time
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Limits used when neither the config nor the spider sets them
+DEFAULT_LIMITS = {
+    "start_delay": 1.0,
+    "min_delay": 0.25,
+    "max_delay": 60.0,
+    "max_concurrency": 8,
+    # Responses slower than this count against the source
+    "target_latency": 2.0,
+}
+# Responses that mean the source wants us to slow down
+BAN_STATUS_CODES = [403, 429, 503]
+# Markers of a captcha page, checked in the start of the body
+CAPTCHA_MARKERS = [b"px-captcha", b"g-recaptcha", b"h-captcha", b"please verify you are a human"]
+CAPTCHA_SCAN_BYTES = 65536
+# Times a request blocked by a captcha page is scheduled again
+MAX_BAN_RETRIES = 2
+
+throttle_delay = metrics.REGISTRY.gauge("pyagent_throttle_delay_seconds", "Current download delay of each source",
+                                        labels=("source",))
+throttle_concurrency = metrics.REGISTRY.gauge("pyagent_throttle_concurrency",
+                                              "Current concurrent requests of each source", labels=("source",))
+
+
+def state_path(state_dir: str, key: str) -> str:
+    """
+    Gets the state file of a source. Each source has its own file, so processes scraping different sources never
+    write the same file.
+    :param state_dir: The state directory
+    :param key: The source key
+    :return: The state file path
+    """
+    return os.path.join(state_dir, "{0}.json".format(key))
+
+
+def load_state(path: str) -> dict:
+    """
+    Loads the rate a source last finished at
+    :param path: The state file of the source
+    :return: Dict of {"delay", "concurrency", "updated"}, empty if there is no state
+    """
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read throttle state {0}: {1}".format(path, e))
+        return {}
+
+
+def save_state(path: str, delay: float, concurrency: int) -> None:
+    """
+    Saves the rate a source finished at, replacing the file atomically
+    :param path: The state file of the source
+    :param delay: The download delay
+    :param concurrency: The concurrent requests
+    :return: Nothing
+    """
+    state = {"delay": delay, "concurrency": concurrency, "updated": time.time()}
+    state_dir = os.path.dirname(path)
+    if state_dir and not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    try:
+        with open(temp_path, "w") as state_file:
+            json.dump(state, state_file, indent=2)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning("Could not write throttle state {0}: {1}".format(path, e))
+
+
+class AdaptiveThrottleMiddleware:
+    """
+    Downloader middleware that adapts a source's delay and concurrency to how it responds. Healthy, fast responses
+    add concurrency and shorten the delay a step at a time, while ban responses (403, 429, 503) and captcha pages
+    halve the concurrency and double the delay. The rate a source finished at is saved, and the next run starts there.
+
+    Settings:
+    PYAGENT_THROTTLE_ENABLED      Whether to throttle at all
+    PYAGENT_THROTTLE_LIMITS       Dict of limits, keys as in DEFAULT_LIMITS
+    PYAGENT_THROTTLE_SOURCE_LIMITS  Dict of limits for this source, overrides the spider's throttle_limits
+    PYAGENT_THROTTLE_KEY          The source key the rate is saved under, defaults to the spider name
+    PYAGENT_THROTTLE_STATE_DIR    Where rates are saved, one file per source, empty to not save them
+
+    A delay set on the spider, download_delay, is a floor the throttle never goes below.
+    """
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self._limits = dict(DEFAULT_LIMITS)
+        self._limits.update(crawler.settings.getdict("PYAGENT_THROTTLE_LIMITS"))
+        self._source_limits = crawler.settings.getdict("PYAGENT_THROTTLE_SOURCE_LIMITS")
+        self._key = crawler.settings.get("PYAGENT_THROTTLE_KEY")
+        self._state_dir = crawler.settings.get("PYAGENT_THROTTLE_STATE_DIR", "")
+        self.delay = self._limits["start_delay"]
+        self.concurrency = 1
+        self._spider = None
+        # Healthy responses since the rate last went up
+        self._healthy = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from scrapy import signals
+        from scrapy.exceptions import NotConfigured
+        if not crawler.settings.getbool("PYAGENT_THROTTLE_ENABLED", True):
+            raise NotConfigured
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        # The spider's own limits override the defaults, and the config overrides both
+        self._limits.update(getattr(spider, "throttle_limits", {}))
+        self._limits.update(self._source_limits)
+        spider_delay = getattr(spider, "download_delay", 0)
+        if spider_delay:
+            self._limits["min_delay"] = max(self._limits["min_delay"], spider_delay)
+            self._limits["max_delay"] = max(self._limits["max_delay"], spider_delay)
+        self._spider = spider
+        if not self._key:
+            self._key = spider.name
+
+        last_rate = load_state(state_path(self._state_dir, self._key)) if self._state_dir else None
+        if last_rate:
+            self.delay = last_rate["delay"]
+            self.concurrency = last_rate["concurrency"]
+            logger.info("{0}: starting at the last rate, {1:.2f} s delay and {2} concurrent requests".format(
+                self._key, self.delay, self.concurrency))
+        self._apply()
+
+    def spider_closed(self, spider):
+        logger.info("{0}: finished at {1:.2f} s delay and {2} concurrent requests".format(self._key, self.delay,
+                                                                                        self.concurrency))
+        if self._state_dir:
+            save_state(state_path(self._state_dir, self._key), self.delay, self.concurrency)
+
+    def _clamp(self) -> None:
+        self.delay = min(max(self.delay, self._limits["min_delay"]), self._limits["max_delay"])
+        self.concurrency = min(max(int(self.concurrency), 1), int(self._limits["max_concurrency"]))
+
+    def _report(self) -> None:
+        throttle_delay.set(self.delay, source=self._key)
+        throttle_concurrency.set(self.concurrency, source=self._key)
+
+    def _apply(self, request=None) -> None:
+        self._clamp()
+        # Read by the downloader when it creates the slot for a new domain
+        self._spider.download_delay = self.delay
+        self._spider.max_concurrent_requests = self.concurrency
+        if request is not None:
+            slot = self.crawler.engine.downloader.slots.get(request.meta.get("download_slot"))
+            if slot is not None:
+                slot.delay = self.delay
+                slot.concurrency = self.concurrency
+        self._report()
+
+    @staticmethod
+    def is_captcha(response) -> bool:
+        """
+        Checks whether a response is a captcha page instead of the page that was asked for
+        :param response: The response
+        :return: True if it is a captcha page, false if otherwise
+        """
+        body = response.body[:CAPTCHA_SCAN_BYTES].lower()
+        return any(marker in body for marker in CAPTCHA_MARKERS)
+
+    def back_off(self, request, reason: str, retry_after: float = 0.0) -> None:
+        """
+        Halves the concurrency and doubles the delay
+        :param request: The request that was refused
+        :param reason: Why, for the log
+        :param retry_after: Seconds the source asked us to wait, if it did
+        :return: Nothing
+        """
+        self.concurrency = self.concurrency // 2
+        self.delay = max(self.delay * 2, retry_after, self._limits["min_delay"], 1.0)
+        self._healthy = 0
+        self._apply(request)
+        logger.warning("{0}: {1} from {2}, backing off to {3:.2f} s delay and {4} concurrent requests".format(
+            self._key, reason, request.url, self.delay, self.concurrency))
+
+    def speed_up(self, request) -> None:
+        """
+        Counts a healthy response, once a full round of them has come back the rate goes up a step
+        :param request: The request
+        :return: Nothing
+        """
+        self._healthy += 1
+        if self._healthy < self.concurrency:
+            return
+        self._healthy = 0
+        self.concurrency += 1
+        self.delay *= 0.8
+        self._apply(request)
+        logger.debug("{0}: speeding up to {1:.2f} s delay and {2} concurrent requests".format(
+            self._key, self.delay, self.concurrency))
+
+    def process_response(self, request, response, spider):
+        # Pages from the HTTP cache say nothing about the source
+        if "cached" in response.flags:
+            return response
+
+        if response.status in BAN_STATUS_CODES:
+            retry_after = 0.0
+            try:
+                retry_after = float(response.headers.get("Retry-After", b"0"))
+            except ValueError:
+                pass
+            self.back_off(request, "HTTP {0}".format(response.status), retry_after)
+            return response
+        if self.is_captcha(response):
+            self.back_off(request, "captcha page")
+            retries = request.meta.get("throttle_retries", 0)
+            if retries < MAX_BAN_RETRIES:
+                retry_request = request.replace(dont_filter=True)
+                retry_request.meta["throttle_retries"] = retries + 1
+                return retry_request
+            return response
+
+        latency = request.meta.get("download_latency")
+        if latency is not None and latency > self._limits["target_latency"]:
+            # Slow, but not refused, so only lengthen the delay
+            self.delay *= 1.25
+            self._healthy = 0
+            self._apply(request)
+            return response
+        if response.status < 400:
+            self.speed_up(request)
+        return response
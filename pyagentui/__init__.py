@@ -16,14 +16,27 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from .ui import WebUI
-
 
 def open_gui(char_file: str) -> None:
     """
     Opens PyAgent gui
-    :param char_file: The path to the characterization data JSON file
+    :param char_file: The path to the characterization data file
     :return: Nothing
     """
+    # pywebview is only needed for the desktop window, not for serving over HTTP
+    from .ui import WebUI
     ui = WebUI()
     ui.open_webview(char_file=char_file)
+
+
+def serve(char_file: str, host: str, port: int) -> None:
+    """
+    Serves the PyAgent frontend and API over HTTP, without a desktop window
+    :param char_file: The path to the characterization data file
+    :param host: The address to listen on
+    :param port: The port to listen on
+    :return: Nothing
+    """
+    from .server import WebServer
+    server = WebServer(char_file, host=host, port=port)
+    server.serve_forever()
@@ -16,15 +16,36 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import logging
-import json
+import math
 import os
-from shutil import copyfile
+import threading
+from collections import OrderedDict
+from pyagent.charfile import open_characterization
+from pyagent.marketstats import MarketStats, MARKET_STATS_FILE
+from .lists import ListStore
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 logger = logging.getLogger(__name__)
 
 WEB_DATA_DIR = "web/data"
 LIST_FILE = "lists.json"
 
+# Sortable address table columns, mapped to where the value is stored in each entry
+SORT_COLUMNS = {
+    "address": ("housing_data", "address"),
+    "rent": ("housing_data", "rent"),
+    "beds": ("housing_data", "beds"),
+    "baths": ("housing_data", "baths_str"),
+    "sqft": ("housing_data", "sqft"),
+    "score": ("char_output", "score"),
+}
+# Number of weightings whose scores and score sort index are kept
+WEIGHTED_CACHE_SIZE = 8
+
 
 class WebAPI:
     """
@@ -33,58 +54,237 @@ class WebAPI:
     def __init__(self, char_file: str):
         """
         Constructor
-        :param char_file: The path to the characterization data JSON file
+        :param char_file: The path to the characterization data file
         """
         self._char_file = char_file
         self._webview_window = None
         self._page_ready = False
 
-        self._loaded_data = {}
-        self._favorites = {}
-        self._rejections = {}
+        self._char_data = None
+        self._sort_indexes = {}
+        self._filter_choices = {}
+        # Scores and score sort index for recently used weights, keyed by the weights. Weights are passed with each
+        # request, so clients with different weights do not see each other's scores.
+        self._weighted_cache = OrderedDict()
+        self._weighted_lock = threading.Lock()
+        self._hashes = None
+        self._score_matrix = None
+        self._market_stats = None
+        self._market_stats_mtime = None
+        self._reload_lock = threading.Lock()
+
+        # Map the characterization data, entries are decoded as the webpage requests them
+        self._char_version = WebAPI._file_version(self._char_file)
+        self._load_char_data()
 
-        # Load the data used by the webpage
+        # Load lists, replaying any changes journaled since the last save
+        if not os.path.isdir(WEB_DATA_DIR):
+            os.makedirs(WEB_DATA_DIR)
+        self._lists = ListStore(WEB_DATA_DIR + "/" + LIST_FILE)
+
+    @staticmethod
+    def _file_version(path: str):
+        """
+        Gets a value that changes whenever a file is written
+        :param path: The file path
+        :return: (modification time, size), or None if the file does not exist
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_char_data(self) -> None:
+        """
+        Maps the characterization file, and drops everything derived from the previous one
+        :return: Nothing
+        """
+        char_data = None
+        sort_indexes = {}
         try:
-            with open(self._char_file, "r") as json_file:
-                self._loaded_data = json.load(json_file)
-        except json.JSONDecodeError as e:
-            logger.error("Failed to json file: {0}".format(e))
-
-        # Load lists if exists
-        filename = WEB_DATA_DIR + "/" + LIST_FILE
-        if os.path.isfile(filename):
-            list_data = None
+            char_data = open_characterization(self._char_file)
+            sort_indexes = WebAPI._build_sort_indexes(char_data)
+        except (OSError, ValueError) as e:
+            logger.error("Failed to open characterization file {0}: {1}".format(self._char_file, e))
+            char_data = None
+        # Requests already running keep their reference to the old file, so it is not closed here
+        with self._weighted_lock:
+            self._char_data = char_data
+            self._sort_indexes = sort_indexes
+            self._filter_choices = {}
+            self._weighted_cache.clear()
+            self._hashes = None
+            self._score_matrix = None
+
+    def refresh(self):
+        """
+        Maps the characterization file again if it was written since it was mapped, such as by a daemon cycle. Only one
+        caller maps it and builds its sort indexes, the others keep using the old file until it is ready.
+        :return: Version of the data, changes whenever the characterization file or the market statistics change
+        """
+        char_version = WebAPI._file_version(self._char_file)
+        if char_version != self._char_version and self._reload_lock.acquire(blocking=False):
             try:
-                with open(filename, "r") as list_file:
-                    list_data = json.load(list_file)
-            except json.JSONDecodeError as e:
-                logger.error("Failed to load lists file: {0}".format(e))
-            if list_data:
-                if "favorites" in list_data:
-                    self._favorites = list_data["favorites"]
-                if "rejections" in list_data:
-                    self._rejections = list_data["rejections"]
+                if char_version != self._char_version:
+                    logger.info("Characterization file {0} changed, loading it again".format(self._char_file))
+                    self._load_char_data()
+                    self._char_version = char_version
+            finally:
+                self._reload_lock.release()
+        return self._char_version, WebAPI._file_version(MARKET_STATS_FILE)
+
+    @staticmethod
+    def _sort_value(column: str, value):
+        """
+        Converts a raw entry value into a comparable sort key
+        :param column: The sort column the value belongs to
+        :param value: The raw value from the entry
+        :return: Sort key, or None if the value cannot be sorted
+        """
+        if value is None:
+            return None
+        if column == "address":
+            return str(value).lower()
+        if column == "beds" and value == "Studio":
+            return 0.0
+        try:
+            return float(str(value).replace("$", "").replace(",", ""))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _build_sort_indexes(char_data) -> dict:
+        """
+        Builds a presorted list of entry hashes for each sortable column, with the number of entries that have a
+        sortable value. Entries without a sortable value are placed at the end of the index. Built in a single pass
+        over the entries when the characterization file is mapped, so sort requests never wait on it.
+        :param char_data: The characterization file
+        :return: Dict of column to (hashes in sorted order, number of entries with a sortable value)
+        """
+        sort_indexes = {}
+        sortable = {column: [] for column in SORT_COLUMNS}
+        unsortable = {column: [] for column in SORT_COLUMNS}
+        for hash_val, entry in char_data.items():
+            for column, (section, field) in SORT_COLUMNS.items():
+                value = WebAPI._sort_value(column, entry[section].get(field))
+                if value is None:
+                    unsortable[column].append(hash_val)
+                else:
+                    sortable[column].append((value, hash_val))
+        for column in SORT_COLUMNS:
+            sortable[column].sort()
+            sort_indexes[column] = ([hash_val for _, hash_val in sortable[column]] + unsortable[column],
+                                    len(sortable[column]))
+        logger.debug("Built sort indexes for {0} entries".format(len(char_data)))
+        return sort_indexes
+
+    @staticmethod
+    def _build_score_index(scores: dict) -> tuple:
+        """
+        Builds the score sort index for weighted scores, the other columns do not change with the weights
+        :param scores: Dict of hash value to weighted score
+        :return: (hashes in score order, number of entries with a score)
+        """
+        scored = []
+        unscored = []
+        for hash_val, score in scores.items():
+            if score is None:
+                unscored.append(hash_val)
             else:
-                logger.warning("Error reading list file")
-        else:
-            logger.warning("No list file found")
+                scored.append((score, hash_val))
+        scored.sort()
+        return [hash_val for _, hash_val in scored] + unscored, len(scored)
+
+    def _compute_scores(self, weights: list):
+        """
+        Scores every entry with criterion weights, from the per-criterion scores stored in the characterization file
+        :param weights: The weight of each criterion, in the order of get_criteria
+        :return: List of scores in file order, or None if the file has no per-criterion scores or the weights are
+        invalid
+        """
+        if self._score_matrix is None:
+            self._score_matrix = self._char_data.scores()
+            if self._score_matrix is None:
+                logger.warning("Characterization file has no per-criterion scores, run characterization again")
+                return None
+            self._hashes = list(self._char_data.keys())
+        criteria_count = len(self._char_data.criteria)
+        if len(weights) != criteria_count:
+            logger.warning("Expected {0} weights, got {1}".format(criteria_count, len(weights)))
+            return None
+
+        if numpy is not None:
+            matrix = numpy.frombuffer(self._score_matrix, dtype=numpy.float32).reshape(-1, criteria_count)
+            evaluated = ~numpy.isnan(matrix)
+            weight_vector = numpy.array(weights, dtype=numpy.float64)
+            totals = numpy.where(evaluated, matrix, 0.0) @ weight_vector
+            possible = evaluated @ weight_vector
+            return numpy.divide(totals, possible, out=numpy.zeros_like(totals), where=possible > 0).tolist()
+        matrix = self._score_matrix
+        scores = []
+        for row in range(len(self._hashes)):
+            total = 0.0
+            possible = 0.0
+            for column, weight in enumerate(weights):
+                value = matrix[row * criteria_count + column]
+                if not math.isnan(value):
+                    total += value * weight
+                    possible += weight
+            scores.append(total / possible if possible > 0 else 0.0)
+        return scores
+
+    def _weighted(self, weights):
+        """
+        Gets the scores and score sort index for criterion weights, computing them if they are not cached
+        :param weights: The weight of each criterion, or None for the stored scores
+        :return: (dict of hash value to score, score sort index), or None to use the stored scores
+        """
+        if not weights or self._char_data is None:
+            return None
+        try:
+            key = tuple(max(float(weight), 0.0) for weight in weights)
+        except (TypeError, ValueError):
+            logger.warning("Invalid weights {0}".format(weights))
+            return None
+        with self._weighted_lock:
+            weighted = self._weighted_cache.get(key)
+            if weighted is not None:
+                self._weighted_cache.move_to_end(key)
+                return weighted
+            scores = self._compute_scores(list(key))
+            if scores is None:
+                return None
+            scores = dict(zip(self._hashes, scores))
+            weighted = (scores, WebAPI._build_score_index(scores))
+            self._weighted_cache[key] = weighted
+            while len(self._weighted_cache) > WEIGHTED_CACHE_SIZE:
+                self._weighted_cache.popitem(last=False)
+            logger.debug("Scored {0} entries with weights {1}".format(len(scores), list(key)))
+            return weighted
+
+    def _apply_weights(self, entries: dict, weights) -> dict:
+        """
+        Replaces the stored score of entries with the score under the given weights
+        :param entries: Dict of hash value to entry
+        :param weights: The weight of each criterion, or None for the stored scores
+        :return: The entries
+        """
+        weighted = self._weighted(weights)
+        if weighted is not None:
+            for hash_val, entry in entries.items():
+                score = weighted[0].get(hash_val)
+                if score is not None:
+                    entry["char_output"]["score"] = score
+        return entries
 
     def save_lists(self) -> None:
         """
-        Save lists to file
+        Save lists to file. Changes are journaled as they are made, so this only compacts the journal.
         :return: Nothing
         """
         logger.info("Saving favorites and rejections...")
-        filename = WEB_DATA_DIR + "/" + LIST_FILE
-        try:
-            with open(filename, "w") as list_file:
-                list_json = {
-                    "favorites": self._favorites,
-                    "rejections": self._rejections
-                }
-                json.dump(list_json, list_file)
-        except OSError as e:
-            logger.error("Failed to save lists to file {0}: {1}".format(filename, e))
+        self._lists.close()
 
     def reload_page(self) -> None:
         """
@@ -100,36 +300,150 @@ class WebAPI:
         """
         self._page_ready = True
         logger.debug("Webpage ready!")
+        self.refresh()
 
-        # Copy the JSON data to the web directory
-        found_char_file = False
-        if self._char_file:
-            if not os.path.isdir(WEB_DATA_DIR):
-                os.mkdir(WEB_DATA_DIR)
-            try:
-                copyfile(self._char_file, WEB_DATA_DIR + "/characterization.json")
-            except FileNotFoundError as e:
-                logger.error(e)
-                return False
-            found_char_file = True
-
-        # Tell javascript there is JSON data available
-        if found_char_file:
-            self._webview_window.evaluate_js(f"load_json(char_avail=true)")
-        else:
-            self._webview_window.evaluate_js(f"load_json(char_avail=false)")
+        # Tell javascript whether there is characterization data to page in, the HTTP frontend asks for itself
+        if self._webview_window is not None:
+            if self._char_data is None:
+                self._webview_window.evaluate_js(f"load_json(char_avail=false)")
+            else:
+                self._webview_window.evaluate_js(f"load_json(char_avail=true)")
 
         return True
 
+    def has_data(self) -> bool:
+        """
+        Checks if characterization data was loaded
+        :return: True if there is characterization data, False if otherwise
+        """
+        return self._char_data is not None
+
+    def get_entry_count(self) -> int:
+        """
+        Gets the number of characterization entries
+        :return: Number of entries
+        """
+        if self._char_data is None:
+            return 0
+        return len(self._char_data)
+
+    def get_page(self, offset: int = 0, count: int = 0, weights: list = None) -> dict:
+        """
+        Gets a page of characterization entries, only the requested entries are decoded
+        :param offset: The index of the first entry
+        :param count: The maximum number of entries, 0 for all remaining
+        :param weights: The weight of each criterion to score the entries with, None for the stored scores
+        :return: Dict of hash value to entry
+        """
+        if self._char_data is None:
+            return {}
+        return self._apply_weights(dict(self._char_data.items(offset, count)), weights)
+
+    def get_entries(self, hash_vals: list, weights: list = None) -> dict:
+        """
+        Gets specific characterization entries
+        :param hash_vals: The hashes of the entries to get
+        :param weights: The weight of each criterion to score the entries with, None for the stored scores
+        :return: Dict of hash value to entry, missing entries are left out
+        """
+        entries = {}
+        if self._char_data is None:
+            return entries
+        for hash_val in hash_vals:
+            entry = self._char_data.get(hash_val)
+            if entry is not None:
+                entries[hash_val] = entry
+        return self._apply_weights(entries, weights)
+
+    def get_criteria(self) -> list:
+        """
+        Gets the criteria the entries were scored on
+        :return: List of {"name", "weight"}, empty if the characterization file has no per-criterion scores
+        """
+        if self._char_data is None or self._char_data.scores() is None:
+            return []
+        return self._char_data.criteria
+
+    def score_weights(self, weights: list) -> dict:
+        """
+        Scores every entry with criterion weights, from the per-criterion scores stored in the characterization file.
+        The score of an entry is its weighted score over the criteria it was evaluated on, as in characterization.
+        Nothing is stored for the caller, pass the same weights to get_page, get_entries and get_sorted_page to use the
+        scores there.
+        :param weights: The weight of each criterion, in the order of get_criteria
+        :return: Dict of hash value to score, empty if the file has no per-criterion scores
+        """
+        weighted = self._weighted(weights)
+        if weighted is None:
+            return {}
+        return weighted[0]
+
     def get_filter_choices(self, filter_field):
-        filter_choices = []
-        for key, value in self._loaded_data.items():
-            option = value["housing_data"][filter_field]
-            if option not in filter_choices and option:
-                filter_choices.append(option)
+        if filter_field in self._filter_choices:
+            return self._filter_choices[filter_field]
+        if self._char_data is None:
+            return []
+        # Newer characterization files store the choices, older ones need a scan
+        stored_choices = self._char_data.meta.get("filter_choices", {})
+        if filter_field in stored_choices:
+            filter_choices = stored_choices[filter_field]
+        else:
+            filter_choices = []
+            for key, value in self._char_data.items():
+                option = value["housing_data"][filter_field]
+                if option not in filter_choices and option:
+                    filter_choices.append(option)
         # TODO: Add lists
+        self._filter_choices[filter_field] = filter_choices
         return filter_choices
 
+    def get_sorted_page(self, column: str, descending: bool = False, offset: int = 0, count: int = 0,
+                        weights: list = None) -> list:
+        """
+        Gets a page of entry hashes ordered by a column, using the prebuilt sort indexes
+        :param column: The column to sort by, one of SORT_COLUMNS
+        :param descending: True to sort in descending order
+        :param offset: The index of the first hash to return
+        :param count: The maximum number of hashes to return, 0 for all remaining
+        :param weights: The weight of each criterion to sort scores by, None for the stored scores
+        :return: List of entry hashes in sorted order, empty if the column is invalid
+        """
+        sort_indexes = self._sort_indexes
+        if column not in SORT_COLUMNS:
+            logger.warning("Invalid sort column '{0}'".format(column))
+            return []
+        if column not in sort_indexes:
+            return []
+        index, sortable_count = sort_indexes[column]
+        if column == "score":
+            weighted = self._weighted(weights)
+            if weighted is not None:
+                index, sortable_count = weighted[1]
+        offset = max(offset, 0)
+        end = len(index) if count <= 0 else min(offset + count, len(index))
+        if descending:
+            # Walk the sorted part of the index from the back, so only the page is copied. Entries without a
+            # sortable value stay at the end either way.
+            page = index[max(sortable_count - end, 0):max(sortable_count - offset, 0)][::-1]
+            return page + index[max(offset, sortable_count):max(end, sortable_count)]
+        return index[offset:end]
+
+    def get_market_stats(self, level: str = None, name: str = None) -> list:
+        """
+        Gets the market statistics, read again whenever characterization has updated them
+        :param level: "neighborhood", "suburb", "city" or "all", None for every level
+        :param name: The neighborhood, suburb or city, None for every one of the level
+        :return: List of group statistics, empty if there are none yet
+        """
+        try:
+            mtime = os.path.getmtime(MARKET_STATS_FILE)
+        except OSError:
+            return []
+        if self._market_stats is None or mtime != self._market_stats_mtime:
+            self._market_stats = MarketStats.load(MARKET_STATS_FILE)
+            self._market_stats_mtime = mtime
+        return self._market_stats.query(level, name)
+
     def add_to_favorites(self, hash_val, data) -> bool:
         """
         Adds a property to the favorite lists
@@ -137,12 +451,10 @@ class WebAPI:
         :param data: The housing data of the entry
         :return: True if successfully added, false if otherwise
         """
-        if hash_val not in self._favorites:
+        if self._lists.add("favorites", hash_val, data):
             logger.info("Adding {0} to favorites".format(hash_val))
-            self._favorites[hash_val] = data
             return True
-        else:
-            return False
+        return False
 
     def add_to_rejections(self, hash_val, data) -> bool:
         """
@@ -151,12 +463,10 @@ class WebAPI:
         :param data: The housing data of the entry
         :return: True if successfully added, false if otherwise
         """
-        if hash_val not in self._rejections:
+        if self._lists.add("rejections", hash_val, data):
             logger.info("Adding {0} to rejections".format(hash_val))
-            self._rejections[hash_val] = data
             return True
-        else:
-            return False
+        return False
 
     def remove_from_favorites(self, hash_val) -> bool:
         """
@@ -164,9 +474,8 @@ class WebAPI:
         :param hash_val: The hash value to remove
         :return: Successfully removed
         """
-        if hash_val in self._favorites:
+        if self._lists.remove("favorites", hash_val):
             logger.info("Removing {0} from favorites".format(hash_val))
-            del self._favorites[hash_val]
             return True
         return False
 
@@ -176,39 +485,38 @@ class WebAPI:
         :param hash_val: The hash value to remove
         :return: Successfully removed
         """
-        if hash_val in self._rejections:
+        if self._lists.remove("rejections", hash_val):
             logger.info("Removing {0} from rejections".format(hash_val))
-            del self._rejections[hash_val]
             return True
         return False
-            
+
     def get_favorites(self) -> dict:
         """
         Gets the favorites list
         :return: Favorites list
         """
-        return self._favorites
+        return self._lists.get("favorites")
 
     def get_rejections(self) -> dict:
         """
         Gets the rejections list
         :return: Rejections list
         """
-        return self._rejections
+        return self._lists.get("rejections")
 
     def get_favorites_count(self) -> int:
         """
         Gets the favorites list count
         :return: Favorites list count
         """
-        return len(self._favorites)
+        return self._lists.count("favorites")
 
     def get_rejections_count(self) -> int:
         """
         Gets the rejections list count
         :return: Rejections list count
         """
-        return len(self._rejections)
+        return self._lists.count("rejections")
 
     @property
     def window(self):
@@ -0,0 +1,250 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import threading
+from pyagent import serialize
+
+logger = logging.getLogger(__name__)
+
+# Number of journal entries after which the journal is folded into the snapshot
+COMPACT_THRESHOLD = 500
+
+LIST_NAMES = ("favorites", "rejections")
+
+
+class ListStore:
+    """
+    Thread-safe store for the favorites and rejections lists. The lists are kept in a JSON snapshot, and every change
+    is appended to a journal file, so each add or remove is persisted immediately without rewriting the snapshot.
+    The journal is replayed on load and periodically compacted into the snapshot.
+    """
+    def __init__(self, snapshot_path: str, compact_threshold: int = COMPACT_THRESHOLD):
+        """
+        Constructor
+        :param snapshot_path: The path to the list snapshot JSON file, the journal is stored next to it
+        :param compact_threshold: Number of journal entries before the journal is compacted
+        """
+        self._snapshot_path = snapshot_path
+        self._journal_path = snapshot_path + ".journal"
+        self._compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._lists = {name: {} for name in LIST_NAMES}
+        self._journal_file = None
+        self._journal_entries = 0
+
+        self._load()
+
+    def _load(self) -> None:
+        """
+        Loads the snapshot and replays the journal on top of it
+        :return: Nothing
+        """
+        if os.path.isfile(self._snapshot_path):
+            try:
+                list_data = serialize.load(self._snapshot_path, serialize.FORMAT_JSON)
+                for name in LIST_NAMES:
+                    if name in list_data:
+                        self._lists[name] = list_data[name]
+            except (OSError, ValueError) as e:
+                logger.error("Failed to load lists file: {0}".format(e))
+        else:
+            logger.warning("No list file found")
+
+        if os.path.isfile(self._journal_path):
+            try:
+                # Offset just past the last complete entry
+                good_offset = 0
+                torn = False
+                with open(self._journal_path, "rb") as journal_file:
+                    for line in journal_file:
+                        try:
+                            entry = serialize.loads(line)
+                        except ValueError:
+                            torn = True
+                            break
+                        self._apply(entry)
+                        self._journal_entries += 1
+                        good_offset += len(line)
+                        if not line.endswith(b"\n"):
+                            # Complete but for the newline, the next append would run into it
+                            torn = True
+                if torn:
+                    # A torn final write from a crash, everything before it is still valid. Cut it off, or the next
+                    # append would be written onto the end of it and lost along with it.
+                    logger.warning("Repairing incomplete final entry in list journal")
+                    with open(self._journal_path, "r+b") as journal_file:
+                        journal_file.truncate(good_offset)
+                        if good_offset and not self._ends_with_newline(journal_file, good_offset):
+                            journal_file.seek(good_offset)
+                            journal_file.write(b"\n")
+                        journal_file.flush()
+                        os.fsync(journal_file.fileno())
+            except OSError as e:
+                logger.error("Failed to read list journal: {0}".format(e))
+            if self._journal_entries:
+                logger.info("Recovered {0} list changes from journal".format(self._journal_entries))
+
+    @staticmethod
+    def _ends_with_newline(journal_file, size: int) -> bool:
+        journal_file.seek(size - 1)
+        return journal_file.read(1) == b"\n"
+
+    def _apply(self, entry: dict) -> bool:
+        """
+        Applies a journal entry to the in-memory lists
+        :param entry: The journal entry, with op, list, hash and optionally data
+        :return: True if the entry changed the lists, false if otherwise
+        """
+        target = self._lists.get(entry.get("list"))
+        if target is None:
+            return False
+        hash_val = entry.get("hash")
+        if entry.get("op") == "add":
+            if hash_val in target:
+                return False
+            target[hash_val] = entry.get("data")
+            return True
+        elif entry.get("op") == "remove":
+            if hash_val not in target:
+                return False
+            del target[hash_val]
+            return True
+        return False
+
+    def _append_journal(self, entry: dict) -> None:
+        """
+        Appends an entry to the journal and flushes it to disk. Must be called with the lock held.
+        :param entry: The journal entry
+        :return: Nothing
+        """
+        try:
+            if self._journal_file is None:
+                directory = os.path.dirname(self._journal_path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                self._journal_file = open(self._journal_path, "a")
+            self._journal_file.write(serialize.dumps(entry) + "\n")
+            self._journal_file.flush()
+            os.fsync(self._journal_file.fileno())
+            self._journal_entries += 1
+        except OSError as e:
+            logger.error("Failed to write list journal {0}: {1}".format(self._journal_path, e))
+            return
+        if self._journal_entries >= self._compact_threshold:
+            self.compact()
+
+    def _change(self, op: str, list_name: str, hash_val: str, data=None) -> bool:
+        """
+        Applies and journals a change
+        :param op: "add" or "remove"
+        :param list_name: The list to change
+        :param hash_val: The hash value of the entry
+        :param data: The housing data of the entry, for adds
+        :return: True if the list changed, false if otherwise
+        """
+        entry = {"op": op, "list": list_name, "hash": hash_val}
+        if op == "add":
+            entry["data"] = data
+        with self._lock:
+            if not self._apply(entry):
+                return False
+            self._append_journal(entry)
+            return True
+
+    def add(self, list_name: str, hash_val: str, data) -> bool:
+        """
+        Adds an entry to a list
+        :param list_name: The list to add to
+        :param hash_val: The hash value of the entry
+        :param data: The housing data of the entry
+        :return: True if successfully added, false if it was already present
+        """
+        return self._change("add", list_name, hash_val, data)
+
+    def remove(self, list_name: str, hash_val: str) -> bool:
+        """
+        Removes an entry from a list
+        :param list_name: The list to remove from
+        :param hash_val: The hash value of the entry
+        :return: True if successfully removed, false if it was not present
+        """
+        return self._change("remove", list_name, hash_val)
+
+    def get(self, list_name: str) -> dict:
+        """
+        Gets a copy of a list
+        :param list_name: The list to get
+        :return: Dict of hash value to housing data
+        """
+        with self._lock:
+            return dict(self._lists[list_name])
+
+    def count(self, list_name: str) -> int:
+        """
+        Gets the number of entries in a list
+        :param list_name: The list to count
+        :return: Number of entries
+        """
+        with self._lock:
+            return len(self._lists[list_name])
+
+    def contains(self, list_name: str, hash_val: str) -> bool:
+        """
+        Checks if an entry is in a list
+        :param list_name: The list to check
+        :param hash_val: The hash value of the entry
+        :return: True if present, false if otherwise
+        """
+        with self._lock:
+            return hash_val in self._lists[list_name]
+
+    def compact(self) -> None:
+        """
+        Writes a new snapshot of the lists and truncates the journal. The snapshot is written to a temporary file and
+        swapped in, so a crash during compaction leaves either the old or the new snapshot intact.
+        :return: Nothing
+        """
+        with self._lock:
+            temp_path = self._snapshot_path + ".tmp"
+            try:
+                with open(temp_path, "wb") as list_file:
+                    list_file.write(serialize.dumpb(self._lists))
+                    list_file.flush()
+                    os.fsync(list_file.fileno())
+                os.replace(temp_path, self._snapshot_path)
+            except OSError as e:
+                logger.error("Failed to save lists to file {0}: {1}".format(self._snapshot_path, e))
+                return
+            if self._journal_file is not None:
+                self._journal_file.close()
+                self._journal_file = None
+            try:
+                if os.path.isfile(self._journal_path):
+                    os.remove(self._journal_path)
+            except OSError as e:
+                logger.error("Failed to truncate list journal {0}: {1}".format(self._journal_path, e))
+            logger.debug("Compacted {0} list journal entries".format(self._journal_entries))
+            self._journal_entries = 0
+
+    def close(self) -> None:
+        """
+        Compacts the journal and releases the journal file
+        :return: Nothing
+        """
+        self.compact()
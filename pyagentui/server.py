@@ -0,0 +1,351 @@
+"""
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import mimetypes
+import inspect
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from urllib.parse import urlsplit, parse_qs, unquote
+from pyagent import serialize
+from .api import WebAPI
+
+logger = logging.getLogger(__name__)
+
+WEB_ROOT = "web"
+# Maximum number of API responses kept in the response cache
+RESPONSE_CACHE_SIZE = 512
+# Responses smaller than this are not worth compressing
+GZIP_MIN_SIZE = 512
+MAX_REQUEST_BODY = 16 * 1024 * 1024
+
+# WebAPI methods that only read data, served over GET and cached
+READ_METHODS = {"has_data", "get_entry_count", "get_page", "get_entries", "get_sorted_page", "get_filter_choices",
+                "get_criteria", "score_weights", "get_market_stats", "get_favorites", "get_rejections",
+                "get_favorites_count", "get_rejections_count"}
+# Read methods whose results depend on the favorites and rejections lists
+LIST_METHODS = {"get_favorites", "get_rejections", "get_favorites_count", "get_rejections_count"}
+# WebAPI methods that change the lists, served over POST
+WRITE_METHODS = {"add_to_favorites", "add_to_rejections", "remove_from_favorites", "remove_from_rejections"}
+
+# Served in place of a static file, tells the frontend to talk to the HTTP API instead of pywebview
+SERVER_CONFIG_SCRIPT = b"window.PYAGENT_HTTP_API = true;\n"
+
+STATUS_TEXT = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class BadArguments(Exception):
+    """
+    Raised when the arguments of an API request do not fit the method
+    """
+
+
+class CachedResponse:
+    """
+    A response body ready to send, with its compressed form and entity tag
+    """
+    __slots__ = ("body", "gzip_body", "etag", "content_type")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.gzip_body = None
+        if len(body) >= GZIP_MIN_SIZE and (content_type.startswith("text/") or "json" in content_type
+                                           or "javascript" in content_type):
+            self.gzip_body = gzip.compress(body, compresslevel=6)
+
+    def entity_tag(self, gzipped: bool) -> str:
+        """
+        Gets the entity tag of one encoding of the body, the identity and gzip bodies are different entities
+        :param gzipped: True for the gzip body
+        :return: The quoted entity tag
+        """
+        if gzipped:
+            return '"{0}-gzip"'.format(self.etag)
+        return '"{0}"'.format(self.etag)
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Checks whether an Accept-Encoding header allows a gzip response
+    :param accept_encoding: The header value
+    :return: True if gzip, or the wildcard, is listed with a nonzero quality
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value.strip())
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    if "gzip" in qualities:
+        return qualities["gzip"] > 0
+    if "x-gzip" in qualities:
+        return qualities["x-gzip"] > 0
+    return qualities.get("*", 0.0) > 0
+
+
+class WebServer:
+    """
+    Asynchronous HTTP server exposing the WebAPI operations and the web frontend, for viewing results without
+    pywebview. Several clients can browse one characterization file at once.
+    """
+    def __init__(self, char_file: str, host: str = "127.0.0.1", port: int = 8080):
+        """
+        Constructor
+        :param char_file: The path to the characterization data file
+        :param host: The address to listen on
+        :param port: The port to listen on
+        """
+        self._api = WebAPI(char_file)
+        self._host = host
+        self._port = port
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._static_cache = {}
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            response = self._cache.get(key)
+            if response is not None:
+                self._cache.move_to_end(key)
+            return response
+
+    def _cache_put(self, key, response: CachedResponse) -> None:
+        with self._cache_lock:
+            self._cache[key] = response
+            self._cache.move_to_end(key)
+            while len(self._cache) > RESPONSE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def _invalidate_lists(self) -> None:
+        """
+        Drops cached responses that depend on the lists
+        :return: Nothing
+        """
+        with self._cache_lock:
+            for key in [key for key in self._cache if key[0] in LIST_METHODS]:
+                del self._cache[key]
+
+    def _call_api(self, method: str, args: list) -> CachedResponse:
+        """
+        Calls a WebAPI method and serializes the result. Runs on a worker thread.
+        :param method: The method name
+        :param args: The positional arguments
+        :return: The response
+        """
+        key = (method, serialize.dumps(args))
+        if method in READ_METHODS:
+            # Responses made before the characterization file or market statistics changed are never matched again,
+            # and fall out of the cache
+            key += (self._api.refresh(),)
+            response = self._cache_get(key)
+            if response is not None:
+                return response
+        api_method = getattr(self._api, method)
+        try:
+            inspect.signature(api_method).bind(*args)
+        except TypeError as e:
+            raise BadArguments(str(e))
+        result = api_method(*args)
+        response = CachedResponse(serialize.dumpb(result), "application/json")
+        if method in READ_METHODS:
+            self._cache_put(key, response)
+        elif method in WRITE_METHODS and result:
+            self._invalidate_lists()
+        return response
+
+    def _static_file(self, path: str):
+        """
+        Loads a static file from the web root
+        :param path: The request path
+        :return: The response, or None if the file does not exist
+        """
+        if path == "/":
+            path = "/index.html"
+        if path == "/js/server_config.js":
+            return CachedResponse(SERVER_CONFIG_SCRIPT, "application/javascript")
+        file_path = os.path.normpath(os.path.join(WEB_ROOT, unquote(path).lstrip("/")))
+        if not file_path.startswith(os.path.normpath(WEB_ROOT) + os.sep) or not os.path.isfile(file_path):
+            return None
+        mtime = os.path.getmtime(file_path)
+        cached = self._static_cache.get(file_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        with open(file_path, "rb") as static_file:
+            response = CachedResponse(static_file.read(), content_type)
+        self._static_cache[file_path] = (mtime, response)
+        return response
+
+    @staticmethod
+    async def _write_response(writer, status: int, response: CachedResponse = None, headers: dict = None,
+                              use_gzip: bool = False, keep_alive: bool = True, head_only: bool = False) -> None:
+        body = b""
+        out_headers = {"Date": formatdate(usegmt=True), "Server": "PyAgent",
+                       "Connection": "keep-alive" if keep_alive else "close"}
+        if response is not None:
+            out_headers["Content-Type"] = response.content_type
+            out_headers["ETag"] = response.entity_tag(use_gzip)
+            out_headers["Cache-Control"] = "no-cache"
+            if response.gzip_body is not None:
+                out_headers["Vary"] = "Accept-Encoding"
+            if status == 200:
+                body = response.body
+                if use_gzip:
+                    body = response.gzip_body
+                    out_headers["Content-Encoding"] = "gzip"
+        if headers:
+            out_headers.update(headers)
+        out_headers["Content-Length"] = str(len(body))
+        head = "HTTP/1.1 {0} {1}\r\n".format(status, STATUS_TEXT.get(status, ""))
+        head += "".join("{0}: {1}\r\n".format(name, value) for name, value in out_headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n")
+        if not head_only and status != 304:
+            writer.write(body)
+        await writer.drain()
+
+    async def _handle_request(self, method: str, target: str, headers: dict, body: bytes):
+        """
+        Routes a request
+        :return: (status, response, extra headers)
+        """
+        url = urlsplit(target)
+        if url.path.startswith("/api/"):
+            api_method = url.path[len("/api/"):]
+            if api_method in READ_METHODS:
+                if method not in ("GET", "HEAD"):
+                    return 405, None, {"Allow": "GET, HEAD"}
+                raw_args = parse_qs(url.query).get("args", ["[]"])[0]
+            elif api_method in WRITE_METHODS:
+                if method != "POST":
+                    return 405, None, {"Allow": "POST"}
+                try:
+                    raw_args = body.decode() if body else "[]"
+                except UnicodeDecodeError:
+                    return 400, None, None
+            else:
+                return 404, None, None
+            try:
+                args = serialize.loads(raw_args)
+            except ValueError:
+                return 400, None, None
+            if not isinstance(args, list):
+                return 400, None, None
+            loop = asyncio.get_running_loop()
+            try:
+                response = await loop.run_in_executor(None, self._call_api, api_method, args)
+            except BadArguments as e:
+                logger.warning("Bad arguments for {0}: {1}".format(api_method, e))
+                return 400, None, None
+            return 200, response, None
+
+        if method not in ("GET", "HEAD"):
+            return 405, None, {"Allow": "GET, HEAD"}
+        response = self._static_file(url.path)
+        if response is None:
+            return 404, None, None
+        return 200, response, None
+
+    async def _handle_connection(self, reader, writer) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await WebServer._write_response(writer, 400, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                body = b""
+                try:
+                    content_length = int(headers.get("content-length", "0") or 0)
+                except ValueError:
+                    content_length = -1
+                if content_length < 0:
+                    await WebServer._write_response(writer, 400, keep_alive=False)
+                    break
+                if content_length > MAX_REQUEST_BODY:
+                    await WebServer._write_response(writer, 413, keep_alive=False)
+                    break
+                if content_length:
+                    body = await reader.readexactly(content_length)
+
+                try:
+                    status, response, extra_headers = await self._handle_request(method, target, headers, body)
+                except Exception as e:
+                    logger.error("Error handling {0} {1}: {2}".format(method, target, e))
+                    status, response, extra_headers = 500, None, None
+                use_gzip = response is not None and response.gzip_body is not None and \
+                    accepts_gzip(headers.get("accept-encoding", ""))
+                if status == 200 and response is not None:
+                    # Conditional GET, the client already has this version in the encoding it would be sent
+                    if_none_match = headers.get("if-none-match")
+                    if if_none_match and (if_none_match.strip() == "*" or response.entity_tag(use_gzip) in
+                                          [tag.strip() for tag in if_none_match.split(",")]):
+                        status = 304
+                await WebServer._write_response(writer, status, response, extra_headers, use_gzip, keep_alive,
+                                                head_only=method == "HEAD")
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self) -> None:
+        server = await asyncio.start_server(self._handle_connection, self._host, self._port)
+        logger.info("Serving PyAgent on http://{0}:{1}/".format(self._host, self._port))
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self) -> None:
+        """
+        Runs the server until interrupted
+        :return: Nothing
+        """
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            logger.info("Stopping server...")
+        finally:
+            self._api.save_lists()
@@ -0,0 +1,65 @@
+/*
+    PyAgent - Python program for aggregating housing info
+    Copyright (C) 2021 Timothy Volpe
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+*/
+
+// When served by `pyagent --serve`, stands in for the pywebview bridge and calls the Python API over HTTP instead.
+// Under pywebview, server_config.js does not exist and this does nothing.
+
+const HTTP_WRITE_METHODS = ["add_to_favorites", "add_to_rejections", "remove_from_favorites", "remove_from_rejections"];
+
+function http_api_call(method, args) {
+    var request;
+    if(HTTP_WRITE_METHODS.includes(method)) {
+        request = fetch("api/" + method, {
+            method: "POST",
+            headers: {"Content-Type": "application/json"},
+            body: JSON.stringify(args)
+        });
+    }
+    else {
+        request = fetch("api/" + method + "?args=" + encodeURIComponent(JSON.stringify(args)));
+    }
+    return request.then(function(response) {
+        if(!response.ok)
+            throw {message: "API call " + method + " failed with status " + response.status};
+        return response.json();
+    });
+}
+
+const http_api = new Proxy({}, {
+    get: function(target, method) {
+        if(method == "ready") {
+            // There is no window for Python to call back into, so ask whether there is data and load it ourselves
+            return function() {
+                return http_api_call("has_data", []).then(function(char_avail) {
+                    load_json(char_avail);
+                    return true;
+                });
+            };
+        }
+        return function(...args) {
+            return http_api_call(method, args);
+        };
+    }
+});
+
+window.addEventListener("load", function() {
+    if(window.PYAGENT_HTTP_API) {
+        window.pywebview = {api: http_api};
+        window.dispatchEvent(new Event("pywebviewready"));
+    }
+});
@@ -17,13 +17,25 @@
 */
 
 const DATA_FILE = "data/scraped_data.json"
-const CHAR_FILE = "data/characterization.json"
-
-let loaded_char_data = null;
+// Entries requested and rendered per page of the All Data table
+const CHAR_PAGE_SIZE = 100
+// Rows rendered per page of a sorted table
+const SORT_PAGE_SIZE = 100
+// Criterion weights from the sliders, passed with every request that returns scores. Null for the stored scores.
+let current_weights = null;
+
+// Entries requested so far, the All Data table only requests the pages that are viewed
+let loaded_char_data = {};
 let removed_char_data = {};
 let orphaned_char_data = {};
+let total_entries = 0;
 
 const TableType = Object.freeze({"TableAll": 1, "TableFavorites": 2, "TableRejections": 3})
+let current_table_type = TableType.TableAll;
+// How the All Data table is paged in: in file order, or by a server-side sort index. Null source for every source.
+let all_view = {"source": null, "sort_key": null, "descending": false};
+// Changes whenever the table is filled again, so pages requested for the previous table are dropped
+let view_generation = 0;
 
 function sleep(ms) {
   return new Promise(resolve => setTimeout(resolve, ms));
@@ -80,18 +92,20 @@ function addToList(is_fav, hash, row, data, is_back_to_old=false)
             pywebview.api.remove_from_rejections(hash);
         }
 
-        var new_row = create_table_row(hash, data.char_output, data.housing_data);
+        var new_row = $(create_table_row(hash, data.char_output, data.housing_data));
         loaded_char_data[hash] = data;
         delete removed_char_data[hash];
         $(row).replaceWith(new_row);
-        setupRowButtons();
+        setupRowButtons(new_row);
         update_list_counts();
     });
     $(row).replaceWith(row_element);
 }
 
-function setupRowButtons() {
-    $(".fav-button, .rej-button, .remove-button").click(function() {
+function setupRowButtons(rows=null) {
+    // Rows added to a table that already has rows pass only themselves, so older rows are not bound twice
+    var buttons = rows ? $(rows).find(".fav-button, .rej-button, .remove-button") : $(".fav-button, .rej-button, .remove-button");
+    buttons.click(function() {
         var is_fav = $(this).hasClass("fav-button");
         var is_remove = $(this).hasClass("remove-button");
         var row = $(this).closest("tr");
@@ -172,12 +186,36 @@ function removeUndoRows(table) {
     });
 }
 
-function populate_table(data, table_type, do_source_list=false) {
+function passes_filters(housing) {
+    if(filter_lists["city-filters"].length == 0 && filter_lists["suburb-filters"].length == 0 && filter_lists["neighborhood-filters"].length == 0)
+        return true;
+    if(filter_lists["neighborhood-filters"].length > 0) {
+        if(filter_lists["neighborhood-filters"].indexOf(housing["neighborhood"]) != -1)
+            return true;
+    }
+    if(filter_lists["suburb-filters"].length > 0) {
+        if(filter_lists["suburb-filters"].indexOf(housing["suburb"]) != -1)
+            return true;
+    }
+    if(filter_lists["city-filters"].length > 0) {
+        if(filter_lists["city-filters"].indexOf(housing["city"]) != -1)
+            return true;
+    }
+    return false;
+}
+
+function clear_table(table_type) {
+    view_generation++;
+    current_table_type = table_type;
     $("#address-table").hide();
     $("tbody#address-table-body").empty();
+    $("#address-table").removeData("pending-rows");
+}
+
+function populate_table(data, table_type, show=true) {
+    clear_table(table_type);
     var char_data;
     var housing;
-    var source_list = [];
     var orphaned = false;
     for (const [k, value] of Object.entries(data))
     {
@@ -185,33 +223,16 @@ function populate_table(data, table_type, do_source_list=false) {
         housing = value.housing_data;
 
         // Check against filters
-        var passedFilters = false;
-        if(filter_lists["city-filters"].length == 0 && filter_lists["suburb-filters"].length == 0 && filter_lists["neighborhood-filters"].length == 0)
-            passedFilters = true;
-        else {
-            if(filter_lists["neighborhood-filters"].length > 0) {
-                if(filter_lists["neighborhood-filters"].indexOf(housing["neighborhood"]) != -1)
-                    passedFilters = true;
-            }
-            if(filter_lists["suburb-filters"].length > 0) {
-                if(filter_lists["suburb-filters"].indexOf(housing["suburb"]) != -1)
-                    passedFilters = true;
-            }
-            if(filter_lists["city-filters"].length > 0) {
-                if(filter_lists["city-filters"].indexOf(housing["city"]) != -1)
-                    passedFilters = true;
-            }
-        }
-
-        if(!passedFilters)
+        if(!passes_filters(housing))
             continue;
+        // The lists keep the score an entry had when it was added, show the score under the current weights
+        if(char_data && k in removed_char_data)
+            char_data = Object.assign({}, char_data, {"score": removed_char_data[k].char_output["score"]});
 
         if(k in orphaned_char_data)
             orphaned = true;
         else
             orphaned = false;
-        if(!source_list.includes(housing["source"]))
-            source_list.push(housing["source"]);
         if( char_data )
             $("tbody#address-table-body").append(create_table_row(k, char_data, housing, table_type, orphaned));
         else
@@ -225,68 +246,197 @@ function populate_table(data, table_type, do_source_list=false) {
             </tr>
         `);
     }
-    if(do_source_list)
-    {
-        if($("#source-column > li").length == 0) {
-            source_list.forEach(function(element) {
-                const list_item = `
-                    <li class="nav-item">
-                        <a class="nav-link source-link" href="#">
-                            <span class="badge badge-pill bg-primary text-light list-counter">0</span> ${element}
-                        </a>
-                    </li>
-                `;
-                $("#source-column").append(list_item);
-            });
+    if(show)
+        $("#address-table").show();
+}
 
-            $("a.source-link").click(function() {
-                var source = $(this).text();
-                clearListActive();
-                $(this).addClass("active");
-                $(this).append("<span class='current-tag'>(current)</span>");
-                console.log("Switching to " + source);
-                combined_source_data = {};
-                for (const [k, value] of Object.entries(loaded_char_data))
-                {
-                    data_source = value.housing_data["source"];
-                    if(data_source == source)
-                        combined_source_data[k] = value;
-                }
-                populate_table(combined_source_data, TableType.TableAll);
-                setupRowButtons();
-            });
+function build_source_list(sources) {
+    if($("#source-column > li").length != 0)
+        return;
+    sources.forEach(function(element) {
+        const list_item = `
+            <li class="nav-item">
+                <a class="nav-link source-link" href="#" source="${element}">
+                    <span class="badge badge-pill bg-primary text-light list-counter">0</span> ${element}
+                </a>
+            </li>
+        `;
+        $("#source-column").append(list_item);
+    });
+
+    $("a.source-link").click(function() {
+        var source = $(this).attr("source");
+        clearListActive();
+        $(this).addClass("active");
+        $(this).append("<span class='current-tag'>(current)</span>");
+        console.log("Switching to " + source);
+        all_view["source"] = source;
+        render_all_view();
+    });
+}
+
+function render_all_view(show=true) {
+    clear_table(TableType.TableAll);
+    if(show)
+        $("#address-table").show();
+    if(all_view["sort_key"])
+        load_all_sorted_page(view_generation, 0);
+    else
+        load_all_page(view_generation, 0);
+}
+
+function load_all_page(generation, offset) {
+    pywebview.api.get_page(offset, CHAR_PAGE_SIZE, current_weights).then(function(response) {
+        if(generation != view_generation)
+            return;
+        Object.assign(loaded_char_data, response);
+        var hashes = Object.keys(response);
+        append_all_rows(hashes, hashes.length == CHAR_PAGE_SIZE, function() {
+            load_all_page(generation, offset + CHAR_PAGE_SIZE);
+        });
+    }).catch(showResponse);
+}
+
+function load_all_sorted_page(generation, offset) {
+    pywebview.api.get_sorted_page(all_view["sort_key"], all_view["descending"], offset, CHAR_PAGE_SIZE, current_weights).then(function(hashes) {
+        if(generation != view_generation)
+            return;
+        var load_more = function() {
+            load_all_sorted_page(generation, offset + CHAR_PAGE_SIZE);
+        };
+        // Only the entries of this page that have not been requested yet are decoded
+        var missing = hashes.filter(hash => !(hash in loaded_char_data) && !(hash in removed_char_data));
+        if(missing.length == 0) {
+            append_all_rows(hashes, hashes.length == CHAR_PAGE_SIZE, load_more);
+            return;
         }
+        pywebview.api.get_entries(missing, current_weights).then(function(response) {
+            if(generation != view_generation)
+                return;
+            Object.assign(loaded_char_data, response);
+            append_all_rows(hashes, hashes.length == CHAR_PAGE_SIZE, load_more);
+        }).catch(showResponse);
+    }).catch(showResponse);
+}
+
+function append_all_rows(hashes, has_more, load_more) {
+    var tbody = $("tbody#address-table-body");
+    tbody.find("tr.more-rows").remove();
+    var rows = [];
+    for (const hash of hashes) {
+        // Favorites and rejections are not in the All Data table
+        if(!(hash in loaded_char_data) || hash in removed_char_data)
+            continue;
+        var housing = loaded_char_data[hash].housing_data;
+        if(!passes_filters(housing) || (all_view["source"] && housing["source"] != all_view["source"]))
+            continue;
+        rows.push($(create_table_row(hash, loaded_char_data[hash].char_output, housing))[0]);
+    }
+    tbody.append(rows);
+    setupRowButtons(rows);
+    if(has_more) {
+        // A filtered table may have no rows in this page, keep going until one does
+        if(rows.length == 0) {
+            load_more();
+            return;
+        }
+        var more_row = $(`
+            <tr class="more-rows">
+                <td colspan="10"><button type="button" class="btn btn-link btn-sm">Show more</button></td>
+            </tr>
+        `);
+        more_row.find("button").click(load_more);
+        tbody.append(more_row);
+    }
+    else if(tbody.children().length == 0) {
+        console.log("No data");
+        tbody.append(`
+            <tr>
+                <td colspan="10"><p class="text-center">No data to display.</p></td>
+            </tr>
+        `);
     }
-    $("#address-table").show();
+}
+
+function load_sorted_page(table, sort_key, descending, rows_by_hash, offset) {
+    pywebview.api.get_sorted_page(sort_key, descending, offset, SORT_PAGE_SIZE, current_weights).then(function(response) {
+        var page_items = [];
+        for (const hash of response) {
+            if(hash in rows_by_hash) {
+                page_items.push(rows_by_hash[hash]);
+                delete rows_by_hash[hash];
+            }
+        }
+        var has_more = response.length == SORT_PAGE_SIZE;
+        // Rows missing from the characterization data (orphans) go at the end
+        if(!has_more) {
+            for (const item of Object.values(rows_by_hash))
+                page_items.push(item);
+        }
+        var tbody = $(table).find("tbody");
+        tbody.find("tr.more-rows").remove();
+        tbody.append($(page_items));
+        if(!has_more) {
+            $(table).removeData("pending-rows");
+            return;
+        }
+        $(table).data("pending-rows", rows_by_hash);
+        // A filtered table may have no rows in this page of the index, keep going until one does
+        if(page_items.length == 0) {
+            load_sorted_page(table, sort_key, descending, rows_by_hash, offset + SORT_PAGE_SIZE);
+            return;
+        }
+        var more_row = $(`
+            <tr class="more-rows">
+                <td colspan="10"><button type="button" class="btn btn-link btn-sm">Show more</button></td>
+            </tr>
+        `);
+        more_row.find("button").click(function() {
+            load_sorted_page(table, sort_key, descending, rows_by_hash, offset + SORT_PAGE_SIZE);
+        });
+        tbody.append(more_row);
+    }).catch(showResponse);
 }
 
 function switch_to_all() {
-    populate_table(loaded_char_data, TableType.TableAll, true);
+    // The sort is kept, so coming back from the weight sliders shows the table ranked by the new weights
+    all_view["source"] = null;
+    render_all_view();
     update_list_counts();
-    setupRowButtons();
 }
 
-function switch_to_favorites() {
+function switch_to_favorites(show=true) {
     // Get favorites data
     pywebview.api.get_favorites().then(function(response) {
         if(response) {
-            populate_table(response, TableType.TableFavorites);
+            populate_table(response, TableType.TableFavorites, show);
             update_list_counts();
             setupRowButtons();
         }
     }).catch(showResponse);
 }
-function switch_to_rejections() {
+function switch_to_rejections(show=true) {
     // Get favorites data
     pywebview.api.get_rejections().then(function(response) {
         if(response) {
-            populate_table(response, TableType.TableRejections);
+            populate_table(response, TableType.TableRejections, show);
             update_list_counts();
             setupRowButtons();
         }
     }).catch(showResponse);
 }
 
+function redraw_table() {
+    // Filled again in the same view and order, and left hidden if it is, so it shows the rows ranked by the new weights
+    var show = $("#address-table").is(":visible");
+    if(current_table_type == TableType.TableFavorites)
+        switch_to_favorites(show);
+    else if(current_table_type == TableType.TableRejections)
+        switch_to_rejections(show);
+    else
+        render_all_view(show);
+}
+
 window.addEventListener('pywebviewready', () => {
     pywebview.api.ready().then(function(response) {
         if(!response)
@@ -311,9 +461,47 @@ window.addEventListener('pywebviewready', () => {
             }
             sortSelectOptions($("#city-filters > select > option"));
         });
+        // Add weight sliders, files characterized without per-criterion scores have no criteria
+        pywebview.api.get_criteria().then(function(response) {
+            if(!response || response.length == 0) {
+                $("#weight-options").hide();
+                return;
+            }
+            for (var i = 0; i < response.length; i++) {
+                var weight = response[i]["weight"];
+                $("#weight-options > .weights").append(`
+                    <div class="weight-option">
+                        <label>${response[i]["name"]} <span class="weight-value">${weight}</span></label>
+                        <input type="range" class="custom-range" min="0" max="${Math.max(weight * 2, 100)}" value="${weight}"/>
+                    </div>`);
+            }
+            $("#weight-options input[type=range]").on("input", function() {
+                $(this).closest(".weight-option").find(".weight-value").text($(this).val());
+            });
+            $("#weight-options input[type=range]").on("change", update_weights);
+        });
     }).catch(showResponse);
 });
 
+function update_weights() {
+    var weights = $("#weight-options input[type=range]").toArray().map(function(slider) {
+        return parseFloat($(slider).val());
+    });
+    pywebview.api.score_weights(weights).then(function(response) {
+        if(!response || Object.keys(response).length == 0)
+            return;
+        current_weights = weights;
+        for (const [hash, score] of Object.entries(response)) {
+            if(hash in loaded_char_data)
+                loaded_char_data[hash]["char_output"]["score"] = score;
+            else if(hash in removed_char_data)
+                removed_char_data[hash]["char_output"]["score"] = score;
+        }
+        // Sorted pages are requested again with the new weights, so a table sorted by score is ranked again
+        redraw_table();
+    }).catch(showResponse);
+}
+
 let filter_lists = {
     "neighborhood-filters": [],
     "suburb-filters": [],
@@ -328,10 +516,33 @@ window.onload = function(e) {
 
     $("#address-table > thead > tr > th.sortable-col > a").click(function() {
         let sort_column_idx = $("#address-table > thead > tr > th.sortable-col").toArray().indexOf($(this).parent()[0]);
+        let sort_key = $(this).parent().attr("sort-key");
         table = $(this).closest("table");
         removeUndoRows(table);
-        items = $(table).find("tbody > tr").toArray();
         desc = $(table).prop("desc");
+        // The All Data table is paged in again in the order of the server-side sort index
+        if(sort_key && current_table_type == TableType.TableAll) {
+            all_view["sort_key"] = sort_key;
+            all_view["descending"] = desc == true;
+            $(table).prop("desc", desc != true);
+            render_all_view();
+            return;
+        }
+        // Rows not yet shown by a paged sort are sorted along with the visible ones
+        var more_rows = $(table).find("tbody > tr.more-rows").detach();
+        items = $(table).find("tbody > tr").toArray().concat(Object.values($(table).data("pending-rows") || {}));
+        $(table).removeData("pending-rows");
+        // Columns with a server-side sort index are ordered by hash lookup instead of parsing cells
+        if(sort_key) {
+            // Detached rows keep their button handlers, and are only put back a page at a time
+            var rows_by_hash = {};
+            $(items).detach().each(function() {
+                rows_by_hash[$(this).attr("hash")] = this;
+            });
+            $(table).prop("desc", desc != true);
+            load_sorted_page(table, sort_key, desc == true, rows_by_hash, 0);
+            return;
+        }
         is_money = $(this).parent().hasClass("sort-money");
         is_int = $(this).parent().hasClass("sort-float");
         // Sort remaining rows
@@ -366,6 +577,9 @@ window.onload = function(e) {
             $(table).prop("desc", true);
             $(table).find("tbody").html($(items));
         }
+        // Only the loaded rows of the All Data table are sorted, the rest can still be paged in
+        if(current_table_type == TableType.TableAll)
+            $(table).find("tbody").append(more_rows);
         setupRowButtons();
     });
 
@@ -442,7 +656,7 @@ function clearListActive()
 
 function update_list_counts()
 {
-    $("#all-data-link > .list-counter").text(Object.keys(loaded_char_data).length);
+    $("#all-data-link > .list-counter").text(total_entries - Object.keys(removed_char_data).length);
     pywebview.api.get_favorites_count().then(function(response) {
         $("#favorites-link > .list-counter").text(response);
     }).catch(showResponse);
@@ -551,45 +765,35 @@ function create_table_row(hash, char_data, housing, table_type=TableType.TableAl
     return table_row;
 }
 
-function finished_json_load(char_json)
-{
-    loaded_char_data = char_json
-    // Remove favorites and rejections
-    pywebview.api.get_favorites().then(function(response) {
-        if(response) {
-            for (const [key, value] of Object.entries(response)) {
-                if(key in loaded_char_data) {
-                    removed_char_data[key] = loaded_char_data[key]
-                    delete loaded_char_data[key];
-                }
-                else {
-                    orphaned_char_data[key] = value;
-                }
-            }
-        }
-        switch_to_all();
-    }).catch(showResponse);
-    pywebview.api.get_rejections().then(function(response) {
-        if(response) {
-            for (const [key, value] of Object.entries(response)) {
-                if(key in loaded_char_data) {
-                    removed_char_data[key] = loaded_char_data[key]
-                    delete loaded_char_data[key];
-                }
-                else {
-                    orphaned_char_data[key] = value;
-                }
-            }
-        }
-        switch_to_all();
-    }).catch(showResponse);
+function get_entries_paged(hashes) {
+    // A page at a time, so the hashes fit in the URL of a GET request to the HTTP API
+    var requests = [];
+    for (var i = 0; i < hashes.length; i += CHAR_PAGE_SIZE)
+        requests.push(pywebview.api.get_entries(hashes.slice(i, i + CHAR_PAGE_SIZE), current_weights));
+    return Promise.all(requests).then(function(responses) {
+        return Object.assign({}, ...responses);
+    });
 }
 
 function load_json(char_avail=true) {
-    if(char_avail) {
-        $.getJSON(CHAR_FILE, finished_json_load);
-    }
-    else {
+    if(!char_avail) {
         postErrorAlert("There was no housing data! Run `pyagent.py -s` to scrape housing data.")
+        return;
     }
-}
\ No newline at end of file
+    // Only the favorites and rejections are requested up front, the table pages in the rest as it is viewed
+    Promise.all([pywebview.api.get_entry_count(), pywebview.api.get_favorites(), pywebview.api.get_rejections(),
+                 pywebview.api.get_filter_choices("source")]).then(function(responses) {
+        total_entries = responses[0];
+        var list_entries = Object.assign({}, responses[1] || {}, responses[2] || {});
+        build_source_list(responses[3] || []);
+        return get_entries_paged(Object.keys(list_entries)).then(function(response) {
+            for (const [key, value] of Object.entries(list_entries)) {
+                if(key in response)
+                    removed_char_data[key] = response[key];
+                else
+                    orphaned_char_data[key] = value;
+            }
+            switch_to_all();
+        });
+    }).catch(showResponse);
+}